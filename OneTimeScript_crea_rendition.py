@@ -0,0 +1,42 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from renditions import RENDITION_SIZES, create_renditions
+
+CARTELLE = ["Immagini Generate", "Immagini Baseline"]
+ESTENSIONI = (".jpg", ".jpeg", ".png", ".webp")
+WORKERS = os.cpu_count() or 4
+
+def crea_rendition(path):
+    try:
+        renditions = create_renditions(path)
+        return path, os.path.getsize(path), {kind: os.path.getsize(p) for kind, p in renditions.items()}, None
+    except Exception as e:
+        return path, 0, {}, str(e)
+
+def crea_rendition_esistenti():
+    # Crea UNA volta le rendition delle immagini già presenti (le nuove le crea main.py)
+    immagini = [path.as_posix() for cartella in CARTELLE if Path(cartella).is_dir()
+                for path in sorted(Path(cartella).rglob("*")) if path.suffix.lower() in ESTENSIONI]
+
+    originali = 0
+    totali = {kind: 0 for kind in RENDITION_SIZES}
+    errori = 0
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        for path, dimensione, dimensioni, errore in pool.map(crea_rendition, immagini):
+            if errore:
+                print(f"Errore su {path}: {errore}")
+                errori += 1
+                continue
+            originali += dimensione
+            for kind, size in dimensioni.items():
+                totali[kind] += size
+
+    print(f"Rendition create per {len(immagini) - errori} immagini ({errori} errori)")
+    print(f"Originali: {originali / 1024 ** 2:.1f} MB")
+    for kind, size in totali.items():
+        print(f"{kind}: {size / 1024 ** 2:.1f} MB ({size / originali:.1%} degli originali)" if originali else kind)
+
+if __name__ == "__main__":
+    crea_rendition_esistenti()
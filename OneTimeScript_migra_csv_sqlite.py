@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from database import DATABASE_PATH, CSV_TABLES, connect, create_tables
+from bulk_loader import bulk_load_csv, format_stats
+
+CSV_FOLDER = Path(".")
+
+def migra_csv_sqlite():
+    # Importa UNA volta i CSV esistenti nel database usato da main.py con STORAGE_BACKEND = "sqlite"
+    conn = connect(DATABASE_PATH)
+    conn.isolation_level = None  # transazioni (una per blocco) gestite dal bulk loader
+    try:
+        create_tables(conn.cursor())
+
+        for table, filename, int_columns in CSV_TABLES:
+            if not (CSV_FOLDER / filename).exists():
+                print(f"File {filename} non trovato, salto la tabella {table}")
+                continue
+            stats = bulk_load_csv(conn, table, CSV_FOLDER / filename, int_columns, offline=True)
+            print(format_stats(table, stats))
+
+        print(f"Migrazione completata in {DATABASE_PATH}")
+
+    except Exception as e:
+        print(f"Errore durante la migrazione: {str(e)}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migra_csv_sqlite()
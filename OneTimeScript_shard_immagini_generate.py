@@ -0,0 +1,32 @@
+import csv
+import os
+
+from image_store import IMAGE_STORE_FOLDER, ImageStore
+
+IMMAGINI_GENERATE_FILE = "immagini_generate.csv"
+
+def shard_immagini_generate():
+    # Sposta UNA volta le immagini della cartella piatta negli shard dell'archivio.
+    # I CSV non vengono riscritti: i vecchi path restano validi tramite ImageStore.resolve()
+    store = ImageStore(IMAGE_STORE_FOLDER)
+    spostate = 0
+    for entry in sorted(os.scandir(IMAGE_STORE_FOLDER), key=lambda e: e.name):
+        if entry.is_file() and entry.name.lower().endswith(store.extension):
+            store.put_file(entry.path, entry.name, move=True)
+            spostate += 1
+    stats = store.stats()
+    print(f"Immagini spostate negli shard: {spostate} "
+          f"(archivio: {stats['immagini']} immagini in {stats['file']} file)")
+
+    # Verifica: ogni path registrato deve essere ancora raggiungibile
+    if os.path.exists(IMMAGINI_GENERATE_FILE):
+        with open(IMMAGINI_GENERATE_FILE, newline="", encoding="utf-8-sig") as f:
+            paths = [row["path_immagine_generata"] for row in csv.DictReader(f)
+                     if row.get("path_immagine_generata")]
+        mancanti = [path for path in paths if store.resolve(path) is None]
+        print(f"Path in {IMMAGINI_GENERATE_FILE}: {len(paths)}, non risolti: {len(mancanti)}")
+        for path in mancanti:
+            print(f"  {path}")
+
+if __name__ == "__main__":
+    shard_immagini_generate()
@@ -0,0 +1,121 @@
+'''
+Cache in memoria dei risultati delle analisi della dashboard (tabelle, grafici, modelli).
+
+Ogni voce ha come chiave il nome dell'analisi e il checksum delle tabelle che legge:
+finché nessuna di queste tabelle cambia, un nuovo clic restituisce subito il risultato
+già calcolato, per tutte le sessioni del browser.
+
+Per non ricalcolare i checksum a ogni clic, una connessione dedicata legge
+PRAGMA data_version, che cambia solo quando un'altra connessione (app utente,
+sincronizzazione CSV) fa un commit: i checksum vengono ricalcolati solo in quel caso,
+e solo per le tabelle effettivamente richieste. Le voci sono al massimo max_entries
+(eviction LRU); i risultati di errore non vengono memorizzati.
+'''
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from database import DATABASE_PATH, connect_readonly
+
+ANALYTICS_CACHE_SIZE = 32
+CHECKSUM_CHUNK_ROWS = 10000
+
+
+def table_checksum(conn, table):
+    """Hash (blake2b) di tutte le righe della tabella, lette a blocchi."""
+    digest = hashlib.blake2b(digest_size=16)
+    cursor = conn.execute(f'SELECT * FROM "{table}"')
+    for chunk in iter(lambda: cursor.fetchmany(CHECKSUM_CHUNK_ROWS), []):
+        digest.update(repr(chunk).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cacheable(result):
+    # Risultati di errore delle analisi: grafici None, messaggi "Errore..." o tabella con colonna 'Errore'
+    items = result if isinstance(result, (tuple, list)) else [result]
+    for item in items:
+        if item is None:
+            return False
+        if isinstance(item, str) and item.startswith("Errore"):
+            return False
+        if isinstance(item, pd.DataFrame) and "Errore" in item.columns:
+            return False
+        if isinstance(item, list) and not _cacheable(item):
+            return False
+    return True
+
+
+class AnalyticsCache:
+    def __init__(self, database_path=DATABASE_PATH, max_entries=ANALYTICS_CACHE_SIZE, enabled=True):
+        self.database_path = database_path
+        self.max_entries = max_entries
+        self.enabled = enabled  # False = bypass (ogni clic ricalcola)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._checksums = {}  # tabella -> checksum, validi per self._data_version
+
+    def checksums(self, tables):
+        """Checksum delle tabelle, ricalcolati solo se il database è cambiato dall'ultima lettura."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = connect_readonly(self.database_path)
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._checksums = {}
+            for table in tables:
+                if table not in self._checksums:
+                    self._checksums[table] = table_checksum(self._conn, table)
+            return tuple(self._checksums[table] for table in tables)
+
+    def get_or_compute(self, name, tables, compute):
+        if not self.enabled:
+            return compute()
+        key = (name, self.checksums(tables))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        result = compute()
+        if _cacheable(result):
+            with self._lock:
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return result
+
+    def cached(self, *tables):
+        """Decoratore per analisi senza argomenti che leggono solo le tabelle indicate."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper():
+                return self.get_or_compute(fn.__qualname__, tables, fn)
+            return wrapper
+        return decorator
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._checksums = {}
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Contatori hit/miss e numero di voci in memoria."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,293 @@
+'''
+Modello Bradley-Terry per le risposte del questionario (Generated vs Baseline).
+
+- extract_comparisons(): estrae i confronti da un DataFrame del questionario con
+  operazioni vettoriali NumPy (niente iterrows, niente liste di tuple).
+- fit_bradley_terry(): stima dei parametri con pesi reali per confronto, senza
+  replicare le righe. Per due item esiste la forma chiusa; in generale si usa
+  l'algoritmo I-LSR, lo stesso di choix.ilsr_pairwise (stessa regolarizzazione
+  alpha, stessi risultati su dati non pesati).
+- image_ranking(): modello a molti item in cui ogni immagine baseline e ogni
+  immagine generata è un item a sé, con matrice dei confronti sparsa e
+  algoritmo MM iterativo (scala a decine di migliaia di immagini).
+
+Lanciato da solo (python bradley_terry.py) confronta tempi e risultati con la
+versione precedente (iterrows + choix).
+'''
+import numpy as np
+
+DOMANDE = [f"domanda{i}" for i in range(1, 6)]
+ITEMS = ["baseline", "generated"]  # indici usati nei confronti: 0 = baseline, 1 = generated
+BT_ALPHA = 0.01  # regolarizzazione (come alpha di choix)
+# Modello a molti item: ogni immagine gioca BT_PRIOR vittorie e BT_PRIOR sconfitte virtuali
+# contro un item di riferimento di forza 1. Rende la stima sempre definita (anche per immagini
+# che hanno solo vinto o solo perso) e confrontabile tra baseline diverse, che non vengono
+# mai confrontate direttamente.
+BT_PRIOR = 0.5
+
+
+def _answer_masks(df, questions):
+    answers = np.char.capitalize(np.char.strip(df[list(questions)].to_numpy(dtype=str)))
+    generated = answers == "Generated"
+    valid = generated | (answers == "Baseline")
+    indifferenti = int(np.count_nonzero(answers == "Indifferente"))
+    return generated, valid, indifferenti
+
+
+def extract_comparisons(df, questions=DOMANDE, weights=None):
+    """Confronti (vincitore, perdente, peso) dalle risposte del questionario.
+
+    weights: peso per riga di df (array o Series) oppure None (peso 1).
+    Restituisce (winners, losers, weights, indifferenti).
+    """
+    generated, valid, indifferenti = _answer_masks(df, questions)
+
+    winners = generated[valid].astype(np.intp)  # 1 = generated vince, 0 = baseline vince
+    losers = 1 - winners
+    row_weights = np.ones(len(df)) if weights is None else np.asarray(weights, dtype=float)
+    comparison_weights = np.broadcast_to(row_weights[:, None], generated.shape)[valid]
+    return winners, losers, comparison_weights, indifferenti
+
+
+def win_matrix(n_items, winners, losers, weights=None):
+    """Matrice W con W[i, j] = peso totale delle vittorie di i su j."""
+    weights = np.ones(len(winners)) if weights is None else np.asarray(weights, dtype=float)
+    flat = np.bincount(np.asarray(winners) * n_items + np.asarray(losers), weights=weights,
+                       minlength=n_items * n_items)
+    return flat.reshape(n_items, n_items)
+
+
+def _centered_log(strengths):
+    params = np.log(strengths)
+    return params - params.mean()
+
+
+def _stationary_distribution(generator):
+    # pi @ Q = 0 con sum(pi) = n: l'ultima equazione viene sostituita dalla normalizzazione
+    n = generator.shape[0]
+    system = generator.T.copy()
+    system[-1, :] = 1.0
+    rhs = np.zeros(n)
+    rhs[-1] = n
+    try:
+        return np.linalg.solve(system, rhs)
+    except np.linalg.LinAlgError:
+        raise ValueError("Distribuzione stazionaria non calcolabile: "
+                         "dati insufficienti (serve alpha > 0 o un grafo dei confronti connesso)")
+
+
+def ilsr(wins, alpha=BT_ALPHA, max_iter=100, tol=1e-8):
+    """I-LSR su una matrice di vittorie pesate (equivalente a choix.ilsr_pairwise)."""
+    n_items = wins.shape[0]
+    strengths = np.ones(n_items)
+    params = np.zeros(n_items)
+    for _ in range(max_iter):
+        chain = alpha + wins.T / (strengths[:, None] + strengths[None, :])
+        chain -= np.diag(chain.sum(axis=1))
+        new_params = _centered_log(_stationary_distribution(chain))
+        converged = np.linalg.norm(new_params - params, ord=1) <= tol
+        params = new_params
+        if converged:
+            return params
+        strengths = np.exp(params)
+        strengths *= n_items / strengths.sum()
+    raise RuntimeError(f"I-LSR non converge dopo {max_iter} iterazioni")
+
+
+def two_item_params(wins, alpha=BT_ALPHA):
+    """Forma chiusa per due item: lambda_1 - lambda_0 = log((2 alpha + W10) / (2 alpha + W01))."""
+    numerator = 2 * alpha + wins[1, 0]
+    denominator = 2 * alpha + wins[0, 1]
+    if numerator <= 0 or denominator <= 0:
+        raise ValueError("Stima non definita: uno dei due item non ha mai vinto (usare alpha > 0)")
+    half = 0.5 * np.log(numerator / denominator)
+    return np.array([-half, half])
+
+
+def fit_bradley_terry(n_items, winners, losers, weights=None, alpha=BT_ALPHA):
+    """Parametri BT centrati (log-forza) con pesi reali per confronto."""
+    wins = win_matrix(n_items, winners, losers, weights)
+    if n_items == 2:
+        return two_item_params(wins, alpha)
+    return ilsr(wins, alpha)
+
+
+def sparse_comparisons(n_items, winners, losers, weights=None):
+    """Vittorie per item e matrice sparsa simmetrica (CSR) del numero di confronti per coppia."""
+    from scipy import sparse
+
+    winners = np.asarray(winners, dtype=np.intp)
+    losers = np.asarray(losers, dtype=np.intp)
+    weights = np.ones(len(winners)) if weights is None else np.asarray(weights, dtype=float)
+    wins = np.bincount(winners, weights=weights, minlength=n_items)
+    # Ogni confronto conta per (i, j) e (j, i); i duplicati vengono sommati dalla conversione in CSR
+    counts = sparse.coo_matrix(
+        (np.concatenate([weights, weights]),
+         (np.concatenate([winners, losers]), np.concatenate([losers, winners]))),
+        shape=(n_items, n_items)).tocsr()
+    return wins, counts
+
+
+def fit_sparse_bradley_terry(n_items, winners, losers, weights=None, prior=BT_PRIOR,
+                             max_iter=5000, tol=1e-8):
+    """Log-forze BT di n_items item (0 = forza dell'item di riferimento) con l'algoritmo MM.
+
+    Ogni iterazione costa O(numero di coppie confrontate): la matrice non viene mai resa densa.
+    """
+    wins, counts = sparse_comparisons(n_items, winners, losers, weights)
+    coo = counts.tocoo()
+    rows, cols, pair_counts = coo.row, coo.col, coo.data
+    strengths = np.ones(n_items)
+    for _ in range(max_iter):
+        # Aggiornamento MM (Hunter, 2004) con le partite virtuali contro il riferimento
+        denominators = np.bincount(rows, weights=pair_counts / (strengths[rows] + strengths[cols]),
+                                   minlength=n_items)
+        new_strengths = (wins + prior) / (denominators + 2 * prior / (strengths + 1))
+        change = np.abs(np.log(new_strengths) - np.log(strengths)).max(initial=0.0)
+        strengths = new_strengths
+        if change <= tol:
+            return np.log(strengths)
+    raise RuntimeError(f"MM non converge dopo {max_iter} iterazioni")
+
+
+def image_ranking(df, questions=DOMANDE, weights=None, prior=BT_PRIOR):
+    """Classifica BT di tutte le immagini baseline e generate.
+
+    df: una riga per questionario con idGenerazione, id_immagine_baseline,
+    path_immagine_generata, path_immagine e le colonne delle domande.
+    Restituisce (classifica, numero di confronti, risposte indifferenti).
+    """
+    import pandas as pd
+
+    generated, valid, indifferenti = _answer_masks(df, questions)
+    baseline_codes, baseline_ids = pd.factorize(df["id_immagine_baseline"])
+    generated_codes, generated_ids = pd.factorize(df["idGenerazione"])
+    n_baselines = len(baseline_ids)
+    n_items = n_baselines + len(generated_ids)
+
+    # Item: prima le baseline, poi le immagini generate
+    rows = np.nonzero(valid)[0]
+    generated_item = n_baselines + generated_codes[rows]
+    baseline_item = baseline_codes[rows]
+    generated_wins = generated[valid]
+    winners = np.where(generated_wins, generated_item, baseline_item)
+    losers = np.where(generated_wins, baseline_item, generated_item)
+    comparison_weights = None
+    if weights is not None:
+        comparison_weights = np.broadcast_to(np.asarray(weights, dtype=float)[:, None], generated.shape)[valid]
+
+    params = fit_sparse_bradley_terry(n_items, winners, losers, comparison_weights, prior)
+    wins, counts = sparse_comparisons(n_items, winners, losers, comparison_weights)
+    comparisons_per_item = np.asarray(counts.sum(axis=1)).ravel()
+    if weights is None:
+        # Senza pesi sono conteggi interi
+        wins, comparisons_per_item = wins.astype(int), comparisons_per_item.astype(int)
+
+    first_generated = df.drop_duplicates("idGenerazione").set_index("idGenerazione")
+    first_baseline = df.drop_duplicates("id_immagine_baseline").set_index("id_immagine_baseline")
+    ranking = pd.DataFrame({
+        "Tipo": ["baseline"] * n_baselines + ["generated"] * len(generated_ids),
+        "Id": np.concatenate([baseline_ids.to_numpy(), generated_ids.to_numpy()]),
+        "Baseline": np.concatenate([baseline_ids.to_numpy(),
+                                    first_generated.loc[generated_ids, "id_immagine_baseline"].to_numpy()]),
+        "Immagine": np.concatenate([first_baseline.loc[baseline_ids, "path_immagine"].to_numpy(),
+                                    first_generated.loc[generated_ids, "path_immagine_generata"].to_numpy()]),
+        "Forza BT (λ)": np.round(params, 4),
+        "Confronti": comparisons_per_item,
+        "Vittorie": wins,
+    })
+    ranking = ranking.sort_values("Forza BT (λ)", ascending=False, kind="stable").reset_index(drop=True)
+    ranking.insert(0, "Posizione", np.arange(1, len(ranking) + 1))
+    return ranking, len(winners), indifferenti
+
+
+def win_probabilities(params):
+    """Probabilità di vittoria (softmax dei parametri)."""
+    strengths = np.exp(params - np.max(params))
+    return strengths / strengths.sum()
+
+
+def _legacy_fit(df, weights):
+    # Versione precedente della dashboard: iterrows + confronti replicati + choix
+    from choix import ilsr_pairwise
+
+    raw_data, weighted_data = [], []
+    for index, row in df.iterrows():
+        for domanda in DOMANDE:
+            risposta = str(row[domanda]).strip().capitalize()
+            if risposta == "Generated":
+                pair = (1, 0)
+            elif risposta == "Baseline":
+                pair = (0, 1)
+            else:
+                continue
+            raw_data.append(pair)
+            weighted_data.extend([pair] * max(1, int(round(weights[index]))))
+    return (ilsr_pairwise(n_items=2, data=raw_data, alpha=BT_ALPHA),
+            ilsr_pairwise(n_items=2, data=weighted_data, alpha=BT_ALPHA))
+
+
+def _benchmark(n_rows=20000, seed=0):
+    import time
+
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({domanda: rng.choice(["Generated", "Baseline", "Indifferente", " generated "],
+                                           size=n_rows, p=[0.45, 0.35, 0.15, 0.05])
+                       for domanda in DOMANDE})
+    weights = 0.65 * rng.integers(1, 6, n_rows) + 0.35 * rng.integers(1, 6, n_rows)
+
+    start = time.perf_counter()
+    legacy_raw, legacy_weighted = _legacy_fit(df, weights)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    winners, losers, comparison_weights, _ = extract_comparisons(df, weights=weights)
+    raw = fit_bradley_terry(2, winners, losers)
+    weighted = fit_bradley_terry(2, winners, losers, comparison_weights)
+    new_time = time.perf_counter() - start
+
+    # Percorso generale (I-LSR) sugli stessi dati: deve coincidere con la forma chiusa
+    general = ilsr(win_matrix(2, winners, losers), BT_ALPHA)
+
+    print(f"{n_rows} questionari, {len(winners)} confronti")
+    print(f"iterrows + choix:   {legacy_time * 1000:8.1f} ms")
+    print(f"vettoriale:         {new_time * 1000:8.1f} ms  ({legacy_time / new_time:.0f}x)")
+    print(f"non pesato, differenza massima da choix:  {np.abs(raw - legacy_raw).max():.2e}")
+    print(f"I-LSR vs forma chiusa:                    {np.abs(general - raw).max():.2e}")
+    print(f"pesato (pesi reali) vs choix (pesi arrotondati): "
+          f"P(generated) {win_probabilities(weighted)[1]:.4f} vs {win_probabilities(legacy_weighted)[1]:.4f}")
+
+
+def _benchmark_ranking(n_baselines=200, per_baseline=100, answers=5, seed=0):
+    import time
+
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    n_generated = n_baselines * per_baseline
+    baseline_of = np.repeat(np.arange(n_baselines), per_baseline)
+    true_strength = rng.normal(0, 1, n_baselines + n_generated)
+    delta = true_strength[n_baselines:] - true_strength[baseline_of]
+    p_generated = 1 / (1 + np.exp(-delta))
+    df = pd.DataFrame({"idGenerazione": np.arange(n_generated),
+                       "id_immagine_baseline": baseline_of,
+                       "path_immagine_generata": [f"g{i}" for i in range(n_generated)],
+                       "path_immagine": [f"b{i}" for i in baseline_of]})
+    for i in range(answers):
+        df[DOMANDE[i]] = np.where(rng.random(n_generated) < p_generated, "Generated", "Baseline")
+
+    start = time.perf_counter()
+    ranking, comparisons, _ = image_ranking(df, DOMANDE[:answers])
+    elapsed = time.perf_counter() - start
+    estimated = ranking.sort_values(["Tipo", "Id"], ascending=[False, True])["Forza BT (λ)"].to_numpy()
+    truth = np.concatenate([true_strength[n_baselines:], true_strength[:n_baselines]])
+    print(f"\nClassifica a molti item: {n_baselines + n_generated} immagini, {comparisons} confronti")
+    print(f"MM sparso:          {elapsed * 1000:8.1f} ms")
+    print(f"correlazione con le forze simulate: {np.corrcoef(estimated, truth)[0, 1]:.3f}")
+
+
+if __name__ == "__main__":
+    _benchmark()
+    _benchmark_ranking()
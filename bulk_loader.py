@@ -0,0 +1,318 @@
+'''
+Caricamento massivo dei CSV nel database.
+
+- lettura a blocchi (chunk) di CHUNK_SIZE righe;
+- conversione dei tipi vettoriale su tutto il blocco (pandas) invece che riga per riga;
+- un solo executemany e una sola transazione per blocco;
+- solo offline (riga di comando, script di migrazione; bulk_load_csv(..., offline=True)):
+  PRAGMA dedicati durante il caricamento (journal_mode, synchronous, cache_size) e indici
+  secondari eliminati prima e ricostruiti dopo. Sul database in uso (sincronizzazione
+  della dashboard, repository di main.py) si resta in WAL, con synchronous e indici invariati;
+- righe non valide scritte in un file di scarti invece che solo stampate.
+- viste aggiornabili (questionario): al trigger INSTEAD OF arrivano solo le righe nuove o cambiate.
+
+Uso da riga di comando (carica tutti i CSV in fashion_database.db):
+    python bulk_loader.py
+'''
+import csv
+import json
+import sqlite3
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from storage import segment_paths
+
+CHUNK_SIZE = 50000
+REJECT_FOLDER = Path("scarti")
+
+
+def iter_chunks(path, offset=0, chunksize=CHUNK_SIZE):
+    """Legge il file in streaming a partire dal byte offset e restituisce blocchi di righe.
+
+    Restituisce coppie (righe, offset): l'offset è valorizzato solo sull'ultimo blocco
+    ed è la posizione subito dopo l'ultima riga completa (terminata da "\n").
+    """
+    consumed = [offset]
+
+    def complete_lines(f):
+        # Solo le righe complete: una coda senza "\n" è ancora in scrittura
+        first = offset == 0
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                return
+            consumed[0] += len(raw)
+            line = raw.decode("utf-8")
+            if first:
+                line = line.lstrip("\ufeff")
+                first = False
+            yield line
+
+    rows = []
+    last_end = offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        reader = csv.reader(complete_lines(f))
+        try:
+            if offset == 0:
+                next(reader, None)  # intestazione
+                last_end = consumed[0]
+            for row in reader:
+                # csv.reader non legge oltre il record: qui consumed è la fine della riga
+                last_end = consumed[0]
+                if not row:
+                    continue
+                rows.append(row)
+                if len(rows) >= chunksize:
+                    yield rows, None
+                    rows = []
+        except csv.Error as e:
+            # Record tra virgolette troncato in coda al file: verrà riletto alla prossima sincronizzazione
+            print(f"Lettura interrotta in {path}: {e}")
+    yield rows, last_end
+
+
+def convert_chunk(rows, n_columns, int_columns):
+    """Conversione vettoriale di un blocco: restituisce (record validi, scarti)."""
+    rejected = []
+    # Numero di campi sbagliato: la riga viene scartata subito
+    good = []
+    for row in rows:
+        if len(row) == n_columns:
+            good.append(row)
+        else:
+            rejected.append((row, f"attesi {n_columns} campi, trovati {len(row)}"))
+    if not good:
+        return [], rejected
+
+    df = pd.DataFrame(good, dtype=object)
+    valid = np.ones(len(df), dtype=bool)
+    for col in int_columns:
+        numbers = pd.to_numeric(df[col], errors="coerce")
+        # Accetta solo valori interi (es. "3" o "3.0")
+        ok = numbers.notna() & (numbers == np.floor(numbers))
+        valid &= ok.to_numpy()
+        df[col] = numbers.where(ok)
+
+    for index in np.flatnonzero(~valid):
+        bad_columns = [c for c in int_columns if pd.isna(df.iat[index, c])]
+        rejected.append((good[index], f"valore non intero nelle colonne {bad_columns}"))
+
+    df = df[valid]
+    for col in int_columns:
+        # astype(object) restituisce int Python, gli unici accettati da sqlite3
+        df[col] = df[col].astype(np.int64).astype(object)
+    return list(df.itertuples(index=False, name=None)), rejected
+
+
+class RejectWriter:
+    """Scrive le righe scartate in scarti/<tabella>_scarti.csv."""
+
+    def __init__(self, table, folder=REJECT_FOLDER):
+        self.path = Path(folder) / f"{table}_scarti.csv"
+        self.count = 0
+
+    def write(self, source, rejected):
+        if not rejected:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        new_file = not self.path.exists()
+        with open(self.path, "a", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            if new_file:
+                writer.writerow(["file", "motivo", "riga"])
+            for row, reason in rejected:
+                writer.writerow([str(source), reason, ",".join(row)])
+        self.count += len(rejected)
+        print(f"{len(rejected)} righe scartate da {source} (vedi {self.path})")
+
+
+@contextmanager
+def loader_pragmas(conn):
+    # PRAGMA per il caricamento massivo, ripristinati alla fine
+    if conn.in_transaction:
+        conn.commit()
+    previous = {
+        name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+        for name in ("journal_mode", "synchronous", "cache_size")
+    }
+    try:
+        journal_mode = conn.execute("PRAGMA journal_mode=MEMORY").fetchone()[0]
+    except sqlite3.OperationalError:
+        journal_mode = previous["journal_mode"]  # altri processi tengono aperto il DB in WAL
+    if journal_mode.lower() == "memory":
+        # Senza journal su disco la durabilità è già persa: synchronous=OFF non toglie altro
+        conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MB
+    conn.execute("PRAGMA temp_store=MEMORY")
+    try:
+        yield
+    finally:
+        if conn.in_transaction:
+            conn.commit()
+        try:
+            conn.execute(f"PRAGMA journal_mode={previous['journal_mode']}")
+        except sqlite3.OperationalError:
+            pass
+        conn.execute(f"PRAGMA synchronous={previous['synchronous']}")
+        conn.execute(f"PRAGMA cache_size={previous['cache_size']}")
+
+
+@contextmanager
+def deferred_indexes(conn, table):
+    # Gli indici secondari vengono ricostruiti una volta sola alla fine del caricamento
+    if conn.in_transaction:
+        conn.commit()
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)).fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+    try:
+        yield
+    finally:
+        if conn.in_transaction:
+            conn.commit()
+        for _, sql in indexes:
+            conn.execute(sql)
+        conn.commit()
+
+
+def is_view(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?", (table,)).fetchone() is not None
+
+
+def insert_statement(table, columns, mode="ignore", view=False):
+    placeholders = ",".join("?" * len(columns))
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    if view:
+        # Viste aggiornabili (es. questionario): l'INSERT del trigger INSTEAD OF è già un upsert
+        return insert
+    if mode == "ignore":
+        return insert.replace("INSERT INTO", "INSERT OR IGNORE INTO", 1)
+    # Upsert: aggiorna solo se la riga è davvero cambiata
+    updates = ", ".join(f"{col} = excluded.{col}" for col in columns[1:])
+    changed = " OR ".join(f"{col} IS NOT excluded.{col}" for col in columns[1:])
+    return f"{insert} ON CONFLICT({columns[0]}) DO UPDATE SET {updates} WHERE {changed}"
+
+
+def load_file(conn, table, path, int_columns, offset=0, mode="ignore", rejects=None,
+              seen_keys=None, chunksize=CHUNK_SIZE):
+    """Carica un singolo file (da offset) a blocchi; restituisce (statistiche, offset finale)."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    view = is_view(conn, table)
+    statement = insert_statement(table, columns, mode, view)
+    stats = {"lette": 0, "scritte": 0, "scartate": 0}
+    final_offset = offset
+    rejects = rejects or RejectWriter(table)
+
+    for rows, end_offset in iter_chunks(path, offset, chunksize):
+        if end_offset is not None:
+            final_offset = end_offset
+        if not rows:
+            continue
+        records, rejected = convert_chunk(rows, len(columns), int_columns)
+        rejects.write(path, rejected)
+        stats["lette"] += len(rows)
+        stats["scartate"] += len(rejected)
+
+        if seen_keys is not None:
+            seen_keys.update(record[0] for record in records)
+        if view:
+            records = changed_records(conn, table, columns, records, mode)
+
+        if conn.in_transaction:
+            conn.commit()
+        # Una transazione per blocco; rowcount (non total_changes) esclude le righe scritte dai trigger.
+        # Sulle viste rowcount è sempre 0: contano le righe passate al trigger
+        conn.execute("BEGIN")
+        try:
+            cursor = conn.executemany(statement, records)
+            written = len(records) if view else cursor.rowcount
+        except sqlite3.IntegrityError:
+            # Un vincolo violato annulla l'executemany: il blocco si ripete riga per riga
+            # e solo le righe che violano i vincoli finiscono negli scarti
+            conn.execute("ROLLBACK")
+            conn.execute("BEGIN")
+            violations = []
+            written = 0
+            for record in records:
+                try:
+                    cursor = conn.execute(statement, record)
+                    written += 1 if view else cursor.rowcount
+                except sqlite3.IntegrityError as e:
+                    violations.append(([str(v) for v in record], f"vincolo violato: {e}"))
+            rejects.write(path, violations)
+            stats["scartate"] += len(violations)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        stats["scritte"] += written
+    return stats, final_offset
+
+
+def changed_records(conn, table, columns, records, mode):
+    """Righe del blocco da scrivere su una vista: nuove o (in upsert) diverse da quelle salvate.
+
+    Fa da ON CONFLICT / OR IGNORE, che SQLite non accetta sulle viste.
+    """
+    keys = json.dumps([record[0] for record in records])
+    stored = {row[0]: row for row in conn.execute(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE {columns[0]} IN (SELECT value FROM json_each(?))",
+        (keys,))}
+
+    def normalized(row):
+        # Confronto come testo: "1" dal CSV e 1 salvato sono lo stesso valore
+        return tuple(None if value is None or value == "" else str(value) for value in row)
+
+    return [record for record in records if record[0] not in stored or (
+        mode != "ignore" and normalized(record) != normalized(stored[record[0]]))]
+
+
+def bulk_load_csv(conn, table, file_path, int_columns, mode="ignore", chunksize=CHUNK_SIZE, offline=False):
+    """Caricamento massivo di un CSV (con tutti i suoi segmenti) in una tabella.
+
+    offline=True (nessun altro usa il database) attiva loader_pragmas e deferred_indexes.
+    """
+    start = time.perf_counter()
+    totals = {"lette": 0, "scritte": 0, "scartate": 0}
+    rejects = RejectWriter(table)
+    with ExitStack() as stack:
+        if offline:
+            stack.enter_context(loader_pragmas(conn))
+            stack.enter_context(deferred_indexes(conn, table))
+        for segment in segment_paths(file_path):
+            stats, _ = load_file(conn, table, segment, int_columns, mode=mode,
+                                 rejects=rejects, chunksize=chunksize)
+            for key in totals:
+                totals[key] += stats[key]
+    elapsed = time.perf_counter() - start
+    totals["secondi"] = elapsed
+    totals["righe_al_secondo"] = totals["lette"] / elapsed if elapsed > 0 else 0.0
+    return totals
+
+
+def format_stats(table, stats):
+    return (f"{table}: {stats['lette']} righe lette, {stats['scritte']} scritte, "
+            f"{stats['scartate']} scartate in {stats['secondi']:.2f}s "
+            f"({stats['righe_al_secondo']:,.0f} righe/s)")
+
+
+if __name__ == "__main__":
+    from database import DATABASE_PATH, CSV_TABLES, connect, create_tables
+
+    conn = connect(DATABASE_PATH)
+    conn.isolation_level = None  # transazioni gestite dal loader
+    try:
+        create_tables(conn.cursor())
+        for table, filename, int_columns in CSV_TABLES:
+            if segment_paths(filename):
+                print(format_stats(table, bulk_load_csv(conn, table, filename, int_columns, offline=True)))
+    finally:
+        conn.close()
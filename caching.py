@@ -0,0 +1,239 @@
+'''
+Cache persistente su disco (SQLite) per risultati deterministici costosi,
+ad esempio i prompt generati dal VLM con seed e temperatura fissi.
+
+Ogni cache ha un namespace, un numero massimo di voci (eviction LRU sull'ultimo
+accesso), una durata opzionale (TTL), contatori hit/miss e un flag per
+disattivarla senza toccare il codice che la usa.
+ImageCache fa lo stesso per i file (immagini generate), indirizzati per hash.
+'''
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+CACHE_DATABASE = os.path.join("cache", "cache.db")
+
+
+def make_key(*parts):
+    """Hash stabile (sha256) di valori serializzabili in JSON."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(source, destination):
+    """Hard link di source in destination (copia se il filesystem non li supporta), con rename atomico."""
+    tmp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Hash sha256 del contenuto di un file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PersistentCache:
+    def __init__(self, namespace, path=CACHE_DATABASE, max_entries=10000, ttl=None, enabled=True):
+        self.namespace = namespace
+        self.path = path
+        self.max_entries = max_entries  # None = nessun limite
+        self.ttl = ttl  # secondi; None = nessuna scadenza
+        self.enabled = enabled  # False = bypass (nessuna lettura né scrittura)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        # Apertura pigra: la cartella e il file vengono creati solo al primo uso
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT,
+                key TEXT,
+                value TEXT,
+                created REAL,
+                last_access REAL,
+                PRIMARY KEY (namespace, key)
+            )''')
+            self._conn.execute('''CREATE INDEX IF NOT EXISTS idx_cache_last_access
+                                  ON cache(namespace, last_access)''')
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, created FROM cache WHERE namespace = ? AND key = ?",
+                               (self.namespace, key)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                # Voce scaduta
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return default
+            conn.execute("UPDATE cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                         (now, self.namespace, key))
+            conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('''
+                INSERT INTO cache (namespace, key, value, created, last_access) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(namespace, key) DO UPDATE SET
+                    value = excluded.value, created = excluded.created, last_access = excluded.last_access''',
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), now, now))
+            if self.max_entries is not None:
+                # Eviction LRU: restano le max_entries voci usate più di recente
+                conn.execute('''
+                    DELETE FROM cache WHERE namespace = ? AND key NOT IN (
+                        SELECT key FROM cache WHERE namespace = ?
+                        ORDER BY last_access DESC LIMIT ?)''',
+                    (self.namespace, self.namespace, self.max_entries))
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Contatori hit/miss e numero di voci salvate."""
+        with self._lock:
+            entries = self._connection().execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+
+class ImageCache:
+    """Cache di file indirizzata per contenuto (hash dei parametri di generazione).
+
+    Le immagini vengono collegate con hard link (copia se il filesystem non li supporta),
+    quindi una voce in cache non occupa spazio in più rispetto al file già generato.
+    Oltre max_bytes vengono eliminate le voci usate meno di recente (il file collegato resta).
+    L'ultimo uso è registrato in una tabella di cache.db e non nel mtime del file: l'inode
+    è condiviso con le immagini dell'archivio, e le rendition dipendono dal loro mtime.
+    """
+
+    def __init__(self, folder=os.path.join("cache", "immagini"), max_bytes=2 * 1024 ** 3,
+                 extension=".jpg", enabled=True, path=CACHE_DATABASE):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.enabled = enabled
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        # Apertura pigra, come per PersistentCache
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS image_cache_uso (
+                folder TEXT,
+                key TEXT,
+                last_access REAL,
+                PRIMARY KEY (folder, key)
+            )''')
+            self._conn.commit()
+        return self._conn
+
+    def _touch(self, key):
+        conn = self._connection()
+        conn.execute('''
+            INSERT INTO image_cache_uso (folder, key, last_access) VALUES (?, ?, ?)
+            ON CONFLICT(folder, key) DO UPDATE SET last_access = excluded.last_access''',
+            (self.folder, key, time.time()))
+        conn.commit()
+
+    def path_for(self, key):
+        return os.path.join(self.folder, key + self.extension)
+
+    def fetch(self, key, destination):
+        """Se la voce esiste la collega in destination e restituisce True."""
+        if not self.enabled:
+            return False
+        cached = self.path_for(key)
+        with self._lock:
+            if not os.path.exists(cached):
+                self.misses += 1
+                return False
+            os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+            link_or_copy(cached, destination)
+            self._touch(key)  # ultimo uso, per l'eviction LRU (il file non viene toccato)
+            self.hits += 1
+            return True
+
+    def store(self, key, source):
+        """Aggiunge il file source alla cache e applica il limite di dimensione."""
+        if not self.enabled:
+            return
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            link_or_copy(source, self.path_for(key))
+            self._touch(key)
+            self._evict()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        conn = self._connection()
+        last_access = dict(conn.execute(
+            "SELECT key, last_access FROM image_cache_uso WHERE folder = ?", (self.folder,)))
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith(self.extension):
+                key = entry.name[:-len(self.extension)]
+                stat = entry.stat()
+                # Voci senza uso registrato (cache precedente): conta la data del file
+                entries.append((last_access.get(key, stat.st_mtime), stat.st_size, entry.path, key))
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, path, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            conn.execute("DELETE FROM image_cache_uso WHERE folder = ? AND key = ?", (self.folder, key))
+            total -= size
+        conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,200 @@
+'''
+Sincronizzazione incrementale CSV -> database (change data capture).
+
+Per ogni file CSV (e segmento) viene salvato nel database un checkpoint con
+offset in byte già importato, dimensione, mtime e hash della coda già letta.
+Alla sincronizzazione successiva:
+- file invariato            -> nessuna lettura;
+- file cresciuto (append)   -> si importano solo le righe nuove (upsert);
+- file riscritto/accorciato -> riconciliazione completa della tabella
+                               (upsert di tutte le righe + delete di quelle sparite).
+Le righe vengono caricate a blocchi da bulk_loader.load_file; quelle non valide
+finiscono in scarti/<tabella>_scarti.csv (conteggiate come "errori").
+'''
+import hashlib
+import threading
+import time
+from pathlib import Path
+
+from bulk_loader import RejectWriter, load_file
+from database import DATABASE_PATH, CSV_TABLES, connect, create_tables
+from storage import segment_paths
+
+TAIL_HASH_BYTES = 4096
+
+
+def create_checkpoint_table(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_checkpoint (
+        file TEXT PRIMARY KEY,
+        tabella TEXT,
+        offset INTEGER,
+        size INTEGER,
+        mtime REAL,
+        tail_hash TEXT
+    )''')
+
+
+def _tail_hash(f, offset):
+    # Hash degli ultimi byte già importati: se cambiano il file è stato riscritto
+    start = max(0, offset - TAIL_HASH_BYTES)
+    f.seek(start)
+    return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+
+class CsvSyncEngine:
+    def __init__(self, database_path=DATABASE_PATH, csv_folder=Path("."), tables=CSV_TABLES):
+        self.database_path = database_path
+        self.csv_folder = Path(csv_folder)
+        self.tables = tables
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_report = {}
+
+    # API pubblica
+    def sync(self):
+        """Sincronizza tutte le tabelle; restituisce un report per tabella."""
+        with self._lock:
+            conn = connect(self.database_path)
+            conn.isolation_level = None  # transazioni (una per blocco) gestite dal bulk loader
+            try:
+                cursor = conn.cursor()
+                create_tables(cursor)
+                create_checkpoint_table(cursor)
+                report = {}
+                for table, filename, int_columns in self.tables:
+                    report[table] = self._sync_table(conn, table, filename, int_columns)
+                self.last_report = report
+                return report
+            finally:
+                conn.close()
+
+    def start(self, interval=60):
+        # Sincronizzazione periodica in background (senza riavviare la dashboard)
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"Errore sincronizzazione CSV: {e}")
+
+        self._thread = threading.Thread(target=loop, name="csv-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # Logica per tabella
+    def _sync_table(self, conn, table, filename, int_columns):
+        files = segment_paths(self.csv_folder / filename)
+        checkpoints = {
+            row[0]: row[1:] for row in conn.execute(
+                "SELECT file, offset, size, mtime, tail_hash FROM sync_checkpoint WHERE tabella = ?", (table,))
+        }
+        stats = {"nuove": 0, "aggiornate": 0, "eliminate": 0, "errori": 0, "modalita": "invariata"}
+        rows_before = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        written = 0
+
+        # Un segmento con checkpoint sparito = file riscritto/rinominato
+        rewritten = any(name not in {str(p) for p in files} for name in checkpoints)
+        appended = []
+        for path in files if checkpoints else []:
+            saved = checkpoints.get(str(path))
+            if saved is None:
+                # Nuovo segmento: si legge dall'inizio
+                appended.append((path, 0))
+                continue
+            offset, size, mtime, tail_hash = saved
+            stat = path.stat()
+            if stat.st_size == offset and stat.st_mtime == mtime:
+                continue
+            if stat.st_size < offset:
+                rewritten = True
+                break
+            with open(path, "rb") as f:
+                if _tail_hash(f, offset) != tail_hash:
+                    rewritten = True
+                    break
+            if stat.st_size == offset:
+                # Stessa dimensione ma mtime diverso: modifica in place, non un append
+                rewritten = True
+                break
+            appended.append((path, offset))
+
+        if not checkpoints or rewritten:
+            # Primo import (nessun checkpoint): solo upsert, nessuna eliminazione
+            if files:
+                stats["modalita"] = "completa"
+                written = self._full_reconcile(conn, table, files, int_columns, stats,
+                                               delete_missing=bool(checkpoints))
+        elif appended:
+            stats["modalita"] = "incrementale"
+            rejects = RejectWriter(table)
+            for path, offset in appended:
+                written += self._ingest(conn, table, path, offset, int_columns, stats, rejects)
+
+        # Nuove = differenza di righe (al netto delle eliminate), il resto delle scritture sono update
+        rows_after = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        stats["nuove"] = rows_after - rows_before + stats["eliminate"]
+        stats["aggiornate"] = max(0, written - stats["nuove"])
+        return stats
+
+    def _full_reconcile(self, conn, table, files, int_columns, stats, delete_missing):
+        seen = set() if delete_missing else None
+        rejects = RejectWriter(table)
+        written = 0
+        conn.execute("DELETE FROM sync_checkpoint WHERE tabella = ?", (table,))
+        # Database in uso (app e dashboard): WAL, synchronous e indici restano quelli di sempre
+        for path in files:
+            written += self._ingest(conn, table, path, 0, int_columns, stats, rejects, seen)
+
+        if delete_missing:
+            # Elimina le righe non più presenti in nessun segmento
+            pk = conn.execute(f"PRAGMA table_info({table})").fetchone()[1]
+            conn.execute("BEGIN")
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS sync_keys (k INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM sync_keys")
+            conn.executemany("INSERT OR IGNORE INTO sync_keys VALUES (?)", ((k,) for k in seen))
+            # Conteggio prima del DELETE: sulle viste (trigger INSTEAD OF) rowcount è 0
+            stats["eliminate"] += conn.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE {pk} NOT IN (SELECT k FROM sync_keys)").fetchone()[0]
+            conn.execute(f"DELETE FROM {table} WHERE {pk} NOT IN (SELECT k FROM sync_keys)")
+            conn.execute("DELETE FROM sync_keys")
+            conn.execute("COMMIT")
+        return written
+
+    def _ingest(self, conn, table, path, offset, int_columns, stats, rejects, seen=None):
+        # Upsert a blocchi dal byte "offset" fino all'ultima riga completa, poi checkpoint
+        loaded, new_offset = load_file(conn, table, path, int_columns, offset=offset, mode="upsert",
+                                       rejects=rejects, seen_keys=seen)
+        stats["errori"] += loaded["scartate"]
+        self._save_checkpoint(conn, table, path, new_offset)
+        return loaded["scritte"]
+
+    def _save_checkpoint(self, conn, table, path, offset):
+        stat = path.stat()
+        with open(path, "rb") as f:
+            tail_hash = _tail_hash(f, offset)
+        conn.execute('''
+            INSERT INTO sync_checkpoint (file, tabella, offset, size, mtime, tail_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file) DO UPDATE SET
+                offset = excluded.offset, size = excluded.size,
+                mtime = excluded.mtime, tail_hash = excluded.tail_hash''',
+            (str(path), table, offset, stat.st_size, stat.st_mtime, tail_hash))
+
+
+def format_report(report):
+    # Riepilogo leggibile per la dashboard
+    lines = [f"Sincronizzazione completata alle {time.strftime('%H:%M:%S')}"]
+    for table, stats in report.items():
+        lines.append(
+            f"- **{table}** ({stats['modalita']}): {stats['nuove']} nuove, "
+            f"{stats['aggiornate']} aggiornate, {stats['eliminate']} eliminate, {stats['errori']} errori"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,512 @@
+'''
+Schema e connessione al database SQLite condiviso (fashion_database.db).
+
+Usato sia dalla dashboard (sql superinterface.py) sia dall'app utente (main.py)
+quando scrive direttamente sul database invece che sui CSV.
+
+Le risposte sono salvate in formato lungo: una riga di risposte (idQuestionario,
+n_domanda, valore) per domanda, con la risposta codificata come intero (tabella
+valori_risposta), quindi senza limite al numero di domande per set. La vista
+questionario ricompone le colonne testuali domanda1..domanda6 per le query esistenti
+e accetta anche INSERT/UPDATE/DELETE (trigger INSTEAD OF).
+'''
+import sqlite3
+from pathlib import Path
+
+DATABASE_PATH = "fashion_database.db"
+SCHEMA_VERSION = 1  # salvata in PRAGMA user_version
+
+# Tabelle importabili dai CSV: (tabella, file, posizioni delle colonne intere).
+# L'ordine rispetta le dipendenze (prima le tabelle referenziate)
+CSV_TABLES = [
+    ('immagini_baseline', 'immagini_baseline.csv', [0]),
+    ('domande', 'domande.csv', [0]),
+    ('registrazioni', 'registrazioni.csv', [0, 3, 12, 13]),
+    ('immagini_generate', 'immagini_generate.csv', [0, 1]),
+    ('questionario', 'questionario.csv', [0, 1, 2]),
+]
+
+# Codici delle risposte: 1-5 scala Likert (il codice è il punteggio), 11-13 domande a scelta.
+# I codici seguono l'ordine alfabetico delle etichette, come i vecchi GROUP BY sul testo
+RISPOSTE = {
+    1: "1 - Molto Poco",
+    2: "2 - Poco",
+    3: "3 - Neutro",
+    4: "4 - Abbastanza",
+    5: "5 - Molto",
+    11: "Baseline",
+    12: "Generated",
+    13: "Indifferente",
+}
+RISPOSTA_BASELINE = 11
+RISPOSTA_GENERATED = 12
+RISPOSTA_INDIFFERENTE = 13
+COMPAT_QUESTIONS = 6  # colonne domandaN della vista questionario
+
+_CODES_BY_LABEL = {label.casefold(): code for code, label in RISPOSTE.items()}
+
+
+def connect(path=DATABASE_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    # WAL: i lettori (dashboard) non bloccano lo scrittore (app utente) e viceversa
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def connect_readonly(path=DATABASE_PATH):
+    """Connessione in sola lettura (query libere della dashboard): nessuna scrittura possibile."""
+    conn = sqlite3.connect(Path(path).absolute().as_uri() + "?mode=ro", uri=True,
+                           check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def answer_code(answer):
+    """Codice intero di una risposta ('Generated', '4 - Abbastanza', '4'); ValueError se sconosciuta."""
+    text = str(answer).strip()
+    code = _CODES_BY_LABEL.get(text.casefold())
+    if code is None and text[:1] and text[0] in "12345" and text[1:2] in ("", " "):
+        code = int(text[0])
+    if code is None:
+        raise ValueError(f"Risposta non valida: {answer!r}")
+    return code
+
+
+def _answer_code_sql(expr):
+    # Stessa conversione di answer_code() in SQL; NULL se la risposta non è riconosciuta
+    text = f"TRIM({expr})"
+    return f'''COALESCE(
+        (SELECT codice FROM valori_risposta WHERE etichetta = {text}),
+        CASE WHEN {text} GLOB '[1-5]' OR {text} GLOB '[1-5] *' THEN CAST(substr({text}, 1, 1) AS INTEGER) END)'''
+
+
+def _registrations_sql(table):
+    return f'''
+    CREATE TABLE IF NOT EXISTS {table} (
+        idUtente INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT,
+        cognome TEXT,
+        eta INTEGER,
+        nazione TEXT,
+        genere TEXT,
+        corrente_artistica_preferita TEXT,
+        professione TEXT,
+        colori_preferiti TEXT,
+        generi_musicali_preferiti TEXT,
+        cosa_cerchi_nei_capi TEXT,
+        marchi_preferiti TEXT,
+        competenza_moda INTEGER CHECK (competenza_moda BETWEEN 1 AND 5),
+        interesse_moda INTEGER CHECK (interesse_moda BETWEEN 1 AND 5)
+    )'''
+
+
+def create_tables(cursor):
+    # Crea le tabelle se non esistono già
+    cursor.execute(_registrations_sql("registrazioni"))
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS immagini_generate (
+        idGenerazione INTEGER PRIMARY KEY AUTOINCREMENT,
+        id_immagine_baseline INTEGER REFERENCES immagini_baseline(idImmagine),
+        prompt_text_to_image TEXT,
+        data_ora TEXT,
+        path_immagine_generata TEXT
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS domande (
+        id_set INTEGER PRIMARY KEY,
+        domanda1 TEXT,
+        domanda2 TEXT,
+        domanda3 TEXT,
+        domanda4 TEXT,
+        domanda5 TEXT,
+        domanda6 TEXT
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS immagini_baseline (
+        idImmagine INTEGER PRIMARY KEY,
+        genere_del_capo TEXT,
+        path_immagine TEXT
+    )''')
+
+    create_answer_tables(cursor)
+    migrate_schema(cursor)
+    create_compat_views(cursor)
+
+    # Indici per le ricerche fatte dall'app utente
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_immagini_generate_path
+                      ON immagini_generate(path_immagine_generata)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_immagini_baseline_path
+                      ON immagini_baseline(path_immagine)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_questionari_utente
+                      ON questionari(idUtente, id_immagine_generata)''')
+    # Indice coprente per le distribuzioni per domanda (WITHOUT ROWID: contiene anche idQuestionario)
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_risposte_domanda
+                      ON risposte(n_domanda, valore)''')
+    # Indici sulle colonne di join (chiavi esterne) usate dalla dashboard e dalle query di analisi.
+    # questionari.idUtente e id_immagine_generata sono già coperti da idx_questionari_utente e UNIQUE
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_immagini_generate_baseline
+                      ON immagini_generate(id_immagine_baseline)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_questionari_set
+                      ON questionari(id_set_domande)''')
+
+    create_aggregate_tables(cursor)
+
+
+def create_answer_tables(cursor):
+    """Testata dei questionari, risposte in formato lungo e codici delle risposte."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS valori_risposta (
+        codice INTEGER PRIMARY KEY,
+        etichetta TEXT NOT NULL UNIQUE COLLATE NOCASE
+    )''')
+    cursor.executemany("INSERT OR IGNORE INTO valori_risposta (codice, etichetta) VALUES (?, ?)",
+                       RISPOSTE.items())
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS questionari (
+        idQuestionario INTEGER PRIMARY KEY AUTOINCREMENT,
+        idUtente INTEGER REFERENCES registrazioni(idUtente),
+        id_immagine_generata INTEGER UNIQUE REFERENCES immagini_generate(idGenerazione),
+        id_set_domande INTEGER REFERENCES domande(id_set)
+    )''')
+
+    codes = ", ".join(str(code) for code in RISPOSTE)
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS risposte (
+        idQuestionario INTEGER NOT NULL REFERENCES questionari(idQuestionario),
+        n_domanda INTEGER NOT NULL CHECK (n_domanda >= 1),
+        valore INTEGER NOT NULL REFERENCES valori_risposta(codice) CHECK (valore IN ({codes})),
+        PRIMARY KEY (idQuestionario, n_domanda)
+    ) WITHOUT ROWID''')
+
+    # Eliminando un questionario si eliminano le sue risposte (le foreign key non sono attive).
+    # BEFORE: le risposte escono dagli aggregati mentre la testata esiste ancora
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_questionari_cascade
+    BEFORE DELETE ON questionari BEGIN
+        DELETE FROM risposte WHERE idQuestionario = OLD.idQuestionario;
+    END''')
+
+
+def _store_answers(row, questionnaire_id):
+    # Riscrive le risposte 1..COMPAT_QUESTIONS di una riga della vista (le successive restano)
+    answers = " UNION ALL ".join(
+        f"SELECT {n} AS n, {_answer_code_sql(f'{row}.domanda{n}')} AS codice"
+        for n in range(1, COMPAT_QUESTIONS + 1))
+    return f'''
+        DELETE FROM risposte WHERE idQuestionario = {questionnaire_id} AND n_domanda <= {COMPAT_QUESTIONS};
+        INSERT INTO risposte (idQuestionario, n_domanda, valore)
+        SELECT {questionnaire_id}, n, codice FROM ({answers}) WHERE codice IS NOT NULL;'''
+
+
+def _validate_answers(row):
+    invalid = " OR ".join(
+        f"(NULLIF(TRIM({row}.domanda{n}), '') IS NOT NULL AND {_answer_code_sql(f'{row}.domanda{n}')} IS NULL)"
+        for n in range(1, COMPAT_QUESTIONS + 1))
+    return f"SELECT RAISE(ABORT, 'risposta non valida') WHERE {invalid};"
+
+
+def create_compat_views(cursor):
+    """Vista questionario con le colonne testuali domanda1..domanda6 dello schema precedente."""
+    answers = ",\n".join(
+        f'''        (SELECT v.etichetta FROM risposte a JOIN valori_risposta v ON v.codice = a.valore
+         WHERE a.idQuestionario = q.idQuestionario AND a.n_domanda = {n}) AS domanda{n}'''
+        for n in range(1, COMPAT_QUESTIONS + 1))
+    cursor.execute(f'''
+    CREATE VIEW IF NOT EXISTS questionario AS
+    SELECT q.idQuestionario, q.idUtente, q.id_immagine_generata, q.id_set_domande,
+{answers}
+    FROM questionari q''')
+
+    header = ("idUtente", "id_immagine_generata", "id_set_domande")
+    triggers = {
+        # INSERT ha semantica di upsert sull'id, come il caricamento dai CSV
+        "trg_questionario_vista_insert": f'''
+            INSTEAD OF INSERT ON questionario BEGIN
+                {_validate_answers("NEW")}
+                INSERT INTO questionari (idQuestionario, {", ".join(header)})
+                VALUES (NEW.idQuestionario, {", ".join(f"NEW.{col}" for col in header)})
+                ON CONFLICT(idQuestionario) DO UPDATE SET
+                    {", ".join(f"{col} = excluded.{col}" for col in header)}
+                WHERE {" OR ".join(f"{col} IS NOT excluded.{col}" for col in header)};
+                {_store_answers("NEW", "COALESCE(NEW.idQuestionario, last_insert_rowid())")}
+            END''',
+        "trg_questionario_vista_update": f'''
+            INSTEAD OF UPDATE ON questionario BEGIN
+                {_validate_answers("NEW")}
+                UPDATE questionari SET idQuestionario = NEW.idQuestionario,
+                    {", ".join(f"{col} = NEW.{col}" for col in header)}
+                WHERE idQuestionario = OLD.idQuestionario;
+                UPDATE risposte SET idQuestionario = NEW.idQuestionario
+                WHERE idQuestionario = OLD.idQuestionario AND NEW.idQuestionario IS NOT OLD.idQuestionario;
+                {_store_answers("NEW", "NEW.idQuestionario")}
+            END''',
+        "trg_questionario_vista_delete": '''
+            INSTEAD OF DELETE ON questionario BEGIN
+                DELETE FROM questionari WHERE idQuestionario = OLD.idQuestionario;
+            END''',
+    }
+    for name, body in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+
+def migrate_schema(cursor):
+    """Porta un database esistente all'ultima versione dello schema (PRAGMA user_version)."""
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    cursor.execute("SAVEPOINT migrazione_schema")
+    try:
+        if version < 1:
+            _migrate_to_v1(cursor)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except Exception:
+        cursor.execute("ROLLBACK TO migrazione_schema")
+        cursor.execute("RELEASE migrazione_schema")
+        raise
+    cursor.execute("RELEASE migrazione_schema")
+
+
+def _sequence(cursor, table):
+    try:
+        row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    except sqlite3.OperationalError:
+        return None  # nessuna tabella AUTOINCREMENT
+    return row[0] if row else None
+
+
+def _migrate_to_v1(cursor):
+    # Versione 1: risposte in formato lungo e colonne numeriche di registrazioni tipizzate
+    types = {row[1]: row[2].upper() for row in cursor.execute("PRAGMA table_info(registrazioni)")}
+    if types.get("competenza_moda") != "INTEGER" or types.get("interesse_moda") != "INTEGER":
+        # SQLite non cambia il tipo di una colonna: la tabella viene ricostruita
+        sequence = _sequence(cursor, "registrazioni")
+        columns = list(types)
+        likert = {col: f"CASE WHEN CAST({col} AS INTEGER) BETWEEN 1 AND 5 THEN CAST({col} AS INTEGER) END"
+                  for col in ("competenza_moda", "interesse_moda")}
+        cursor.execute(_registrations_sql("registrazioni_v1"))
+        cursor.execute(f'''
+            INSERT INTO registrazioni_v1 ({", ".join(columns)})
+            SELECT {", ".join(likert.get(col, col) for col in columns)} FROM registrazioni''')
+        cursor.execute("DROP TABLE registrazioni")
+        cursor.execute("ALTER TABLE registrazioni_v1 RENAME TO registrazioni")
+        if sequence is not None:
+            cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'registrazioni'",
+                           (sequence,))
+
+    legacy = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'questionario'").fetchone()
+    if legacy:
+        sequence = _sequence(cursor, "questionario")
+        cursor.execute('''
+            INSERT OR IGNORE INTO questionari (idQuestionario, idUtente, id_immagine_generata, id_set_domande)
+            SELECT idQuestionario, idUtente, id_immagine_generata, id_set_domande FROM questionario''')
+        skipped = 0
+        for n in range(1, COMPAT_QUESTIONS + 1):
+            code = _answer_code_sql(f"domanda{n}")
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO risposte (idQuestionario, n_domanda, valore)
+                SELECT idQuestionario, {n}, {code} FROM questionario
+                WHERE NULLIF(TRIM(domanda{n}), '') IS NOT NULL AND {code} IS NOT NULL''')
+            skipped += cursor.execute(f'''
+                SELECT COUNT(*) FROM questionario
+                WHERE NULLIF(TRIM(domanda{n}), '') IS NOT NULL AND {code} IS NULL''').fetchone()[0]
+        if skipped:
+            # Restano comunque in questionario.csv, la fonte dei dati
+            print(f"Migrazione questionario: {skipped} risposte non riconosciute non copiate")
+        if sequence is not None:
+            cursor.execute("INSERT OR REPLACE INTO sqlite_sequence (name, seq) VALUES ('questionari', ?)",
+                           (max(sequence, _sequence(cursor, "questionari") or 0),))
+        cursor.execute("DROP TABLE questionario")
+
+    # Aggregati e trigger della versione 0 leggevano il vecchio questionario: si ricreano
+    for name in ("trg_immagini_generate_insert", "trg_immagini_generate_delete", "trg_immagini_generate_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cursor.execute("DROP TABLE IF EXISTS aggregati_utente")
+    cursor.execute("DROP TABLE IF EXISTS aggregati_baseline")
+
+
+# Risposte contate negli aggregati: codici delle domande a scelta (colonne generated, baseline, indifferente)
+AGGREGATE_CODES = (RISPOSTA_GENERATED, RISPOSTA_BASELINE, RISPOSTA_INDIFFERENTE)
+_AGGREGATE_CODES_SQL = ", ".join(str(code) for code in AGGREGATE_CODES)
+
+
+def _answer_counts(answer):
+    # Espressioni SQL (generated, baseline, indifferente, totale) sulle righe di risposte (alias answer)
+    return tuple(f"COALESCE(SUM({answer}.valore = {code}), 0)" for code in AGGREGATE_CODES) + (
+        f"COUNT({answer}.valore)",)
+
+
+def _user_delta(select):
+    return f'''
+        INSERT INTO aggregati_utente (idUtente, generated, baseline, indifferente, totale, questionari)
+        {select}
+        ON CONFLICT(idUtente) DO UPDATE SET
+            generated = generated + excluded.generated, baseline = baseline + excluded.baseline,
+            indifferente = indifferente + excluded.indifferente, totale = totale + excluded.totale,
+            questionari = questionari + excluded.questionari;'''
+
+
+def _baseline_delta(select):
+    return f'''
+        INSERT INTO aggregati_baseline (id_immagine_baseline, id_set_domande, generated, baseline,
+                                        indifferente, totale, questionari)
+        {select}
+        ON CONFLICT(id_immagine_baseline, id_set_domande) DO UPDATE SET
+            generated = generated + excluded.generated, baseline = baseline + excluded.baseline,
+            indifferente = indifferente + excluded.indifferente, totale = totale + excluded.totale,
+            questionari = questionari + excluded.questionari;'''
+
+
+def _questionnaire_delta(row, sign):
+    # Testata inserita/eliminata/modificata: il questionario con tutte le sue risposte
+    counts = ", ".join(f"{expr} AS c{i}" for i, expr in enumerate(_answer_counts("a")))
+    answers = f'''(SELECT {counts} FROM risposte a
+                   WHERE a.idQuestionario = {row}.idQuestionario AND a.valore IN ({_AGGREGATE_CODES_SQL})) c'''
+    deltas = ", ".join(f"{sign} * c.c{i}" for i in range(4))
+    return _user_delta(f'''
+        SELECT {row}.idUtente, {deltas}, {sign}
+        FROM {answers}
+        WHERE {row}.idUtente IS NOT NULL''') + _baseline_delta(f'''
+        SELECT g.id_immagine_baseline, IFNULL({row}.id_set_domande, 0), {deltas}, {sign}
+        FROM immagini_generate g, {answers}
+        WHERE g.idGenerazione = {row}.id_immagine_generata AND g.id_immagine_baseline IS NOT NULL''')
+
+
+def _answer_delta(row, sign):
+    # Singola risposta: conta solo se la testata del questionario esiste
+    deltas = ", ".join(f"{sign} * ({row}.valore = {code})" for code in AGGREGATE_CODES)
+    return _user_delta(f'''
+        SELECT q.idUtente, {deltas}, {sign}, 0
+        FROM questionari q
+        WHERE q.idQuestionario = {row}.idQuestionario AND q.idUtente IS NOT NULL
+          AND {row}.valore IN ({_AGGREGATE_CODES_SQL})''') + _baseline_delta(f'''
+        SELECT g.id_immagine_baseline, IFNULL(q.id_set_domande, 0), {deltas}, {sign}, 0
+        FROM questionari q
+        JOIN immagini_generate g ON g.idGenerazione = q.id_immagine_generata
+        WHERE q.idQuestionario = {row}.idQuestionario AND g.id_immagine_baseline IS NOT NULL
+          AND {row}.valore IN ({_AGGREGATE_CODES_SQL})''')
+
+
+def _generation_delta(row, sign):
+    # Questionari già presenti per un'immagine generata inserita, eliminata o spostata
+    deltas = ", ".join(f"{sign} * {expr}" for expr in _answer_counts("a"))
+    return _baseline_delta(f'''
+        SELECT {row}.id_immagine_baseline, IFNULL(q.id_set_domande, 0), {deltas},
+               {sign} * COUNT(DISTINCT q.idQuestionario)
+        FROM questionari q
+        LEFT JOIN risposte a ON a.idQuestionario = q.idQuestionario AND a.valore IN ({_AGGREGATE_CODES_SQL})
+        WHERE q.id_immagine_generata = {row}.idGenerazione AND {row}.id_immagine_baseline IS NOT NULL
+        GROUP BY IFNULL(q.id_set_domande, 0)''')
+
+
+def create_aggregate_tables(cursor):
+    """Tabelle aggregate per utente e per baseline, aggiornate da trigger a ogni scrittura.
+
+    La dashboard legge i conteggi da qui invece di ricalcolarli dalle risposte a ogni
+    aggiornamento. Alla prima creazione le tabelle vengono popolate dai dati esistenti.
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'aggregati_utente'").fetchone()
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS aggregati_utente (
+        idUtente INTEGER PRIMARY KEY,
+        generated INTEGER NOT NULL DEFAULT 0,
+        baseline INTEGER NOT NULL DEFAULT 0,
+        indifferente INTEGER NOT NULL DEFAULT 0,
+        totale INTEGER NOT NULL DEFAULT 0,
+        questionari INTEGER NOT NULL DEFAULT 0
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS aggregati_baseline (
+        id_immagine_baseline INTEGER NOT NULL,
+        id_set_domande INTEGER NOT NULL,
+        generated INTEGER NOT NULL DEFAULT 0,
+        baseline INTEGER NOT NULL DEFAULT 0,
+        indifferente INTEGER NOT NULL DEFAULT 0,
+        totale INTEGER NOT NULL DEFAULT 0,
+        questionari INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (id_immagine_baseline, id_set_domande)
+    )''')
+
+    header = ("idQuestionario", "idUtente", "id_immagine_generata", "id_set_domande")
+    triggers = {
+        "trg_questionari_insert": f'''
+            AFTER INSERT ON questionari BEGIN
+                {_questionnaire_delta("NEW", 1)}
+            END''',
+        "trg_questionari_delete": f'''
+            AFTER DELETE ON questionari BEGIN
+                {_questionnaire_delta("OLD", -1)}
+            END''',
+        "trg_questionari_update": f'''
+            AFTER UPDATE ON questionari
+            WHEN {" OR ".join(f"OLD.{col} IS NOT NEW.{col}" for col in header)} BEGIN
+                {_questionnaire_delta("OLD", -1)}
+                {_questionnaire_delta("NEW", 1)}
+            END''',
+        "trg_risposte_insert": f'''
+            AFTER INSERT ON risposte BEGIN
+                {_answer_delta("NEW", 1)}
+            END''',
+        "trg_risposte_delete": f'''
+            AFTER DELETE ON risposte BEGIN
+                {_answer_delta("OLD", -1)}
+            END''',
+        "trg_risposte_update": f'''
+            AFTER UPDATE OF idQuestionario, valore ON risposte
+            WHEN OLD.idQuestionario IS NOT NEW.idQuestionario OR OLD.valore IS NOT NEW.valore BEGIN
+                {_answer_delta("OLD", -1)}
+                {_answer_delta("NEW", 1)}
+            END''',
+        "trg_immagini_generate_insert": f'''
+            AFTER INSERT ON immagini_generate BEGIN
+                {_generation_delta("NEW", 1)}
+            END''',
+        "trg_immagini_generate_delete": f'''
+            AFTER DELETE ON immagini_generate BEGIN
+                {_generation_delta("OLD", -1)}
+            END''',
+        "trg_immagini_generate_update": f'''
+            AFTER UPDATE OF idGenerazione, id_immagine_baseline ON immagini_generate
+            WHEN OLD.idGenerazione IS NOT NEW.idGenerazione
+              OR OLD.id_immagine_baseline IS NOT NEW.id_immagine_baseline BEGIN
+                {_generation_delta("OLD", -1)}
+                {_generation_delta("NEW", 1)}
+            END''',
+    }
+    for name, body in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+    if not exists:
+        rebuild_aggregates(cursor)
+
+
+def rebuild_aggregates(cursor):
+    """Ricalcola da zero le tabelle aggregate (prima creazione o verifica)."""
+    counts = ", ".join(_answer_counts("a"))
+    answers = f"LEFT JOIN risposte a ON a.idQuestionario = q.idQuestionario AND a.valore IN ({_AGGREGATE_CODES_SQL})"
+    cursor.execute("DELETE FROM aggregati_utente")
+    cursor.execute("DELETE FROM aggregati_baseline")
+    cursor.execute(f'''
+        INSERT INTO aggregati_utente (idUtente, generated, baseline, indifferente, totale, questionari)
+        SELECT q.idUtente, {counts}, COUNT(DISTINCT q.idQuestionario)
+        FROM questionari q
+        {answers}
+        WHERE q.idUtente IS NOT NULL
+        GROUP BY q.idUtente''')
+    cursor.execute(f'''
+        INSERT INTO aggregati_baseline (id_immagine_baseline, id_set_domande, generated, baseline,
+                                        indifferente, totale, questionari)
+        SELECT g.id_immagine_baseline, IFNULL(q.id_set_domande, 0), {counts}, COUNT(DISTINCT q.idQuestionario)
+        FROM questionari q
+        JOIN immagini_generate g ON g.idGenerazione = q.id_immagine_generata
+        {answers}
+        WHERE g.id_immagine_baseline IS NOT NULL
+        GROUP BY g.id_immagine_baseline, IFNULL(q.id_set_domande, 0)''')
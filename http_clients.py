@@ -0,0 +1,116 @@
+'''
+Client HTTP condivisi (keep-alive) per le chiamate a OpenRouter e Stability AI.
+
+I client async sono legati all'event loop su cui vengono usati: ne viene creato
+uno per loop (quello di Gradio per gli handler async, quello in background per
+i wrapper sincroni) e riutilizzato da tutte le chiamate, così le connessioni
+TCP+TLS restano aperte tra una generazione e l'altra.
+'''
+import asyncio
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING
+
+import httpx
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI  # solo per l'annotazione: l'import vero resta pigro
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_API_KEY = "INSERIRE API KEY di OPEN ROUTER" # Rimossa per motivi di sicurezza
+STABILITY_API_URL = "https://api.stability.ai/v2beta/stable-image/generate/sd3"
+
+# Dimensione del pool e timeout (secondi)
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+HTTP_KEEPALIVE_EXPIRY = 60.0  # connessioni inattive tenute aperte
+HTTP_CONNECT_TIMEOUT = 10.0
+HTTP_TIMEOUT = 120.0  # generazione SD3.5: risposte lente
+
+# Host da "scaldare" all'avvio (la risposta non interessa, solo la connessione)
+WARM_UP_URLS = [OPENROUTER_BASE_URL + "/models", "https://api.stability.ai/"]
+
+_clients = weakref.WeakKeyDictionary()  # event loop -> (httpx Stability, httpx OpenRouter, AsyncOpenAI)
+_clients_lock = threading.Lock()
+_last_warm_up = weakref.WeakKeyDictionary()  # event loop -> istante dell'ultimo warm-up
+_background_loop = None
+_background_lock = threading.Lock()
+
+
+def _new_http_client():
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+def _loop_clients():
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _clients.get(loop)
+        if clients is None:
+            from openai import AsyncOpenAI  # import pesante: solo alla prima generazione
+            openrouter_http = _new_http_client()
+            openrouter_client = AsyncOpenAI(
+                base_url=OPENROUTER_BASE_URL,
+                api_key=OPENROUTER_API_KEY,
+                http_client=openrouter_http,
+            )
+            clients = _clients[loop] = (_new_http_client(), openrouter_http, openrouter_client)
+        return clients
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Client httpx condiviso dell'event loop corrente (usato per Stability AI)."""
+    return _loop_clients()[0]
+
+
+def get_openrouter_client() -> "AsyncOpenAI":
+    """Client OpenAI (OpenRouter) condiviso dell'event loop corrente."""
+    return _loop_clients()[2]
+
+
+def _get_background_loop():
+    # Event loop unico in un thread daemon per i wrapper sincroni
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="http-clients", daemon=True).start()
+            _background_loop = loop
+        return _background_loop
+
+
+def run_sync(coro):
+    """Esegue una coroutine sul loop in background e ne attende il risultato (thread-safe)."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result()
+
+
+async def warm_up_async():
+    """Apre in anticipo le connessioni verso le API (una volta per keep-alive)."""
+    loop = asyncio.get_running_loop()
+    if time.monotonic() - _last_warm_up.get(loop, float("-inf")) < HTTP_KEEPALIVE_EXPIRY:
+        return
+    _last_warm_up[loop] = time.monotonic()
+    stability_http, openrouter_http, _ = _loop_clients()
+
+    async def touch(client, url):
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            print(f"Warm-up {url} non riuscito: {str(e)}")
+
+    await asyncio.gather(
+        touch(openrouter_http, WARM_UP_URLS[0]),
+        touch(stability_http, WARM_UP_URLS[1]),
+    )
+
+
+def warm_up():
+    """Warm-up del loop in background (wrapper sincroni e pre-generazione)."""
+    run_sync(warm_up_async())
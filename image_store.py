@@ -0,0 +1,170 @@
+'''
+Archivio delle immagini generate, suddiviso in sottocartelle.
+
+Ogni generazione ha un proprio file <cartella>/ab/cd/immagine_adv_{id}.jpg: le
+sottocartelle sono le prime cifre dell'hash del nome logico, così nessuna cartella
+cresce oltre poche decine di file anche con centinaia di migliaia di generazioni e
+il path salvato identifica sempre una sola generazione. La scrittura passa da un
+file temporaneo nella stessa cartella e un rename atomico: un crash non lascia mai
+immagini troncate al loro posto.
+
+Il manifest (SQLite) associa il nome logico a path, dimensione, hash del contenuto
+e risoluzione. Immagini con contenuto identico (seed fisso, cache delle immagini)
+non occupano spazio due volte: il nuovo path è un hard link al file già presente.
+resolve() trova anche i path salvati prima dello sharding
+("Immagini Generate\\immagine_adv_1.jpg" nei CSV esistenti) e va usato ovunque
+si legga un path_immagine_generata salvato.
+'''
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from caching import link_or_copy
+
+IMAGE_STORE_FOLDER = "Immagini Generate"
+MANIFEST_FILE = "manifest.db"
+SHARD_LEVELS = 2  # sottocartelle annidate
+SHARD_WIDTH = 2  # cifre esadecimali per livello (256 cartelle per livello)
+
+
+class ImageStore:
+    def __init__(self, folder=IMAGE_STORE_FOLDER, extension=".jpg"):
+        self.folder = folder
+        self.extension = extension
+        self.manifest_path = os.path.join(folder, MANIFEST_FILE)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        # Apertura pigra, come per PersistentCache
+        if self._conn is None:
+            os.makedirs(self.folder, exist_ok=True)
+            self._conn = sqlite3.connect(self.manifest_path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS immagini (
+                nome TEXT PRIMARY KEY,
+                path TEXT,
+                hash TEXT,
+                dimensione INTEGER,
+                larghezza INTEGER,
+                altezza INTEGER,
+                creata REAL
+            )''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_immagini_hash ON immagini(hash)")
+            self._conn.commit()
+        return self._conn
+
+    def path_for_name(self, name):
+        """Path della generazione name: shard dall'hash del nome, un file per generazione."""
+        digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+        return os.path.join(self.folder, *shards, name).replace("\\", "/")
+
+    def temp_path(self):
+        """File temporaneo nella cartella dell'archivio (stesso filesystem: rename atomico)."""
+        tmp_folder = os.path.join(self.folder, ".tmp")
+        os.makedirs(tmp_folder, exist_ok=True)
+        return os.path.join(tmp_folder, f"{uuid.uuid4().hex}.part")
+
+    def commit(self, tmp_path, name):
+        """Sposta nell'archivio il file temporaneo scritto per l'immagine name e ne restituisce il path."""
+        from PIL import Image
+
+        digest = hashlib.sha256()
+        with open(tmp_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+            os.fsync(f.fileno())
+        digest = digest.hexdigest()
+        with Image.open(tmp_path) as image:
+            width, height = image.size
+        size = os.path.getsize(tmp_path)
+
+        path = self.path_for_name(name)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            same_content = self._connection().execute(
+                "SELECT path FROM immagini WHERE hash = ? AND path != ?", (digest, path)).fetchall()
+            existing = next((row[0] for row in same_content if os.path.exists(row[0])), None)
+            if existing:
+                # Contenuto già presente: hard link (stesso inode), il path resta per generazione
+                os.remove(tmp_path)
+                link_or_copy(existing, path)
+            else:
+                os.replace(tmp_path, path)
+            self._conn.execute('''
+                INSERT INTO immagini (nome, path, hash, dimensione, larghezza, altezza, creata)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(nome) DO UPDATE SET
+                    path = excluded.path, hash = excluded.hash, dimensione = excluded.dimensione,
+                    larghezza = excluded.larghezza, altezza = excluded.altezza, creata = excluded.creata''',
+                (name, path, digest, size, width, height, time.time()))
+            self._conn.commit()
+        return path
+
+    def put_file(self, source, name, move=False):
+        """Aggiunge all'archivio un file esistente (copiato, o spostato con move=True)."""
+        tmp_path = self.temp_path()
+        if move:
+            os.replace(source, tmp_path)
+        else:
+            shutil.copyfile(source, tmp_path)
+        return self.commit(tmp_path, name)
+
+    def get(self, name):
+        """Voce del manifest per il nome logico (dict) o None."""
+        with self._lock:
+            row = self._connection().execute(
+                '''SELECT nome, path, hash, dimensione, larghezza, altezza, creata
+                   FROM immagini WHERE nome = ?''', (name,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("nome", "path", "hash", "dimensione", "larghezza", "altezza", "creata"), row))
+
+    def resolve(self, stored_path):
+        """Path reale di un'immagine a partire dal valore salvato (anche pre-sharding); None se non esiste."""
+        if not stored_path:
+            return None
+        normalized = stored_path.replace("\\", "/")
+        if os.path.exists(normalized):
+            return normalized
+        entry = self.get(os.path.basename(normalized))
+        if entry and os.path.exists(entry["path"]):
+            return entry["path"]
+        return None
+
+    def remove(self, name, before_delete=None):
+        """Elimina l'immagine name; gli hard link delle altre generazioni restano validi.
+
+        before_delete(path) viene chiamata prima di cancellare il file (es. per le rendition).
+        """
+        with self._lock:
+            row = self._connection().execute("SELECT path FROM immagini WHERE nome = ?", (name,)).fetchone()
+            if row is None:
+                return
+            self._conn.execute("DELETE FROM immagini WHERE nome = ?", (name,))
+            self._conn.commit()
+            # Il path è solo di questa generazione: gli hard link delle altre non vengono toccati
+            if os.path.exists(row[0]):
+                if before_delete:
+                    before_delete(row[0])
+                os.remove(row[0])
+
+    def stats(self):
+        with self._lock:
+            images, files, total = self._connection().execute('''
+                SELECT SUM(immagini), COUNT(*), COALESCE(SUM(dimensione), 0)
+                FROM (SELECT COUNT(*) AS immagini, MAX(dimensione) AS dimensione FROM immagini GROUP BY hash)
+            ''').fetchone()
+        # file = contenuti distinti su disco (gli hard link non occupano spazio in più)
+        return {"immagini": images or 0, "file": files, "byte": total}
+
+
+def generated_image_name(generation_id):
+    """Nome logico dell'immagine di una generazione (lo stesso usato prima dello sharding)."""
+    return f"immagine_adv_{generation_id}.jpg"
@@ -1,6 +1,25 @@
+import sys
+from startup_profile import PROFILE_FLAG, is_profiling_child, profile_startup # --profile-startup
+if __name__ == "__main__" and PROFILE_FLAG in sys.argv:
+    sys.exit(profile_startup(__file__))  # report dei tempi di avvio, senza avviare l'app
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import gradio as gr
 import pandas as pd
-from models import generate_fashion_prompt, generate_adv_image # funzioni usate per la generazione
+from models import generate_fashion_prompt, generate_adv_image # funzioni usate per la pre-generazione
+from models import generate_fashion_prompt_async, generate_adv_image_async # funzioni (async) usate per la generazione
+from models import stream_fashion_prompt_async # prompt del VLM token per token
+from models import IMAGE_STORE # archivio a shard delle immagini generate
+from image_store import generated_image_name
+from repository import CsvRepository, SqliteRepository # dati in memoria con indici / database SQLite
+from session_store import SessionStore # stato separato per ogni partecipante
+from http_clients import warm_up, warm_up_async # connessioni HTTP aperte in anticipo
+from renditions import create_renditions, get_rendition, remove_renditions # immagini ridotte per il browser
+from traduzioni import (build_english_description, CORRENTI_ARTISTICHE, COLORI, GENERI_MUSICALI,
+                        COSA_CERCHI_NEI_CAPI, MARCHI) # descrizione inglese e opzioni delle liste
 
 # Inizializza i file e i dataset
 data_file = "registrazioni.csv"
@@ -9,15 +28,40 @@ IMMAGINI_GENERATE_FILE = "immagini_generate.csv"
 IMMAGINI_BASELINE_FILE = "immagini_baseline.csv"
 questions_file = "domande.csv"
 QUESTION_SET_ID = 1
+# Dove salvare i dati: "csv" (file CSV append-only) oppure "sqlite" (scrittura diretta
+# su fashion_database.db, eseguire prima OneTimeScript_migra_csv_sqlite.py)
+STORAGE_BACKEND = "csv"
+DATABASE_PATH = "fashion_database.db"
+# Dimensione massima (byte) di un segmento CSV prima del rollover; None = file unico
+CSV_SEGMENT_MAX_BYTES = None
+
+# Colonne dei CSV scritti dall'applicazione
+REGISTRATION_COLUMNS = [
+    "idUtente", "nome", "cognome", "eta", "nazione", "genere",
+    "corrente_artistica_preferita", "professione",
+    "colori_preferiti", "generi_musicali_preferiti",
+    "cosa_cerchi_nei_capi", "marchi_preferiti",
+    "competenza_moda", "interesse_moda"
+]
+GENERATION_COLUMNS = [
+    "idGenerazione", "id_immagine_baseline", "prompt_text_to_image",
+    "data_ora", "path_immagine_generata"
+]
 
-# Usata per memorizzare l'ordine casuale per ogni tab
-DISPLAY_ORDERS = {}
-# Usata per controllare le generazioni
-GENERATED_TABS = {}
-
-# Variabili globali id utente, immagini baseline
-CURRENT_USER_ID = None  # Sarà impostato dopo la registrazione
-CURRENT_USER_GENDER = None  # Utile per determinare le immagini da mostrare
+# Concorrenza: richieste gestite in parallelo dalla coda di Gradio
+DEFAULT_CONCURRENCY_LIMIT = 16
+GENERATION_CONCURRENCY_LIMIT = 8  # generazioni (Gemini + Stable Diffusion) contemporanee, condivise tra le tab
+QUESTIONNAIRE_CONCURRENCY_LIMIT = 16  # invii del questionario contemporanei
+# Secondi di inattività dopo i quali la sessione di un partecipante viene eliminata
+SESSION_TTL = 2 * 60 * 60
+# Pre-generazione speculativa: dopo la registrazione le 4 immagini vengono generate
+# in background, così "Genera" restituisce un risultato già pronto (o in corso)
+PREGENERATE = False
+PREGENERATE_WORKERS = 4  # generazioni in background contemporanee (tra tutti gli utenti)
+# Prompt del VLM mostrato nella tab man mano che viene scritto (False = solo spinner fino all'immagine)
+STREAM_PROMPT = True
+
+# Immagini baseline
 BASELINE_IMAGES = {
     "Uomo": {
         1: "Immagini Baseline/uomo/baseline1.jpg",
@@ -33,10 +77,8 @@ BASELINE_IMAGES = {
     }
 }
 
-# Se immagini_baseline.csv non esiste lo crea altrimenti lo apre
-try:
-    df_baseline = pd.read_csv(IMMAGINI_BASELINE_FILE)
-except FileNotFoundError:
+# Se immagini_baseline.csv non esiste lo crea (le baseline vengono poi lette dal repository)
+if not os.path.exists(IMMAGINI_BASELINE_FILE):
     baseline_data = []
     idImmagine = 1
     for genere in ["Uomo", "Donna"]:
@@ -51,71 +93,35 @@ except FileNotFoundError:
     df_baseline = pd.DataFrame(baseline_data)
     df_baseline.to_csv(IMMAGINI_BASELINE_FILE, index=False)
 
-# idem ma per questionario
-try:
-    questionnaire_data = pd.read_csv(questionnaire_file)
-    if not questionnaire_data.empty and 'idQuestionario' in questionnaire_data.columns:
-        next_questionnaire_id = questionnaire_data['idQuestionario'].max() + 1
-    else:
-        next_questionnaire_id = 1
-except (FileNotFoundError, ValueError):
-    next_questionnaire_id = 1
-    
-next_generation_id = 1
-
-# idem ma per dataset utenti
-try:
-    # Legge il file esistente con encoding UTF-8
-    dataset = pd.read_csv(data_file, encoding='utf-8', engine='python')
-    # Calcola il prossimo ID
-    next_id = dataset['idUtente'].max() + 1 if not dataset.empty else 1
-except FileNotFoundError:
-    # Crea nuovo dataset
-    dataset = pd.DataFrame(columns=[
-        "idUtente", "nome", "cognome", "eta", "nazione", "genere", 
-        "corrente_artistica_preferita", "professione",
-        "colori_preferiti", "generi_musicali_preferiti", 
-        "cosa_cerchi_nei_capi", "marchi_preferiti",
-        "competenza_moda", "interesse_moda"
-    ])
-    dataset.to_csv(data_file, index=False, encoding='utf-8-sig')
-    next_id = 1  # Parte da 1 per il primo utente
+# Caricamento Domande sul Sito (letto una volta sola per tutte le tab)
+DEFAULT_QUESTIONS = ("Domanda 1", "Domanda 2", "Domanda 3")  # tupla come il risultato in cache
 
-# idem ma per dataset immagini generate
-try:
-    immagini_generate = pd.read_csv(IMMAGINI_GENERATE_FILE)
-    if 'idGenerazione' in immagini_generate.columns:
-        next_generation_id = immagini_generate['idGenerazione'].max() + 1
-    else:
-        next_generation_id = 1
-except FileNotFoundError:
-    next_generation_id = 1
-
-# Caricamento Domande sul Sito
+@lru_cache(maxsize=None)
 def load_questions(file_path, question_set_id=QUESTION_SET_ID):
     try:
         df = pd.read_csv(file_path)
         # Filtra per id_set e seleziona le colonne delle domande
         selected = df[df["id_set"] == question_set_id]
         if selected.empty:
-            return ["Domanda 1", "Domanda 2", "Domanda 3"]  # Default
+            return DEFAULT_QUESTIONS
         
         # Estrai le domande (ignora la colonna id_set)
         questions = selected.iloc[0, 1:].dropna().tolist()
-        return [q.strip() for q in questions if q.strip()]
+        return tuple(q.strip() for q in questions if q.strip())
         
     except FileNotFoundError:
-        return ["Domanda 1", "Domanda 2", "Domanda 3"]
+        return DEFAULT_QUESTIONS
     except Exception as e:
         print(f"Errore nel caricamento delle domande: {str(e)}")
-        return ["Domanda 1", "Domanda 2", "Domanda 3"]
+        return DEFAULT_QUESTIONS
 
 # INIZIALIZZAZIONE DATASET QUESTIONARI CON DOMANDE DINAMICHE
 max_questions = 6  # Numero massimo di domande per set (domanda1-domanda6)
 required_columns = ["idQuestionario", "idUtente", "id_immagine_generata", "id_set_domande"]
 
 try:
-    questionnaire_data = pd.read_csv(questionnaire_file, encoding='utf-8')
+    # Basta l'intestazione per verificare la struttura
+    questionnaire_data = pd.read_csv(questionnaire_file, encoding='utf-8', nrows=0)
     
     # Verifica struttura corretta
     if not all(col in questionnaire_data.columns for col in required_columns) or \
@@ -129,11 +135,86 @@ except (FileNotFoundError, ValueError):
     questionnaire_data = pd.DataFrame(columns=required_columns + question_columns)
     questionnaire_data.to_csv(questionnaire_file, index=False, encoding='utf-8-sig')
 
+# Repository unico del processo
+if STORAGE_BACKEND == "sqlite":
+    # Scrittura transazionale su SQLite (WAL), id assegnati dal database
+    repository = SqliteRepository(DATABASE_PATH, IMMAGINI_BASELINE_FILE)
+else:
+    # Legge i CSV una volta e mantiene gli indici aggiornati
+    repository = CsvRepository(
+        data_file, questionnaire_file, IMMAGINI_GENERATE_FILE, IMMAGINI_BASELINE_FILE,
+        REGISTRATION_COLUMNS,
+        required_columns + [f"domanda{i}" for i in range(1, max_questions + 1)],
+        GENERATION_COLUMNS,
+        segment_max_bytes=CSV_SEGMENT_MAX_BYTES
+    )
+
+# Pre-generazione in background (PREGENERATE = True)
+pregeneration_pool = ThreadPoolExecutor(max_workers=PREGENERATE_WORKERS,
+                                        thread_name_prefix="pregenerazione") if PREGENERATE else None
+
+def pregenerate_image(baseline_path, user_description):
+    # Eseguita nel pool: prompt + immagine, il record viene salvato solo quando l'utente apre la tab
+    prompt_text_to_image = generate_fashion_prompt(image_path=baseline_path, user_description=user_description)
+    generation_id = repository.reserve_generation_id()
+    try:
+        generated_path = generate_adv_image(prompt_text_to_image, generation_id)
+    except Exception:
+        repository.release_generation_id(generation_id)
+        raise
+    get_rendition(generated_path)  # pronta anche la versione da mostrare
+    return generation_id, prompt_text_to_image, generated_path
+
+def schedule_pregeneration(session):
+    for tab_number in BASELINE_IMAGES[session.gender]:
+        baseline_path = BASELINE_IMAGES[session.gender][tab_number]
+        session.pregenerated[tab_number] = pregeneration_pool.submit(
+            pregenerate_image, baseline_path, session.description_eng)
+
+def discard_pregeneration(future):
+    # Risultato mai mostrato: libera l'id riservato ed elimina l'immagine
+    def cleanup(done):
+        if done.cancelled() or done.exception() is not None:
+            return
+        generation_id, _, _ = done.result()
+        repository.release_generation_id(generation_id)
+        IMAGE_STORE.remove(generated_image_name(generation_id), before_delete=remove_renditions)
+
+    if not future.cancel():
+        future.add_done_callback(cleanup)
+
+def discard_session_pregenerations(session):
+    with session.lock:
+        futures = list(session.pregenerated.values())
+        session.pregenerated = {}
+    for future in futures:
+        discard_pregeneration(future)
+
+async def take_pregenerated(session, tab_number):
+    """Restituisce (id, prompt, path) pre-generati per la tab, None se non disponibili."""
+    with session.lock:
+        future = session.pregenerated.pop(tab_number, None)
+    if future is None:
+        return None
+    try:
+        # Attende la generazione ancora in corso senza bloccare l'event loop
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        discard_pregeneration(future)
+        raise
+    except Exception as e:
+        print(f"Pre-generazione tab {tab_number} fallita, genero ora: {str(e)}")
+        return None
+
+# Stato per sessione (id utente, genere, ordine immagini, tab generate):
+# ogni scheda del browser ha il proprio, indicizzato dal session_hash di Gradio
+sessions = SessionStore(ttl=SESSION_TTL, on_evict=discard_session_pregenerations)
+
 # Funzioni per la gestione
 def handle_registration(name, cognome, eta, nazione, genere, corrente_artistica, 
                       professione, colori_preferiti, generi_musicali, cerca_nei_capi, 
-                      marchi_preferiti, competenza_moda, interesse_moda):
-    global CURRENT_USER_ID, CURRENT_USER_GENDER, next_id, dataset, GENERATED_TABS
+                      marchi_preferiti, competenza_moda, interesse_moda, request: gr.Request):
+    session = sessions.get(request.session_hash)
     error_messages = []
     
     # Validazione campi obbligatori
@@ -175,9 +256,8 @@ def handle_registration(name, cognome, eta, nazione, genere, corrente_artistica,
     if error_messages:
         return "\n".join(error_messages)
     
-    # Creazione nuovo utente con ID
+    # Creazione nuovo utente (l'ID viene assegnato dal repository)
     new_entry = {
-        "idUtente": next_id,
         "nome": name.strip(), 
         "cognome": cognome.strip(),
         "eta": int(eta),
@@ -193,38 +273,25 @@ def handle_registration(name, cognome, eta, nazione, genere, corrente_artistica,
         "interesse_moda": int(interesse_moda)
     }
     
-    # Memorizzazione dell'id utente corrente
-    CURRENT_USER_ID = next_id
-    CURRENT_USER_GENDER = genere # e del genere corrente
-
-    # Resetta le generazioni per il nuovo utente
-    GENERATED_TABS = {}
-
-    # Salvataggio dati
-    dataset = pd.concat([dataset, pd.DataFrame([new_entry])], ignore_index=True)
-    dataset.to_csv(data_file, index=False, encoding='utf-8-sig')
+    # Salvataggio dati (append di una sola riga) e memorizzazione nella sessione dell'id utente
+    user_id = repository.add_registration(new_entry)
     
-    # Incrementa ID per prossimo utente
-    next_id += 1
-    
-    # Stringa (ITA) Utente Globale per Essere Passata a Gemini
-    # Stringa da rivedere togliendo le cose che sono superflue (es. salario, stato civile)
-    descrizione_utente_ita = (
-        "Genere: " + genere + "\n" +
-        f"Età: {eta} \n" +
-        "Nazione: " + nazione + "\n" +
-        "Professione: " + professione + "\n" +
-        "Corrente artistica preferita: " + corrente_artistica + "\n" +
-        f"{'Marchi' if len(marchi_preferiti) > 1 else 'Marchio'} Preferit{'i' if len(marchi_preferiti) > 1 else 'o'}: {', '.join(marchi_preferiti)}" + "\n"+
-        f"{'Generi' if len(generi_musicali) > 1 else 'Genere'} Musical{'i' if len(generi_musicali) > 1 else 'e'} Preferit{'i' if len(generi_musicali) > 1 else 'o'}: {', '.join(generi_musicali).lower()}" + "\n"+
-        f"Cosa Ricerca nei Capi che Indossa: {', '.join(cerca_nei_capi).lower()}" + "\n"+
-        f"{'Colori' if len(colori_preferiti) > 1 else 'Colore'} Preferit{'i' if len(colori_preferiti) > 1 else 'o'}: {', '.join(colori_preferiti).lower()}."
+    # Descrizione utente in inglese (ENG) per agevolare il lavoro di Gemini:
+    # traduzione locale delle liste chiuse, cache per nazione e professione
+    descrizione_utente_eng = build_english_description(
+        genere, eta, nazione, professione, corrente_artistica,
+        marchi_preferiti, generi_musicali, cerca_nei_capi, colori_preferiti
     )
-        
-    # Traduzione in Inglese (ENG) per agevolare il lavoro di Gemini
-    from deep_translator import GoogleTranslator
-    global descrizione_utente_eng
-    descrizione_utente_eng = GoogleTranslator(source="it", target="en").translate(descrizione_utente_ita)
+
+    # Resetta le generazioni per il nuovo utente
+    discard_session_pregenerations(session)
+    with session.lock:
+        session.user_id = user_id
+        session.gender = genere # e del genere corrente
+        session.description_eng = descrizione_utente_eng
+        session.reset()
+        if PREGENERATE:
+            schedule_pregeneration(session)
 
     # Messaggio di conferma
     return f"✅ Registrazione completata per {name} {cognome}!\n"
@@ -239,10 +306,11 @@ def clear_fields():
     )
 
 # FUNZIONE DI GESTIONE QUESTIONARIO
-def handle_questionnaire(tab_number, generated_image_path, questions, *answers):
-    global questionnaire_data, next_questionnaire_id, CURRENT_USER_ID, DISPLAY_ORDERS
-    
-    if not CURRENT_USER_ID:
+def handle_questionnaire(tab_number, generated_image_path, questions, request: gr.Request, *answers):
+    session = sessions.get(request.session_hash)
+    user_id = session.user_id
+
+    if not user_id:
         return "❌ Effettua prima la registrazione!"
     
     # Controlla se l'immagine è stata generata
@@ -255,28 +323,15 @@ def handle_questionnaire(tab_number, generated_image_path, questions, *answers):
             return "❌ Completa tutte le domande prima di inviare!"
     
     # Recupera l'ordine di visualizzazione per questo tab
-    display_order = DISPLAY_ORDERS.get(tab_number, 1)
+    display_order = session.display_orders.get(tab_number, 1)
 
-    # Converti path generated -> ID
-    df_generated = pd.read_csv(IMMAGINI_GENERATE_FILE)
-    generated_row = df_generated[df_generated['path_immagine_generata'] == generated_image_path]
-    if generated_row.empty:
+    # ID della generazione mostrata in questo tab (il path non basta: contenuti identici)
+    generated_id = session.generation_ids.get(tab_number)
+    if generated_id is None:
         return "❌ Errore: Immagine generata non trovata!"
-    generated_id = generated_row['idGenerazione'].values[0]
 
     # +++ INIZIO CONTROLLO DUPPLICATI +++
-    # Carica il dataset aggiornato per evitare cache obsoleta
-    try:
-        current_questionnaire_data = pd.read_csv(questionnaire_file)
-    except FileNotFoundError:
-        current_questionnaire_data = pd.DataFrame()
-
-    existing_entry = current_questionnaire_data[
-        (current_questionnaire_data["idUtente"] == CURRENT_USER_ID) &
-        (current_questionnaire_data["id_immagine_generata"] == generated_id)
-    ]
-
-    if not existing_entry.empty:
+    if repository.has_questionnaire(user_id, generated_id):
         return "❌ Hai già inviato questo questionario per questa immagine!"
     # +++ FINE CONTROLLO DUPPLICATI +++
 
@@ -294,21 +349,17 @@ def handle_questionnaire(tab_number, generated_image_path, questions, *answers):
             processed = ans
         processed_answers.append(processed)
 
-    # Crea nuovo record
+    # Crea nuovo record (l'ID viene assegnato dal repository)
     new_entry = {
-        "idQuestionario": next_questionnaire_id,
-        "idUtente": CURRENT_USER_ID,
+        "idUtente": user_id,
         "id_immagine_generata": generated_id,
         "id_set_domande": QUESTION_SET_ID,
         **{f"domanda{i+1}": a for i, a in enumerate(processed_answers)}
     }
     
-    # Aggiorna dataset
-    questionnaire_data = pd.concat([questionnaire_data, pd.DataFrame([new_entry])], ignore_index=True)
-    questionnaire_data.to_csv(questionnaire_file, index=False, encoding='utf-8-sig')
-    
-    # Incrementa l'ID per il prossimo questionario
-    next_questionnaire_id += 1
+    # Aggiorna dataset (append di una sola riga); None = duplicato arrivato nel frattempo
+    if repository.add_questionnaire(new_entry) is None:
+        return "❌ Hai già inviato questo questionario per questa immagine!"
 
     return "✅ Valutazione salvata correttamente!"
 
@@ -332,45 +383,32 @@ with gr.Blocks(theme=gr.themes.Soft()) as registration_tab:
     # Sezione preferenze artistiche
     corrente_artistica = gr.Dropdown(
         label="Corrente Artistica Preferita*",
-        choices=sorted([
-            "Avant-Garde", "Tradizionalismo", "Surrealismo", "Futurismo", "Minimalismo", "Barocco",
-            "Decostruttivismo", "Pop-Art", "Neo-Classicismo", "Gothic", "Post-Modernismo",
-            "Art Déco", "Romanticismo", "Tribalismo", "Eco-Fashion", "Streetwear"
-        ])
+        choices=sorted(CORRENTI_ARTISTICHE)
     )
     
     # Preferenze personali
     with gr.Row():
         colori_preferiti = gr.CheckboxGroup(
             label="Colori Preferiti* (max 2)",
-            choices=sorted([
-                "Nero", "Bianco", "Rosso", "Verde", "Giallo", "Arancione", "Blu", "Rosa",
-                "Celeste", "Magenta", "Marrone", "Bordeaux", "Turchese", "Viola"
-            ]),
+            choices=sorted(COLORI),
             scale=1
         )
     with gr.Row():
         generi_musicali = gr.CheckboxGroup(
             label="Generi Musicali Preferiti* (max 2)",
-            choices=sorted(["Rock", "Rap", "RnB", "Pop", "House", "Techno", "Metal", "Jazz", "Country", "Blues", "Classica"]),
+            choices=sorted(GENERI_MUSICALI),
             scale=1
         )
     with gr.Row():
         cerca_nei_capi = gr.CheckboxGroup(
             label="Cosa cerchi nei capi che indossi?* (max 3)",
-            choices=sorted(["Sicurezza", "Eleganza", "Audacia", "Originalità", "Comodità", 
-                           "Versatilità", "Libertà", "Seduttività", "Misteriosità", "Tradizionalità"]),
+            choices=sorted(COSA_CERCHI_NEI_CAPI),
             scale=1
         )
     with gr.Row():
         marchi_preferiti = gr.CheckboxGroup(
             label="Marchi Preferiti* (max 2)",
-            choices=sorted([
-                "Rick Owens", "Gucci", "Yves Saint Laurent", "Miu Miu", "Coperni",
-                "Stella McCartney", "Isabel Marant", "Junya Watanabe", "Dior",
-                "André Courrèges", "Jil Sander", "Ralph Lauren", "Bottega Veneta",
-                "Giorgio Armani", "Louis Vuitton", "Versace"
-            ]),
+            choices=sorted(MARCHI),
             scale=1
         )
     with gr.Row():
@@ -409,61 +447,44 @@ with gr.Blocks(theme=gr.themes.Soft()) as registration_tab:
 
 # Tab 2.*: Generazione Immagini
 # Funzione per gestire le immagini generate
-def save_generation_data(baseline_image_path, prompt_text_to_image, generated_image_path):
-    global next_generation_id, CURRENT_USER_ID
+def save_generation_data(generation_id, baseline_image_path, prompt_text_to_image, generated_image_path):
     import datetime
-    import os
 
-    # Carica il dataset delle baseline
-    df_baseline = pd.read_csv(IMMAGINI_BASELINE_FILE)
-    
     # Trova l'ID corrispondente al path
-    baseline_row = df_baseline[df_baseline['path_immagine'] == baseline_image_path]
-    if baseline_row.empty:
+    id_immagine_baseline = repository.get_baseline_id(baseline_image_path)
+    if id_immagine_baseline is None:
         raise ValueError(f"Path baseline {baseline_image_path} non trovato nel database")
 
-    id_immagine_baseline = baseline_row['idImmagine'].values[0]
-
     # Crea il nuovo record
     new_entry = {
-        "idGenerazione": next_generation_id,
+        "idGenerazione": generation_id,
         "id_immagine_baseline": id_immagine_baseline,
         "prompt_text_to_image": prompt_text_to_image,
         "data_ora": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "path_immagine_generata": generated_image_path
     }
     
-    # Salvataggio
+    # Salvataggio (append di una sola riga)
     try:
-        df = pd.read_csv(IMMAGINI_GENERATE_FILE) if os.path.exists(IMMAGINI_GENERATE_FILE) else pd.DataFrame()
-        df = pd.concat([df, pd.DataFrame([new_entry])], ignore_index=True)
-        df.to_csv(IMMAGINI_GENERATE_FILE, index=False, encoding='utf-8-sig')
-        next_generation_id += 1
+        repository.add_generation(new_entry)
     except Exception as e:
-        if os.path.exists(generated_image_path):
-            os.remove(generated_image_path)
+        IMAGE_STORE.remove(generated_image_name(generation_id), before_delete=remove_renditions)
         raise
     
 
 # Gestione tab in base al genere
-def get_baseline_image(tab_number):
-    if not CURRENT_USER_GENDER:
+def get_baseline_image(gender, tab_number):
+    if not gender:
         raise gr.Error("Effettua prima la registrazione!")
     
     try:
-        df_baseline = pd.read_csv(IMMAGINI_BASELINE_FILE)
-        expected_path = BASELINE_IMAGES[CURRENT_USER_GENDER][tab_number]
+        expected_path = BASELINE_IMAGES[gender][tab_number]
         
         # Cerca il path esatto nel database
-        baseline_row = df_baseline[
-            (df_baseline['genere_del_capo'] == CURRENT_USER_GENDER) &
-            (df_baseline['path_immagine'] == expected_path)
-        ]
-        
-        if not baseline_row.empty:
-            return baseline_row['path_immagine'].values[0]
+        if repository.has_baseline(gender, expected_path):
+            return expected_path
         else:
-            raise gr.Error(f"Immagine baseline per {CURRENT_USER_GENDER} tab {tab_number} non trovata nel database")
+            raise gr.Error(f"Immagine baseline per {gender} tab {tab_number} non trovata nel database")
             
     except KeyError as e:
         raise gr.Error(f"Configurazione baseline mancante: {str(e)}")
@@ -471,96 +492,123 @@ def get_baseline_image(tab_number):
         raise gr.Error(f"Errore nel recupero baseline: {str(e)}")
 
 def get_baseline_from_generated(generated_id):
-    df_generated = pd.read_csv(IMMAGINI_GENERATE_FILE)
-    generated_row = df_generated[df_generated['idGenerazione'] == generated_id]
-    
-    if not generated_row.empty:
-        baseline_id = generated_row['id_immagine_baseline'].values[0]
-        df_baseline = pd.read_csv(IMMAGINI_BASELINE_FILE)
-        return df_baseline[df_baseline['idImmagine'] == baseline_id]['path_immagine'].values[0]
-    return None
-
-def save_generated_image(tab_number):
-    global next_generation_id, CURRENT_USER_ID, CURRENT_USER_GENDER, DISPLAY_ORDERS, GENERATED_TABS
+    return repository.get_baseline_path_for_generation(generated_id)
 
-    # Controlla se il tab è già stato generato
-    if GENERATED_TABS.get(tab_number, False):
-        raise gr.Error("Hai già generato un'immagine per questa tab. Procedi con la valutazione!")
+def display_renditions(baseline_path, generated_path):
+    # Creazione una tantum: le baseline vengono ridotte al primo utilizzo
+    try:
+        create_renditions(generated_path)
+    except Exception as e:
+        print(f"Rendition di {generated_path} non create: {str(e)}")
+    return get_rendition(baseline_path), get_rendition(generated_path)
+
+async def save_generated_image(tab_number, request: gr.Request):
+    # Handler async: durante le chiamate a Gemini e Stable Diffusion l'event loop
+    # resta libero per le altre generazioni invece di occupare un thread ciascuna.
+    # È un generatore: con STREAM_PROMPT il prompt parziale viene inviato alla tab
+    # a ogni token, l'ultimo valore contiene le immagini
+    session = sessions.get(request.session_hash)
+
+    # Controlla se il tab è già stato generato (o se una generazione è in corso)
+    with session.lock:
+        if session.generated_tabs.get(tab_number, False) or tab_number in session.pending_tabs:
+            raise gr.Error("Hai già generato un'immagine per questa tab. Procedi con la valutazione!")
+        session.pending_tabs.add(tab_number)
+        user_id, gender = session.user_id, session.gender
 
     try:
-        if not CURRENT_USER_ID:
+        if not user_id:
             raise gr.Error("Effettua prima la registrazione!")
         
         # Controllo tab precedenti compilate per tab > 1
         if tab_number > 1:
             try:
                 # Ottieni la baseline del tab precedente
-                prev_baseline_path = get_baseline_image(tab_number - 1)
+                prev_baseline_path = get_baseline_image(gender, tab_number - 1)
                 
                 # Cerca l'ID baseline corrispondente
-                df_baseline = pd.read_csv(IMMAGINI_BASELINE_FILE)
-                prev_baseline_row = df_baseline[df_baseline['path_immagine'] == prev_baseline_path]
-                if prev_baseline_row.empty:
+                prev_baseline_id = repository.get_baseline_id(prev_baseline_path)
+                if prev_baseline_id is None:
                     raise gr.Error("Baseline precedente non trovata")
-                prev_baseline_id = prev_baseline_row['idImmagine'].values[0]
 
-                # Recupera TUTTE le generazioni per questa baseline
-                df_generated = pd.read_csv(IMMAGINI_GENERATE_FILE)
-                prev_generations = df_generated[df_generated['id_immagine_baseline'] == prev_baseline_id]
-                
-                if prev_generations.empty:
+                # Esiste almeno una generazione per questa baseline?
+                if not repository.has_generations(prev_baseline_id):
                     raise gr.Error(f"Genera prima l'immagine nella Tab {tab_number - 1}!")
 
-                # Cerca nei questionari se esiste una risposta per queste generazioni
-                df_questionario = pd.read_csv(questionnaire_file)
-                prev_completed = df_questionario[
-                    (df_questionario['id_immagine_generata'].isin(prev_generations['idGenerazione'])) &
-                    (df_questionario['idUtente'] == CURRENT_USER_ID)
-                ]
-                
-                if prev_completed.empty:
+                # L'utente ha compilato un questionario per una di queste generazioni?
+                if not repository.has_completed_baseline(user_id, prev_baseline_id):
                     raise gr.Error(f"Completa il questionario nella Tab {tab_number - 1}!")
 
             except Exception as e:
                 raise gr.Error(f"Errore controllo tab precedente: {str(e)}")
 
         # Generazione Immagine
-        baseline_path = get_baseline_image(tab_number)
-        
-        prompt_text_to_image = generate_fashion_prompt(
-            image_path=baseline_path,
-            user_description=descrizione_utente_eng
-        )
+        baseline_path = get_baseline_image(gender, tab_number)
+
+        # Risultato della pre-generazione (già pronto o ancora in corso)
+        pregenerated = await take_pregenerated(session, tab_number)
+        if pregenerated:
+            generation_id, prompt_text_to_image, generated_path = pregenerated
+        elif STREAM_PROMPT:
+            async for prompt_text_to_image in stream_fashion_prompt_async(
+                image_path=baseline_path,
+                user_description=session.description_eng
+            ):
+                yield gr.update(), gr.update(), gr.update(), prompt_text_to_image
+            # Prompt definitivo: la richiesta dell'immagine parte subito
+            generation_id = repository.reserve_generation_id()
+        else:
+            prompt_text_to_image = await generate_fashion_prompt_async(
+                image_path=baseline_path,
+                user_description=session.description_eng
+            )
+            generation_id = repository.reserve_generation_id()
         
         import random
         display_order = random.randint(1, 2)
-        DISPLAY_ORDERS[tab_number] = display_order
 
-        generated_path = generate_adv_image(prompt_text_to_image, next_generation_id)
-        
-        if display_order == 1:
-            left_image, right_image = baseline_path, generated_path
-        else:
-            left_image, right_image = generated_path, baseline_path
+        try:
+            if not pregenerated:
+                generated_path = await generate_adv_image_async(prompt_text_to_image, generation_id)
 
-        import os
-        if not os.path.exists(generated_path):
-            raise FileNotFoundError(f"Immagine generata non trovata: {generated_path}")
+            if not os.path.exists(generated_path):
+                raise FileNotFoundError(f"Immagine generata non trovata: {generated_path}")
 
-        save_generation_data(
-            baseline_path,
-            prompt_text_to_image,
-            generated_path
-        )
+            # Scrittura con fsync: eseguita in un thread per non bloccare l'event loop
+            await asyncio.to_thread(
+                save_generation_data,
+                generation_id,
+                baseline_path,
+                prompt_text_to_image,
+                generated_path
+            )
+        except Exception:
+            # Libera l'id riservato (con SQLite elimina la riga segnaposto)
+            repository.release_generation_id(generation_id)
+            raise
+
+        # Nel browser vanno le rendition (ridotte), lo stato conserva il path originale
+        baseline_display, generated_display = await asyncio.to_thread(
+            display_renditions, baseline_path, generated_path)
+        if display_order == 1:
+            left_image, right_image = baseline_display, generated_display
+        else:
+            left_image, right_image = generated_display, baseline_display
 
         # Dopo il salvataggio riuscito, segna il tab come generato
-        GENERATED_TABS[tab_number] = True
+        with session.lock:
+            session.display_orders[tab_number] = display_order
+            session.generated_tabs[tab_number] = True
+            session.generation_ids[tab_number] = generation_id
         
-        return left_image, right_image, generated_path
+        yield left_image, right_image, generated_path, prompt_text_to_image
         
     except Exception as e:
         print(f"RIPROVA! Errore durante la generazione: {str(e)}")
         raise gr.Error(f"RIPROVA! Errore durante la generazione: {str(e)}")
+    finally:
+        with session.lock:
+            session.pending_tabs.discard(tab_number)
 
 def disable_generate():
             return gr.update(interactive=False)
@@ -577,13 +625,17 @@ def create_image_tab(tab_number):
                 img_right = gr.Image(label="Immagine Destra", interactive=False, height=600, width=600)
         
         generate_btn = gr.Button("Genera")
+        prompt_box = gr.Textbox(label="Prompt generato", interactive=False, lines=3, visible=STREAM_PROMPT)
         generated_image_path = gr.State(value="")
 
         generate_btn.click(
-            fn=lambda tn=tab_number: save_generated_image(tn),
-            inputs=[],
-            outputs=[img_left, img_right, generated_image_path],
-            show_progress=True
+            fn=save_generated_image,
+            inputs=[gr.State(tab_number)],
+            outputs=[img_left, img_right, generated_image_path, prompt_box],
+            show_progress=True,
+            # Limite condiviso tra le 4 tab (stesso concurrency_id)
+            concurrency_limit=GENERATION_CONCURRENCY_LIMIT,
+            concurrency_id="generazione"
         ).success(
             fn=disable_generate,
             inputs=[],
@@ -650,7 +702,9 @@ def create_image_tab(tab_number):
         submit_btn.click(
             handle_questionnaire,
             [gr.State(tab_number), generated_image_path, gr.State(questions)] + inputs,  # Passa la variabile locale
-            output
+            output,
+            concurrency_limit=QUESTIONNAIRE_CONCURRENCY_LIMIT,
+            concurrency_id="questionario"
         )
     
     return tab
@@ -668,5 +722,20 @@ demo = gr.TabbedInterface(
     ["Registrazione", "Immagine 1", "Immagine 2", "Immagine 3", "Immagine 4"]
 )
 
+# Chiusura/ricarica della scheda: la sessione del partecipante viene liberata
+def close_session(request: gr.Request):
+    sessions.remove(request.session_hash)
+
+with demo:
+    demo.unload(close_session)
+    # All'apertura della pagina le connessioni verso OpenRouter e Stability vengono aperte
+    # sul loop di Gradio, pronte per il primo "Genera"
+    demo.load(warm_up_async, show_progress="hidden")
+demo.queue(default_concurrency_limit=DEFAULT_CONCURRENCY_LIMIT)
+
 if __name__ == "__main__":
+    if is_profiling_child():
+        sys.exit(0)  # --profile-startup: misura solo l'avvio
+    if PREGENERATE:
+        warm_up() # loop in background usato dalla pre-generazione
     demo.launch(server_port=7860) #, share=True (per mettere la pagina online)
\ No newline at end of file
@@ -4,36 +4,75 @@ modello: google/gemini-2.0-flash-exp:free
 link: https://openrouter.ai/google/gemini-2.0-flash-exp:free
 '''
 
-from openai import OpenAI
+import asyncio
 import base64
-import mimetypes
+import hashlib
+import os
+import time
+from functools import lru_cache
+from io import BytesIO
+import aiofiles
+from http_clients import get_openrouter_client, get_http_client, run_sync, STABILITY_API_URL
+from caching import ImageCache, PersistentCache, file_digest, make_key
+from image_store import ImageStore, generated_image_name
 
-def get_image_as_base64(file_path: str) -> str:
-    """Convert a local image file to base64 data URI."""
-    # Legge il file immagine come dati binari
-    with open(file_path, "rb") as image_file:
-        image_data = image_file.read()
-    
-    # Determina il tipo MIME dal percorso del file
-    mime_type, _ = mimetypes.guess_type(file_path)
-    if not mime_type:
-        mime_type = "image/jpeg"  # Default a JPEG
-    
-    # Converte in base64
-    base64_data = base64.b64encode(image_data).decode("utf-8")
-    return f"data:{mime_type};base64,{base64_data}"
+# Immagine inviata al VLM: Gemini lavora a tasselli di 768 px, un lato di 1024 px basta
+VLM_MAX_SIDE = 1024
+VLM_IMAGE_FORMAT = "JPEG"  # oppure "WEBP"
+VLM_IMAGE_QUALITY = 85
+VLM_CACHE_SIZE = 32  # data URI tenuti in memoria (LRU)
+VLM_DISK_CACHE_FOLDER = os.path.join("cache", "vlm")  # copia su disco delle immagini ridotte; None = disattivata
 
-def generate_fashion_prompt(image_path: str, user_description: str) -> str:
-    # Converti immagine in base64
-    data_uri = get_image_as_base64(image_path)
-    
-    # Configurazione client OpenAI con parametri fissi
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key="INSERIRE API KEY di OPEN ROUTER" # Rimossa per motivi di sicurezza
-    )
-    
-    vlm_prompt = """
+@lru_cache(maxsize=VLM_CACHE_SIZE)
+def _encode_for_vlm(file_path: str, mtime_ns: int, size: int) -> str:
+    # mtime_ns e size fanno parte della chiave: se il file cambia la voce non è più valida
+    from PIL import Image, ImageOps
+
+    extension = "webp" if VLM_IMAGE_FORMAT == "WEBP" else "jpg"
+    disk_path = None
+    if VLM_DISK_CACHE_FOLDER:
+        key = hashlib.sha256(f"{file_path}|{mtime_ns}|{size}|{VLM_MAX_SIDE}|{VLM_IMAGE_QUALITY}".encode()).hexdigest()
+        disk_path = os.path.join(VLM_DISK_CACHE_FOLDER, f"{key}.{extension}")
+
+    if disk_path and os.path.exists(disk_path):
+        with open(disk_path, "rb") as cached:
+            image_data = cached.read()
+    else:
+        with Image.open(file_path) as image:
+            original_format = image.format
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail((VLM_MAX_SIDE, VLM_MAX_SIDE), Image.LANCZOS)  # solo riduzione, mai ingrandimento
+            buffer = BytesIO()
+            image.save(buffer, format=VLM_IMAGE_FORMAT, quality=VLM_IMAGE_QUALITY, optimize=True)
+        image_data = buffer.getvalue()
+        if original_format == VLM_IMAGE_FORMAT and size <= len(image_data):
+            # File già compatto: la ricodifica non farebbe risparmiare byte
+            with open(file_path, "rb") as original:
+                image_data = original.read()
+        if disk_path:
+            os.makedirs(VLM_DISK_CACHE_FOLDER, exist_ok=True)
+            tmp_path = f"{disk_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as cached:
+                cached.write(image_data)
+            os.replace(tmp_path, disk_path)
+
+    mime_type = "image/webp" if VLM_IMAGE_FORMAT == "WEBP" else "image/jpeg"
+    return f"data:{mime_type};base64,{base64.b64encode(image_data).decode('utf-8')}"
+
+def get_vlm_image_data_uri(file_path: str) -> str:
+    """Data URI ridotto e ricodificato per il VLM, in cache per (path, mtime, dimensione)."""
+    stat = os.stat(file_path)
+    return _encode_for_vlm(os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+VLM_MODEL = "google/gemini-2.0-flash-exp:free"
+VLM_PARAMS = {"seed": 42, "temperature": 0, "top_p": 0.8}
+VLM_EXTRA_HEADERS = {
+    "HTTP-Referer": "<YOUR_SITE_URL>",
+    "X-Title": "<YOUR_SITE_NAME>"
+}
+
+# Istruzioni per il VLM (seguite dalla descrizione utente)
+VLM_PROMPT = """
     Your task is to generate a detailed and visually compelling prompt to create an advertising (fashion editorial) image.
 
     Instructions:
@@ -46,14 +85,35 @@ def generate_fashion_prompt(image_path: str, user_description: str) -> str:
     7. Output Only the Textual Prompt: No explanations, metadata, or additional commentary—only the generated description. \n
     """
 
+# Con seed e temperatura fissi il prompt dipende solo da (immagine, descrizione, template, modello):
+# i risultati vengono riutilizzati per profili identici
+PROMPT_CACHE_BYPASS = False  # True = chiama sempre il VLM
+PROMPT_CACHE = PersistentCache("prompt_vlm", max_entries=5000, ttl=90 * 24 * 60 * 60)
+
+@lru_cache(maxsize=VLM_CACHE_SIZE)
+def _baseline_digest(file_path: str, mtime_ns: int, size: int) -> str:
+    return file_digest(file_path)
+
+def prompt_cache_key(image_path: str, user_description: str) -> str:
+    stat = os.stat(image_path)
+    image_hash = _baseline_digest(os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+    return make_key(image_hash, user_description, VLM_PROMPT, VLM_MODEL, VLM_PARAMS,
+                    VLM_MAX_SIDE, VLM_IMAGE_FORMAT, VLM_IMAGE_QUALITY)
+
+def _clean_prompt(text: str) -> str:
+    return text.replace("\n", " ").replace("\r", " ")
+
+async def _vlm_messages(image_path: str, user_description: str) -> list:
+    data_uri = await asyncio.to_thread(get_vlm_image_data_uri, image_path)
+
     # Creazione messaggio
-    messages = [
+    return [
         {
             "role": "user",
             "content": [
                 {
                     "type": "text",
-                    "text": vlm_prompt + user_description
+                    "text": VLM_PROMPT + user_description
                 },
                 {
                     "type": "image_url",
@@ -65,25 +125,85 @@ def generate_fashion_prompt(image_path: str, user_description: str) -> str:
         }
     ]
 
-    # Chiamata API
-    completion = client.chat.completions.create(
-        extra_headers={
-            "HTTP-Referer": "<YOUR_SITE_URL>",
-            "X-Title": "<YOUR_SITE_NAME>"
-        },
-        model="google/gemini-2.0-flash-exp:free",
+def generate_fashion_prompt(image_path: str, user_description: str, bypass_cache: bool = False) -> str:
+    # Wrapper sincrono: esegue la versione async sul loop in background (client condivisi)
+    return run_sync(generate_fashion_prompt_async(image_path, user_description, bypass_cache))
+
+async def generate_fashion_prompt_async(image_path: str, user_description: str, bypass_cache: bool = False) -> str:
+    use_cache = PROMPT_CACHE.enabled and not (PROMPT_CACHE_BYPASS or bypass_cache)
+    if use_cache:
+        cache_key = await asyncio.to_thread(prompt_cache_key, image_path, user_description)
+        cached = await asyncio.to_thread(PROMPT_CACHE.get, cache_key)
+        if cached is not None:
+            return cached
+
+    # Immagine ridotta e ricodificata (in cache dopo la prima volta); il ridimensionamento gira in un thread
+    messages = await _vlm_messages(image_path, user_description)
+    
+    # Client OpenAI (async) condiviso con keep-alive, configurato in http_clients.py
+    client = get_openrouter_client()
+
+    # Chiamata API (non blocca l'event loop durante l'attesa)
+    completion = await client.chat.completions.create(
+        extra_headers=VLM_EXTRA_HEADERS,
+        model=VLM_MODEL,
         messages=messages,
-        seed=42,
-        temperature=0,
-        top_p=0.8
+        **VLM_PARAMS
     )
     
     # Pulizia del risultato (elimino \n)
-    testo_pulito = completion.choices[0].message.content.replace("\n", " ").replace("\r", " ")
+    testo_pulito = _clean_prompt(completion.choices[0].message.content)
+
+    if use_cache:
+        await asyncio.to_thread(PROMPT_CACHE.set, cache_key, testo_pulito)
 
     # Ritorna il risultato pulito
     return testo_pulito
 
+async def stream_fashion_prompt_async(image_path: str, user_description: str, bypass_cache: bool = False):
+    """Come generate_fashion_prompt_async, ma produce il prompt parziale man mano che arrivano i token.
+
+    Ogni valore prodotto è il testo accumulato fino a quel momento; l'ultimo è il prompt finale (pulito).
+    """
+    use_cache = PROMPT_CACHE.enabled and not (PROMPT_CACHE_BYPASS or bypass_cache)
+    if use_cache:
+        cache_key = await asyncio.to_thread(prompt_cache_key, image_path, user_description)
+        cached = await asyncio.to_thread(PROMPT_CACHE.get, cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    messages = await _vlm_messages(image_path, user_description)
+    client = get_openrouter_client()
+
+    start = time.perf_counter()
+    first_token = None
+    parts = []
+    stream = await client.chat.completions.create(
+        extra_headers=VLM_EXTRA_HEADERS,
+        model=VLM_MODEL,
+        messages=messages,
+        stream=True,
+        **VLM_PARAMS
+    )
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        parts.append(delta)
+        yield "".join(parts)
+
+    testo_pulito = _clean_prompt("".join(parts))
+    if not testo_pulito.strip():
+        raise ValueError("Il VLM ha restituito un prompt vuoto")
+    print(f"VLM: primo token dopo {first_token:.2f}s, prompt completo dopo {time.perf_counter() - start:.2f}s")
+
+    if use_cache:
+        await asyncio.to_thread(PROMPT_CACHE.set, cache_key, testo_pulito)
+    yield testo_pulito
+
 '''
 usage in another python file:
 
@@ -108,14 +228,22 @@ print(prompt)
 modello: stable diffusion 3.5 large
 link: 
 '''
-import requests
-import os
+# Con seed fisso, a parità di parametri Stability restituisce la stessa immagine:
+# le immagini già generate vengono riutilizzate (hard link) invece di ripetere la generazione
+IMAGE_CACHE_BYPASS = False  # True = chiama sempre Stability
+IMAGE_CACHE = ImageCache(max_bytes=2 * 1024 ** 3)
+# Archivio a shard delle immagini generate (un file per generazione, vedi image_store.py)
+IMAGE_STORE = ImageStore()
 
 def generate_adv_image(generated_prompt: str, generation_id: int) -> str:
+    # Wrapper sincrono: esegue la versione async sul loop in background (client condivisi)
+    return run_sync(generate_adv_image_async(generated_prompt, generation_id))
+
+async def generate_adv_image_async(generated_prompt: str, generation_id: int) -> str:
     try:
         # Configurazione fissa dell'API
         STABILITY_API_KEY = "INSERIRE API KEY di STABILITY AI" # Rimossa per motivi di sicurezza
-        API_URL = "https://api.stability.ai/v2beta/stable-image/generate/sd3"
+        API_URL = STABILITY_API_URL
 
         headers = {
             "Authorization": f"Bearer {STABILITY_API_KEY}",
@@ -130,12 +258,24 @@ def generate_adv_image(generated_prompt: str, generation_id: int) -> str:
             "prompt": (None, generated_prompt),
             "output_format": (None, "jpeg"),
             "steps": (None, "40"),
-            "width": (None, 1024),
-            "height": (None, 1024),
+            "width": (None, "1024"),
+            "height": (None, "1024"),
         }
 
-        # Invio richiesta
-        response = requests.post(API_URL, headers=headers, files=files)
+        # Nome logico dell'immagine; il path reale lo decide l'archivio (shard per hash)
+        nome = generated_image_name(generation_id)
+        tmp_path = IMAGE_STORE.temp_path()
+
+        # Cache indirizzata per contenuto: chiave = hash di tutti i parametri della richiesta
+        use_cache = IMAGE_CACHE.enabled and not IMAGE_CACHE_BYPASS
+        cache_key = make_key(API_URL, {name: value for name, (_, value) in files.items()})
+        if use_cache and await asyncio.to_thread(IMAGE_CACHE.fetch, cache_key, tmp_path):
+            path = await asyncio.to_thread(IMAGE_STORE.commit, tmp_path, nome)
+            print("Immagine dalla cache salvata come " + path)
+            return path
+
+        # Invio richiesta (client HTTP async condiviso: connessione già aperta se in keep-alive)
+        response = await get_http_client().post(API_URL, headers=headers, files=files)
         
         # Verifica che la risposta contenga effettivamente un'immagine
         if not response.content:
@@ -150,33 +290,32 @@ def generate_adv_image(generated_prompt: str, generation_id: int) -> str:
             raise ValueError(f"Contenuto immagine non valido: {str(e)}")
 
         # Inizio Salvataggio:
-        # Creazione cartella se non esiste
-        output_folder = "Immagini Generate"
-        os.makedirs(output_folder, exist_ok=True)
-
-        # Nome immagine
-        nome = os.path.join(output_folder, f"immagine_adv_{generation_id}.jpg")
-
         # Gestione risposta
         if response.status_code == 200:
-            with open(nome, 'wb') as file:
-                file.write(response.content)
-            print("Immagine salvata come " + nome)
+            # File temporaneo + rename atomico nello shard
+            async with aiofiles.open(tmp_path, 'wb') as file:
+                await file.write(response.content)
+            path = await asyncio.to_thread(IMAGE_STORE.commit, tmp_path, nome)
+            print("Immagine salvata come " + path)
         else:
             print(f"Errore: {response.status_code}, {response.text}")
+            path = None
         # Fine Salvataggio.
 
         # Verifica finale del file salvato
-        if not os.path.exists(nome) or os.path.getsize(nome) == 0:
+        if not path or not os.path.exists(path) or os.path.getsize(path) == 0:
             raise IOError("Il file non è stato salvato correttamente")
 
-        return nome
+        if use_cache:
+            await asyncio.to_thread(IMAGE_CACHE.store, cache_key, path)
+
+        return path
 
     except Exception as e:
         print(f"Errore grave durante la generazione: {str(e)}")
         # Pulizia eventuali file parziali
-        if 'nome' in locals() and os.path.exists(nome):
-            os.remove(nome)
+        if 'tmp_path' in locals() and os.path.exists(tmp_path):
+            os.remove(tmp_path)
         raise  # Rilancia l'eccezione
 
 '''
@@ -0,0 +1,267 @@
+'''
+Esecuzione delle query libere della dashboard: sola lettura, a pagine, con limite di tempo.
+
+- connessione in sola lettura (database.connect_readonly): le query non possono scrivere;
+- i risultati arrivano a pagine dal cursore aperto (fetchmany): la pagina successiva
+  riprende dal punto in cui si era fermato il cursore, senza rieseguire la query né
+  usare OFFSET, e al massimo MAX_ROWS righe passano dalla tabella della dashboard;
+- un cursore aperto tiene aperta una transazione di lettura, che in WAL impedisce i
+  checkpoint: viene chiuso appena arriva l'ultima pagina o il limite di righe, e dopo
+  SESSION_IDLE_SECONDS secondi senza richieste di pagine;
+- ogni passo (esecuzione, pagina, blocco di export) ha un limite di tempo controllato
+  dal progress handler di SQLite; cancel() interrompe subito la query in corso;
+- export_query() scrive CSV o Parquet a blocchi di EXPORT_CHUNK_ROWS righe: il
+  risultato completo non viene mai caricato in memoria.
+'''
+import csv
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from database import DATABASE_PATH, connect_readonly
+
+PAGE_SIZE = 500  # righe per pagina nella tabella dei risultati
+MAX_ROWS = 50000  # righe massime sfogliabili nella dashboard (l'export non ha limite)
+QUERY_TIMEOUT_SECONDS = 30  # per esecuzione e per pagina
+EXPORT_TIMEOUT_SECONDS = 600  # per l'intero export
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_FOLDER = Path("cache/export")
+EXPORT_MAX_AGE_SECONDS = 3600  # i file esportati più vecchi vengono eliminati al prossimo export
+SESSION_IDLE_SECONDS = 30  # cursori fermi da più tempo vengono chiusi (fine della transazione di lettura)
+VM_STEPS_PER_CHECK = 1000  # ogni quanti passi della VM si controllano timeout e annullamento
+
+
+class QueryInterrupted(Exception):
+    """Query fermata per timeout o annullata dall'utente."""
+
+
+class QuerySession:
+    """Query in corso su una connessione in sola lettura, letta a pagine dal cursore."""
+
+    def __init__(self, query, database_path=DATABASE_PATH, timeout=QUERY_TIMEOUT_SECONDS, max_rows=MAX_ROWS):
+        self.query = query.strip().rstrip(";")
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.conn = connect_readonly(database_path)
+        self.cursor = None
+        self.columns = []
+        self.fetched = 0
+        self.finished = False  # cursore chiuso: risultato finito, limite raggiunto o inattività
+        self.truncated = False  # il risultato continua oltre max_rows
+        self.expired = False
+        self.steps = 0
+        self.cancelled = False
+        self._idle_timer = None
+        self.last_used = time.monotonic()
+        self._deadline = None
+        self._lock = threading.Lock()
+        self.conn.set_progress_handler(self._progress, VM_STEPS_PER_CHECK)
+
+    def _progress(self):
+        # Un valore diverso da 0 interrompe la query (sqlite3.OperationalError: interrupted)
+        self.steps += VM_STEPS_PER_CHECK
+        return int(self.cancelled or (self._deadline is not None and time.monotonic() > self._deadline))
+
+    def _timed(self, fn, timeout=None):
+        self._deadline = time.monotonic() + (timeout or self.timeout)
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if self.cancelled:
+                raise QueryInterrupted("Query annullata") from e
+            if "interrupted" in str(e):
+                raise QueryInterrupted(f"Query interrotta: superato il limite di {timeout or self.timeout} s") from e
+            raise
+        finally:
+            self._deadline = None
+            self.last_used = time.monotonic()
+
+    def start(self):
+        """Esegue la query (senza leggere righe)."""
+        with self._lock:
+            self.cursor = self._timed(lambda: self.conn.execute(self.query))
+            self.columns = [column[0] for column in self.cursor.description or []]
+            if self.cursor.description is None:
+                self._finish()
+        return self
+
+    def _finish(self):
+        # Chiude il cursore: termina la transazione di lettura (la connessione resta per EXPLAIN e profilo)
+        self.finished = True
+        if self._idle_timer:
+            self._idle_timer.cancel()
+        if self.cursor is not None:
+            self.cursor.close()
+
+    def _expire(self):
+        # Timer di inattività: se il cursore è in uso ci riprova la prossima pagina
+        if self._lock.acquire(blocking=False):
+            try:
+                if not self.finished:
+                    self.expired = True
+                    self._finish()
+            finally:
+                self._lock.release()
+
+    def _arm_idle_timer(self):
+        if self._idle_timer:
+            self._idle_timer.cancel()
+        if not self.finished:
+            self._idle_timer = threading.Timer(SESSION_IDLE_SECONDS, self._expire)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def next_page(self, size=PAGE_SIZE):
+        """Pagina successiva come DataFrame (vuoto a risultati finiti o limite raggiunto)."""
+        import pandas as pd
+
+        with self._lock:
+            if self.expired:
+                raise QueryInterrupted(f"Query scaduta: nessuna pagina richiesta per {SESSION_IDLE_SECONDS} s, "
+                                       "rieseguila")
+            size = max(0, min(size, self.max_rows - self.fetched))
+            rows = [] if self.finished or size == 0 else self._timed(lambda: self.cursor.fetchmany(size))
+            self.fetched += len(rows)
+            if not self.finished and len(rows) < size:
+                self._finish()
+            elif not self.finished and self.fetched >= self.max_rows:
+                # Limite raggiunto: una riga in più dice se il risultato continuava
+                self.truncated = self._timed(self.cursor.fetchone) is not None
+                self._finish()
+            self._arm_idle_timer()
+            return pd.DataFrame.from_records(rows, columns=self.columns)
+
+    @property
+    def has_more(self):
+        return not self.finished
+
+    def iter_chunks(self, chunk_rows=EXPORT_CHUNK_ROWS, timeout=EXPORT_TIMEOUT_SECONDS):
+        """Blocchi di righe (liste di tuple) fino alla fine del risultato, senza limite di righe.
+
+        Il limite di tempo vale per l'intera lettura, non per il singolo blocco.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.finished:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise QueryInterrupted(f"Export interrotto: superato il limite di {timeout} s")
+            with self._lock:
+                rows = self._timed(lambda: self.cursor.fetchmany(chunk_rows), timeout=remaining)
+                if len(rows) < chunk_rows:
+                    self._finish()
+            if rows:
+                yield rows
+
+    def cancel(self):
+        self.cancelled = True
+        self.conn.interrupt()
+
+    def close(self):
+        if self._idle_timer:
+            self._idle_timer.cancel()
+        try:
+            self.conn.close()
+        except sqlite3.ProgrammingError:
+            pass  # connessione in uso da un altro thread: verrà chiusa dal garbage collector
+
+
+# Una query aperta per chiave (sessione del browser) + una per l'export in corso
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _register(key, session):
+    with _sessions_lock:
+        now = time.monotonic()
+        for other_key in [k for k, s in _sessions.items() if now - s.last_used > SESSION_IDLE_SECONDS]:
+            _sessions.pop(other_key).close()
+        previous = _sessions.pop(key, None)
+        _sessions[key] = session
+    if previous:
+        previous.cancel()
+        previous.close()
+
+
+def open_session(key, query, database_path=DATABASE_PATH, timeout=QUERY_TIMEOUT_SECONDS, max_rows=MAX_ROWS):
+    """Avvia la query per la chiave data (chiude quella precedente) e la restituisce."""
+    session = QuerySession(query, database_path, timeout, max_rows)
+    _register(key, session)
+    return session.start()
+
+
+def get_session(key):
+    with _sessions_lock:
+        return _sessions.get(key)
+
+
+def cancel(key):
+    """Annulla la query e l'eventuale export della chiave; True se c'era qualcosa da annullare."""
+    with _sessions_lock:
+        sessions = [_sessions.get(key), _sessions.get(f"{key}:export")]
+    for session in sessions:
+        if session:
+            session.cancel()
+    return any(sessions)
+
+
+def export_query(query, fmt="csv", key=None, database_path=DATABASE_PATH, timeout=EXPORT_TIMEOUT_SECONDS,
+                 chunk_rows=EXPORT_CHUNK_ROWS, folder=EXPORT_FOLDER):
+    """Scrive l'intero risultato in un file CSV o Parquet a blocchi; restituisce (path, righe)."""
+    folder.mkdir(parents=True, exist_ok=True)
+    for old in folder.glob("query_*"):
+        if time.time() - old.stat().st_mtime > EXPORT_MAX_AGE_SECONDS:
+            old.unlink(missing_ok=True)
+    path = folder / f"query_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.{fmt}"
+    session = QuerySession(query, database_path, timeout)
+    export_key = f"{key or uuid.uuid4().hex}:export"
+    _register(export_key, session)
+    rows = 0
+    try:
+        session.start()
+        if fmt == "parquet":
+            rows = _write_parquet(path, session, chunk_rows, timeout)
+        else:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(session.columns)
+                for chunk in session.iter_chunks(chunk_rows, timeout):
+                    writer.writerows(chunk)
+                    rows += len(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    finally:
+        with _sessions_lock:
+            if _sessions.get(export_key) is session:
+                del _sessions[export_key]
+        session.close()
+    return path, rows
+
+
+def _write_parquet(path, session, chunk_rows, timeout):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Per l'export Parquet serve pyarrow (pip install pyarrow)") from e
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in session.iter_chunks(chunk_rows, timeout):
+            table = pa.Table.from_arrays([pa.array(column) for column in zip(*chunk)], names=session.columns)
+            if writer is None:
+                # Schema dal primo blocco; le colonne tutte NULL diventano testo
+                schema = pa.schema([pa.field(f.name, pa.string() if pa.types.is_null(f.type) else f.type)
+                                    for f in table.schema])
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(table.cast(writer.schema))
+            rows += len(chunk)
+        if writer is None:
+            writer = pq.ParquetWriter(path, pa.schema([pa.field(name, pa.string()) for name in session.columns]))
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
@@ -0,0 +1,221 @@
+'''
+Profilo delle query eseguite dal tab "🔍 SQL Query" della dashboard.
+
+Per ogni query vengono misurati tempo reale, righe restituite, righe lette
+(stima delle righe delle tabelle scansionate per intero, da sqlite_stat1 o dal
+rowid massimo: nessuna tabella viene riletta) e passi della VM di SQLite,
+e viene mostrato il piano di EXPLAIN QUERY PLAN. index_advice() segnala le
+scansioni complete su colonne usate in join o filtri di uguaglianza e gli indici
+automatici che SQLite costruisce a ogni esecuzione, proponendo il CREATE INDEX.
+'''
+import re
+import time
+
+SLOW_QUERY_SECONDS = 1.0  # oltre questa soglia la query viene segnalata come lenta
+VM_STEPS_PER_CALLBACK = 100  # granularità del progress handler usato per contare i passi VM
+
+_TABLE_REF = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_JOIN_EQUALITY = re.compile(r'\b(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)')
+_FILTER_EQUALITY = re.compile(r'\b(\w+)\.(\w+)\s*(?:=|\bIN\b)\s*(?:\?|\'|\d|\()', re.IGNORECASE)
+_SCAN = re.compile(r'^SCAN (\w+)(?: USING (COVERING )?INDEX (\w+))?$')
+_AUTOMATIC_INDEX = re.compile(r'^SEARCH (\w+) USING AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \((.+)\)$')
+_SQL_KEYWORDS = {"on", "where", "join", "left", "right", "inner", "outer", "cross", "natural", "group",
+                 "order", "limit", "using", "union", "except", "intersect", "having", "window", "full"}
+
+
+def explain_plan(conn, query, params=()):
+    """Righe di EXPLAIN QUERY PLAN: lista di (id, parent, dettaglio)."""
+    return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+
+def format_plan(plan):
+    """Piano ad albero, come lo stampa la shell sqlite3."""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, detail in plan:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append(f"{'   ' * depth[node_id]}{'`--' if depth[node_id] else ''}{detail}")
+    return "\n".join(lines)
+
+
+def _table_aliases(conn, query):
+    # alias -> tabella per le tabelle (o viste) citate in FROM/JOIN
+    known = {row[0].lower(): row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(query):
+        if table.lower() not in known:
+            continue
+        aliases[table.lower()] = known[table.lower()]
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            aliases[alias.lower()] = known[table.lower()]
+    return aliases
+
+
+def _indexed_columns(conn, table):
+    # Colonne che fanno da prima colonna di un indice (o chiave primaria)
+    columns = {row[1].lower() for row in conn.execute(f'PRAGMA table_info("{table}")') if row[5] == 1}
+    for index in conn.execute(f'PRAGMA index_list("{table}")'):
+        first = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchone()
+        if first and first[2]:
+            columns.add(first[2].lower())
+    return columns
+
+
+def _suggestion(table, columns, reason):
+    name = f"idx_{table}_{'_'.join(columns)}"
+    return {"tabella": table, "colonne": columns, "motivo": reason,
+            "sql": f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)});"}
+
+
+def index_advice(conn, query, plan):
+    """Indici consigliati per la query, a partire dal piano: lista di dict (tabella, colonne, motivo, sql)."""
+    aliases = _table_aliases(conn, query)
+    tables = {row[0].lower(): row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def resolve(alias):
+        table = aliases.get(alias.lower(), alias)
+        return tables.get(table.lower())
+
+    # Colonne confrontate tra due tabelle (join) e con costanti/parametri (filtri)
+    join_columns, filter_columns = {}, {}
+    for left, left_col, right, right_col in _JOIN_EQUALITY.findall(query):
+        for alias, column in ((left, left_col), (right, right_col)):
+            if resolve(alias):
+                join_columns.setdefault(resolve(alias), set()).add(column.lower())
+    for alias, column in _FILTER_EQUALITY.findall(query):
+        if resolve(alias):
+            filter_columns.setdefault(resolve(alias), set()).add(column.lower())
+
+    advice = []
+    seen = set()
+    first_loop = next((node_id for node_id, _, detail in plan if detail.startswith(("SCAN ", "SEARCH "))), None)
+    for node_id, _, detail in plan:
+        automatic = _AUTOMATIC_INDEX.match(detail)
+        if automatic:
+            # SQLite ricostruisce questo indice a ogni esecuzione della query
+            table = resolve(automatic.group(1))
+            columns = [term.split("=")[0].strip() for term in automatic.group(2).split(" AND ")]
+            if table and (table, tuple(columns)) not in seen:
+                seen.add((table, tuple(columns)))
+                advice.append(_suggestion(table, columns, "indice automatico creato a ogni esecuzione"))
+            continue
+        scan = _SCAN.match(detail)
+        if not scan or scan.group(3):
+            continue
+        table = resolve(scan.group(1))
+        if table is None:
+            continue
+        # La tabella del ciclo più esterno viene letta comunque per intero: contano solo i filtri
+        candidates = set(filter_columns.get(table, set()))
+        if node_id != first_loop:
+            candidates |= join_columns.get(table, set())
+        existing = {row[1].lower() for row in conn.execute(f'PRAGMA table_info("{table}")')}
+        missing = sorted((candidates & existing) - _indexed_columns(conn, table))
+        for column in missing:
+            if (table, (column,)) in seen:
+                continue
+            seen.add((table, (column,)))
+            kind = "join" if column in join_columns.get(table, set()) else "filtro"
+            advice.append(_suggestion(table, [column], f"scansione completa di {table} con {kind} su {column}"))
+    return advice
+
+
+def _table_rows(conn, table):
+    # Stima senza scansione: sqlite_stat1 (dopo ANALYZE) o rowid massimo; None se non disponibile
+    try:
+        row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)).fetchone()
+        if row:
+            return int(row[0].split()[0])
+    except Exception:
+        pass  # database mai analizzato: sqlite_stat1 non esiste
+    try:
+        return conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0]  # NULL = non disponibile
+    except Exception:
+        return None  # tabella WITHOUT ROWID senza statistiche
+
+
+def _scanned_tables(conn, query, plan):
+    # Tabelle reali scansionate per intero; None se il nome del piano non corrisponde a una tabella
+    aliases = _table_aliases(conn, query)
+    tables = {row[0].lower(): row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    views = {row[0].lower(): row[1] for row in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view'")}
+    # Il piano di una vista usa gli alias interni alla sua definizione (es. "SCAN q" per questionario)
+    view_aliases = [_table_aliases(conn, views[name.lower()]) for name in set(aliases.values())
+                    if name.lower() in views]
+
+    def resolve(name):
+        target = aliases.get(name.lower(), name)
+        if target.lower() in tables:
+            return tables[target.lower()]
+        for inner in view_aliases:
+            target = inner.get(name.lower())
+            if target and target.lower() in tables:
+                return tables[target.lower()]
+        return None
+
+    return [resolve(m.group(1)) for m in (_SCAN.match(detail) for _, _, detail in plan) if m]
+
+
+def profile_query(conn, query, params=()):
+    """Esegue la query misurandola; restituisce (DataFrame, profilo)."""
+    import pandas as pd
+
+    query = query.strip().rstrip(";")
+    try:
+        plan = explain_plan(conn, query, params)
+    except Exception:
+        plan = []  # es. più istruzioni o comandi senza piano: si esegue comunque
+
+    steps = [0]
+
+    def count_steps():
+        steps[0] += VM_STEPS_PER_CALLBACK
+        return 0
+
+    conn.set_progress_handler(count_steps, VM_STEPS_PER_CALLBACK)
+    start = time.perf_counter()
+    try:
+        df = pd.read_sql_query(query, conn, params=params or None)
+    finally:
+        elapsed = time.perf_counter() - start
+        conn.set_progress_handler(None, 0)
+
+    return df, build_profile(conn, query, plan, elapsed, len(df), steps[0])
+
+
+def build_profile(conn, query, plan, elapsed, rows, steps):
+    """Profilo di una query già eseguita (tempo, righe restituite, passi VM misurati da chi la esegue)."""
+    estimates = [_table_rows(conn, table) if table else None for table in _scanned_tables(conn, query, plan)]
+    known = [estimate for estimate in estimates if estimate is not None]
+    profile = {
+        "secondi": elapsed,
+        "righe_restituite": rows,
+        "righe_lette": sum(known) if known or not estimates else None,
+        "passi_vm": steps,
+        "lenta": elapsed >= SLOW_QUERY_SECONDS,
+        "piano": plan,
+        "indici_consigliati": index_advice(conn, query, plan) if plan else [],
+    }
+    if profile["lenta"]:
+        print(f"Query lenta ({elapsed:.2f}s): {' '.join(query.split())[:200]}")
+    return profile
+
+
+def format_profile(profile):
+    """Riepilogo Markdown di tempi, righe e indici consigliati."""
+    lines = [
+        f"{'⚠️ **Query lenta** - ' if profile['lenta'] else ''}"
+        f"⏱️ {profile['secondi'] * 1000:.1f} ms · "
+        f"righe restituite: {profile['righe_restituite']:,} · "
+        f"righe lette (stima, scansioni complete): "
+        f"{'n.d.' if profile['righe_lette'] is None else format(profile['righe_lette'], ',')} · "
+        f"passi VM: ~{profile['passi_vm']:,}"
+    ]
+    if profile["indici_consigliati"]:
+        lines.append("\n**Indici consigliati:**")
+        for advice in profile["indici_consigliati"]:
+            lines.append(f"- {advice['motivo']}: `{advice['sql']}`")
+    elif profile["piano"]:
+        lines.append("\nNessuna scansione completa su colonne di join o filtro senza indice.")
+    return "\n".join(lines)
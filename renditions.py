@@ -0,0 +1,96 @@
+'''
+Versioni "web" delle immagini (rendition) mostrate nelle interfacce.
+
+I gr.Image dell'app utente sono di 600x600, ma gli originali sono JPEG 1024x1024
+(generate) o baseline fino a 4 MB: per ogni immagine vengono create una volta sola
+una versione "display" (lato massimo DISPLAY_MAX_SIDE) e una miniatura per la
+dashboard, in JPEG progressivo o WebP. Le rendition sono indirizzate per
+(path, mtime, dimensione, parametri): se l'originale cambia ne viene creata una nuova.
+Gli originali restano invariati e sono quelli salvati nei CSV e nel database.
+'''
+import os
+import threading
+
+from caching import make_key
+
+RENDITION_FOLDER = os.path.join("cache", "rendition")
+RENDITION_FORMAT = "WEBP"  # oppure "JPEG" (progressivo)
+RENDITION_QUALITY = 80
+
+# Lato massimo in pixel per ogni tipo di rendition (solo riduzione, mai ingrandimento)
+RENDITION_SIZES = {
+    "display": 600,  # gr.Image 600x600 dell'app utente
+    "thumbnail": 300,  # anteprime della dashboard
+}
+
+_locks = {}  # una creazione alla volta per la stessa rendition
+_locks_guard = threading.Lock()
+
+
+def _extension():
+    return ".webp" if RENDITION_FORMAT == "WEBP" else ".jpg"
+
+
+def rendition_path(source_path, kind="display"):
+    """Percorso della rendition di source_path (che esista o meno)."""
+    stat = os.stat(source_path)
+    key = make_key(os.path.abspath(source_path), stat.st_mtime_ns, stat.st_size, kind,
+                   RENDITION_SIZES[kind], RENDITION_FORMAT, RENDITION_QUALITY)
+    return os.path.join(RENDITION_FOLDER, key + _extension())
+
+
+def _render(source_path, destination, max_side):
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        tmp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if RENDITION_FORMAT == "WEBP":
+            image.save(tmp_path, format="WEBP", quality=RENDITION_QUALITY, method=4)
+        else:
+            image.save(tmp_path, format="JPEG", quality=RENDITION_QUALITY,
+                       optimize=True, progressive=True)
+    os.replace(tmp_path, destination)
+
+
+def create_rendition(source_path, kind="display"):
+    """Crea (se manca) la rendition e ne restituisce il percorso."""
+    destination = rendition_path(source_path, kind)
+    if os.path.exists(destination):
+        return destination
+    with _locks_guard:
+        lock = _locks.setdefault(destination, threading.Lock())
+    with lock:
+        if not os.path.exists(destination):
+            _render(source_path, destination, RENDITION_SIZES[kind])
+    with _locks_guard:
+        _locks.pop(destination, None)
+    return destination
+
+
+def create_renditions(source_path):
+    """Crea tutte le rendition di un'immagine (chiamata dopo la generazione)."""
+    return {kind: create_rendition(source_path, kind) for kind in RENDITION_SIZES}
+
+
+def get_rendition(source_path, kind="display"):
+    """Rendition da mostrare al posto dell'originale; in caso di errore restituisce l'originale."""
+    if not source_path:
+        return source_path
+    try:
+        return create_rendition(source_path, kind)
+    except Exception as e:
+        print(f"Rendition {kind} di {source_path} non disponibile: {str(e)}")
+        return source_path
+
+
+def remove_renditions(source_path):
+    """Elimina le rendition di un'immagine (da chiamare prima di eliminare l'originale)."""
+    if not os.path.exists(source_path):
+        return
+    for kind in RENDITION_SIZES:
+        path = rendition_path(source_path, kind)
+        if os.path.exists(path):
+            os.remove(path)
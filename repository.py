@@ -0,0 +1,305 @@
+'''
+Repository in memoria dei dati dell'app utente.
+
+I CSV vengono letti UNA sola volta all'avvio; a ogni scrittura vengono aggiornati
+sia il file (append-only, vedi storage.py) sia gli indici hash in memoria, così le
+ricerche fatte a ogni click (path baseline -> id, controllo duplicati, tab precedente)
+diventano accessi O(1) a dizionari invece di read_csv + filtri.
+'''
+import threading
+from contextlib import contextmanager
+
+from storage import AppendOnlyCsvWriter, iter_csv_records
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class CsvRepository:
+    def __init__(self, registration_file, questionnaire_file, generation_file, baseline_file,
+                 registration_columns, questionnaire_columns, generation_columns,
+                 segment_max_bytes=None):
+        self._lock = threading.RLock()
+
+        # Indici baseline
+        self.baseline_id_by_path = {}
+        self.baseline_path_by_id = {}
+        self.baseline_gender_by_path = {}
+        # Indici generazioni
+        self.baseline_id_by_generation = {}
+        self.generations_by_baseline = {}
+        # Indici questionari
+        self.questionnaire_by_user_generation = {}
+        self.completed_baselines = set()  # coppie (idUtente, id_immagine_baseline)
+
+        # Contatori id
+        self.next_user_id = 1
+        self.next_generation_id = 1
+        self.next_questionnaire_id = 1
+
+        self._load_baselines(baseline_file)
+        self._load_registrations(registration_file)
+        self._load_generations(generation_file)
+        self._load_questionnaires(questionnaire_file)
+
+        self.registration_writer = AppendOnlyCsvWriter(registration_file, registration_columns, max_bytes=segment_max_bytes)
+        self.questionnaire_writer = AppendOnlyCsvWriter(questionnaire_file, questionnaire_columns, max_bytes=segment_max_bytes)
+        self.generation_writer = AppendOnlyCsvWriter(generation_file, generation_columns, max_bytes=segment_max_bytes)
+
+    # Caricamento iniziale
+    def _load_baselines(self, path):
+        for row in iter_csv_records(path):
+            self._index_baseline(_to_int(row["idImmagine"]), row["path_immagine"], row["genere_del_capo"])
+
+    def _load_registrations(self, path):
+        max_id = 0
+        for row in iter_csv_records(path):
+            max_id = max(max_id, _to_int(row["idUtente"]) or 0)
+        self.next_user_id = max_id + 1
+
+    def _load_generations(self, path):
+        max_id = 0
+        for row in iter_csv_records(path):
+            generation_id = _to_int(row["idGenerazione"])
+            if generation_id is None:
+                continue
+            self._index_generation(generation_id, _to_int(row["id_immagine_baseline"]))
+            max_id = max(max_id, generation_id)
+        self.next_generation_id = max_id + 1
+
+    def _load_questionnaires(self, path):
+        max_id = 0
+        for row in iter_csv_records(path):
+            questionnaire_id = _to_int(row["idQuestionario"])
+            if questionnaire_id is None:
+                continue
+            self._index_questionnaire(questionnaire_id, _to_int(row["idUtente"]), _to_int(row["id_immagine_generata"]))
+            max_id = max(max_id, questionnaire_id)
+        self.next_questionnaire_id = max_id + 1
+
+    # Aggiornamento indici
+    def _index_baseline(self, baseline_id, path, gender):
+        self.baseline_id_by_path[path] = baseline_id
+        self.baseline_path_by_id[baseline_id] = path
+        self.baseline_gender_by_path[path] = gender
+
+    def _index_generation(self, generation_id, baseline_id):
+        self.baseline_id_by_generation[generation_id] = baseline_id
+        self.generations_by_baseline.setdefault(baseline_id, set()).add(generation_id)
+
+    def _index_questionnaire(self, questionnaire_id, user_id, generation_id):
+        self.questionnaire_by_user_generation[(user_id, generation_id)] = questionnaire_id
+        baseline_id = self.baseline_id_by_generation.get(generation_id)
+        if baseline_id is not None:
+            self.completed_baselines.add((user_id, baseline_id))
+
+    # Letture O(1)
+    def get_baseline_id(self, path):
+        return self.baseline_id_by_path.get(path)
+
+    def has_baseline(self, gender, path):
+        return self.baseline_gender_by_path.get(path) == gender
+
+    def get_baseline_path_for_generation(self, generation_id):
+        return self.baseline_path_by_id.get(self.baseline_id_by_generation.get(generation_id))
+
+    def has_generations(self, baseline_id):
+        return bool(self.generations_by_baseline.get(baseline_id))
+
+    def has_questionnaire(self, user_id, generation_id):
+        return (user_id, generation_id) in self.questionnaire_by_user_generation
+
+    def has_completed_baseline(self, user_id, baseline_id):
+        return (user_id, baseline_id) in self.completed_baselines
+
+    # Scritture (file + indici)
+    def add_registration(self, entry):
+        with self._lock:
+            user_id = self.next_user_id
+            self.registration_writer.append({**entry, "idUtente": user_id})
+            self.next_user_id += 1
+            return user_id
+
+    def reserve_generation_id(self):
+        # L'id serve già per il nome del file: lo si riserva prima della generazione
+        with self._lock:
+            generation_id = self.next_generation_id
+            self.next_generation_id += 1
+            return generation_id
+
+    def release_generation_id(self, generation_id):
+        # Con i CSV l'id riservato e non usato resta semplicemente un "buco"
+        pass
+
+    def add_generation(self, entry):
+        with self._lock:
+            self.generation_writer.append(entry)
+            self._index_generation(entry["idGenerazione"], entry["id_immagine_baseline"])
+            return entry["idGenerazione"]
+
+    def add_questionnaire(self, entry):
+        with self._lock:
+            # Controllo duplicati e scrittura nello stesso lock
+            if self.has_questionnaire(entry["idUtente"], entry["id_immagine_generata"]):
+                return None
+            questionnaire_id = self.next_questionnaire_id
+            self.questionnaire_writer.append({**entry, "idQuestionario": questionnaire_id})
+            self._index_questionnaire(questionnaire_id, entry["idUtente"], entry["id_immagine_generata"])
+            self.next_questionnaire_id += 1
+            return questionnaire_id
+
+
+class SqliteRepository:
+    """Stessa interfaccia di CsvRepository, ma scrive direttamente su fashion_database.db.
+
+    Gli id sono assegnati da SQLite (AUTOINCREMENT + RETURNING) invece che da
+    contatori in memoria; le query sono costanti parametriche, quindi vengono
+    preparate una volta e riusate dalla cache degli statement di sqlite3.
+    """
+
+    def __init__(self, database_path, baseline_file=None):
+        from database import connect, create_tables
+        from bulk_loader import bulk_load_csv
+
+        self._lock = threading.RLock()
+        self.conn = connect(database_path)
+        self.conn.isolation_level = None  # transazioni gestite esplicitamente
+        with self.transaction() as cursor:
+            create_tables(cursor)
+            missing_baselines = cursor.execute("SELECT COUNT(*) FROM immagini_baseline").fetchone()[0] == 0
+        # Le baseline servono subito: se mancano si importano dal CSV
+        if baseline_file and missing_baselines:
+            bulk_load_csv(self.conn, "immagini_baseline", baseline_file, [0])
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE ... COMMIT/ROLLBACK sotto lock: scritture multi-riga atomiche
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn.cursor()
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _fetch_one(self, query, params):
+        with self._lock:
+            return self.conn.execute(query, params).fetchone()
+
+    # Letture (tutte su colonne indicizzate)
+    def get_baseline_id(self, path):
+        row = self._fetch_one("SELECT idImmagine FROM immagini_baseline WHERE path_immagine = ?", (path,))
+        return row[0] if row else None
+
+    def has_baseline(self, gender, path):
+        row = self._fetch_one(
+            "SELECT 1 FROM immagini_baseline WHERE path_immagine = ? AND genere_del_capo = ?", (path, gender))
+        return row is not None
+
+    def get_baseline_path_for_generation(self, generation_id):
+        row = self._fetch_one('''
+            SELECT ib.path_immagine
+            FROM immagini_generate ig
+            JOIN immagini_baseline ib ON ig.id_immagine_baseline = ib.idImmagine
+            WHERE ig.idGenerazione = ?''', (generation_id,))
+        return row[0] if row else None
+
+    def has_generations(self, baseline_id):
+        row = self._fetch_one('''
+            SELECT 1 FROM immagini_generate
+            WHERE id_immagine_baseline = ? AND path_immagine_generata IS NOT NULL
+            LIMIT 1''', (baseline_id,))
+        return row is not None
+
+    def has_questionnaire(self, user_id, generation_id):
+        row = self._fetch_one(
+            "SELECT 1 FROM questionari WHERE idUtente = ? AND id_immagine_generata = ?", (user_id, generation_id))
+        return row is not None
+
+    def has_completed_baseline(self, user_id, baseline_id):
+        row = self._fetch_one('''
+            SELECT 1
+            FROM questionari q
+            JOIN immagini_generate ig ON q.id_immagine_generata = ig.idGenerazione
+            WHERE q.idUtente = ? AND ig.id_immagine_baseline = ?
+            LIMIT 1''', (user_id, baseline_id))
+        return row is not None
+
+    # Scritture
+    def add_registration(self, entry):
+        with self.transaction() as cursor:
+            return cursor.execute('''
+                INSERT INTO registrazioni (
+                    nome, cognome, eta, nazione, genere, corrente_artistica_preferita, professione,
+                    colori_preferiti, generi_musicali_preferiti, cosa_cerchi_nei_capi, marchi_preferiti,
+                    competenza_moda, interesse_moda
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING idUtente''', (
+                    entry["nome"], entry["cognome"], entry["eta"], entry["nazione"], entry["genere"],
+                    entry["corrente_artistica_preferita"], entry["professione"], entry["colori_preferiti"],
+                    entry["generi_musicali_preferiti"], entry["cosa_cerchi_nei_capi"], entry["marchi_preferiti"],
+                    entry["competenza_moda"], entry["interesse_moda"]
+                )).fetchone()[0]
+
+    def reserve_generation_id(self):
+        # Riga segnaposto (senza path) per ottenere subito l'id usato nel nome del file
+        with self.transaction() as cursor:
+            return cursor.execute(
+                "INSERT INTO immagini_generate (path_immagine_generata) VALUES (NULL) RETURNING idGenerazione"
+            ).fetchone()[0]
+
+    def release_generation_id(self, generation_id):
+        # Generazione fallita: elimina la riga segnaposto
+        with self.transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM immagini_generate WHERE idGenerazione = ? AND path_immagine_generata IS NULL",
+                (generation_id,))
+
+    def add_generation(self, entry):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE immagini_generate
+                SET id_immagine_baseline = ?, prompt_text_to_image = ?, data_ora = ?, path_immagine_generata = ?
+                WHERE idGenerazione = ?''', (
+                    entry["id_immagine_baseline"], entry["prompt_text_to_image"], entry["data_ora"],
+                    entry["path_immagine_generata"], entry["idGenerazione"]
+                ))
+            if cursor.rowcount == 0:
+                # Id non riservato con reserve_generation_id: inserimento diretto
+                cursor.execute('''
+                    INSERT INTO immagini_generate (
+                        idGenerazione, id_immagine_baseline, prompt_text_to_image, data_ora, path_immagine_generata
+                    ) VALUES (?, ?, ?, ?, ?)''', (
+                        entry["idGenerazione"], entry["id_immagine_baseline"], entry["prompt_text_to_image"],
+                        entry["data_ora"], entry["path_immagine_generata"]
+                    ))
+            return entry["idGenerazione"]
+
+    def add_questionnaire(self, entry):
+        from database import answer_code
+
+        # Risposte in formato lungo: tutte le chiavi domandaN presenti, anche oltre la sesta
+        answers = sorted((int(key[len("domanda"):]), answer_code(value)) for key, value in entry.items()
+                         if key.startswith("domanda") and value not in (None, ""))
+        with self.transaction() as cursor:
+            # Controllo duplicati e inserimento nella stessa transazione
+            duplicate = cursor.execute(
+                "SELECT 1 FROM questionari WHERE idUtente = ? AND id_immagine_generata = ?",
+                (entry["idUtente"], entry["id_immagine_generata"])).fetchone()
+            if duplicate:
+                return None
+            questionnaire_id = cursor.execute('''
+                INSERT INTO questionari (idUtente, id_immagine_generata, id_set_domande)
+                VALUES (?, ?, ?)
+                RETURNING idQuestionario''', (
+                    entry["idUtente"], entry["id_immagine_generata"], entry["id_set_domande"]
+                )).fetchone()[0]
+            cursor.executemany(
+                "INSERT INTO risposte (idQuestionario, n_domanda, valore) VALUES (?, ?, ?)",
+                [(questionnaire_id, n, code) for n, code in answers])
+            return questionnaire_id
@@ -0,0 +1,74 @@
+'''
+Stato per sessione dell'app utente (main.py).
+
+Ogni scheda del browser ha un proprio session_hash Gradio: l'utente registrato,
+il genere, la descrizione in inglese, l'ordine casuale delle immagini e le tab
+già generate vivono qui invece che in variabili globali, così più partecipanti
+possono usare lo stesso processo contemporaneamente. Le sessioni inattive da
+più di ttl secondi vengono eliminate.
+'''
+import threading
+import time
+
+
+class UserSession:
+    def __init__(self):
+        self.user_id = None  # Sarà impostato dopo la registrazione
+        self.gender = None  # Utile per determinare le immagini da mostrare
+        self.description_eng = None  # Descrizione utente (ENG) passata a Gemini
+        self.display_orders = {}  # Ordine casuale per ogni tab
+        self.generated_tabs = {}  # Tab con immagine già generata
+        self.generation_ids = {}  # Tab -> id della generazione mostrata (per il questionario)
+        self.pending_tabs = set()  # Tab con generazione in corso (evita doppi click)
+        self.pregenerated = {}  # Tab -> Future della pre-generazione in background
+        self.lock = threading.Lock()
+        self.last_seen = time.monotonic()
+
+    def reset(self):
+        # Nuova registrazione nella stessa scheda: si riparte da zero
+        self.display_orders = {}
+        self.generated_tabs = {}
+        self.generation_ids = {}
+        self.pending_tabs = set()
+        self.pregenerated = {}
+
+
+class SessionStore:
+    def __init__(self, ttl, on_evict=None):
+        self.ttl = ttl  # secondi di inattività prima dell'eliminazione (SESSION_TTL in main.py)
+        # Chiamata con la sessione rimossa (chiusura scheda o inattività), es. per liberare risorse
+        self.on_evict = on_evict
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_hash):
+        """Restituisce (creandola se serve) la sessione associata al session_hash."""
+        now = time.monotonic()
+        with self._lock:
+            expired = self._evict_idle(now)
+            session = self._sessions.get(session_hash)
+            if session is None:
+                session = self._sessions[session_hash] = UserSession()
+            session.last_seen = now
+        self._notify(expired)
+        return session
+
+    def remove(self, session_hash):
+        with self._lock:
+            session = self._sessions.pop(session_hash, None)
+        self._notify([session] if session else [])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _evict_idle(self, now):
+        expired = [key for key, session in self._sessions.items()
+                   if now - session.last_seen > self.ttl]
+        return [self._sessions.pop(key) for key in expired]
+
+    def _notify(self, removed):
+        # Fuori dal lock: la callback può richiedere tempo
+        if self.on_evict:
+            for session in removed:
+                self.on_evict(session)
@@ -1,16 +1,32 @@
-import sqlite3
-import csv
+import sys
+import time
+from startup_profile import PROFILE_FLAG, is_profiling_child, profile_startup # --profile-startup
+if __name__ == '__main__' and PROFILE_FLAG in sys.argv:
+    sys.exit(profile_startup(__file__))  # report dei tempi di avvio, senza avviare la dashboard
+
 import numpy as np
 import pandas as pd
 from pathlib import Path
-# Utili per grafici
-import matplotlib.pyplot as plt
-import plotly.express as px
-import seaborn as sns
+from database import DATABASE_PATH, connect # schema condiviso con main.py
+from csv_sync import CsvSyncEngine, format_report # sincronizzazione incrementale CSV -> DB
+from renditions import get_rendition # miniature delle immagini baseline
+from image_store import ImageStore # path reali delle immagini generate (anche pre-sharding)
+from bradley_terry import extract_comparisons, fit_bradley_terry, win_probabilities # modello BT vettoriale
+from bradley_terry import image_ranking # BT a molti item (una voce per immagine)
+from query_profiler import build_profile, explain_plan, format_plan, format_profile # tempi, piano e indici delle query
+from query_executor import MAX_ROWS, PAGE_SIZE, QUERY_TIMEOUT_SECONDS, QueryInterrupted, QuerySession # query in sola lettura, a pagine
+from query_executor import cancel, export_query, get_session, open_session
+from analytics_cache import AnalyticsCache # risultati delle analisi finché i dati non cambiano
+# Le librerie per grafici e modelli (plotly, matplotlib, seaborn, statsmodels)
+# vengono importate solo quando la relativa analisi viene eseguita la prima volta
 
-DATABASE_PATH = "fashion_database.db"
 CSV_FOLDER = Path(".")  # da modificare se i CSV sono in un'altra cartella
 ID_SET = 1
+SYNC_INTERVAL = 60  # secondi tra due sincronizzazioni automatiche dei CSV (None = disattivata)
+
+sync_engine = CsvSyncEngine(DATABASE_PATH, CSV_FOLDER)
+analysis_cache = AnalyticsCache(DATABASE_PATH)  # condivisa tra le sessioni
+image_store = ImageStore()
 
 css = """
 .gr-row {
@@ -44,69 +60,10 @@ css = """
 }
 """
 
-def create_tables(cursor):
-    # Crea le tabelle se non esistono già
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS registrazioni (
-        idUtente INTEGER PRIMARY KEY,
-        nome TEXT,
-        cognome TEXT,
-        eta INTEGER,
-        nazione TEXT,
-        genere TEXT,
-        corrente_artistica_preferita TEXT,
-        professione TEXT,
-        colori_preferiti TEXT,
-        generi_musicali_preferiti TEXT,
-        cosa_cerchi_nei_capi TEXT,
-        marchi_preferiti TEXT,
-        competenza_moda TEXT,
-        interesse_moda TEXT
-    )''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS questionario (
-        idQuestionario INTEGER PRIMARY KEY,
-        idUtente INTEGER REFERENCES registrazioni(idUtente),
-        id_immagine_generata INTEGER UNIQUE REFERENCES immagini_generate(idGenerazione),
-        id_set_domande INTEGER REFERENCES domande(id_set),
-        domanda1 TEXT,
-        domanda2 TEXT,
-        domanda3 TEXT,
-        domanda4 TEXT,
-        domanda5 TEXT,
-        domanda6 TEXT
-    )''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS immagini_generate (
-        idGenerazione INTEGER PRIMARY KEY,
-        id_immagine_baseline INTEGER REFERENCES immagini_baseline(idImmagine),
-        prompt_text_to_image TEXT,
-        data_ora TEXT,
-        path_immagine_generata TEXT
-    )''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS domande (
-        id_set INTEGER PRIMARY KEY,
-        domanda1 TEXT,
-        domanda2 TEXT,
-        domanda3 TEXT,
-        domanda4 TEXT,
-        domanda5 TEXT,
-        domanda6 TEXT
-    )''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS immagini_baseline (
-        idImmagine INTEGER PRIMARY KEY,
-        genere_del_capo TEXT,
-        path_immagine TEXT
-    )''')
-
 # Funzione per preferenze e grafici
+@analysis_cache.cached("domande", "risposte", "valori_risposta", "questionari", "registrazioni", "immagini_generate")
 def analyze_preferences():
+    import plotly.express as px
     conn = get_db_connection()
     try:
         figures = []
@@ -127,20 +84,28 @@ def analyze_preferences():
                 6: df_domande['domanda6'].iloc[0]
             }
         
+        # Conteggi di tutte le domande in una sola scansione: (domanda, risposta, genere) -> totale
+        query = '''
+        SELECT 
+            a.n_domanda,
+            v.etichetta as risposta,
+            COUNT(*) as totale,
+            r.genere
+        FROM risposte a
+        JOIN valori_risposta v ON v.codice = a.valore
+        JOIN questionari q ON q.idQuestionario = a.idQuestionario
+        JOIN registrazioni r ON q.idUtente = r.idUtente
+        JOIN immagini_generate ig ON q.id_immagine_generata = ig.idGenerazione
+        GROUP BY a.n_domanda, a.valore, r.genere
+        '''
+        counts = pd.read_sql_query(query, conn)
+        per_domanda = {n: group.drop(columns='n_domanda').reset_index(drop=True)
+                       for n, group in counts.groupby('n_domanda', sort=False)}
+        vuoto = counts.drop(columns='n_domanda').iloc[0:0]
+
         # Analisi per domande 1-5
         for domanda in range(1, 6):
-            query = f'''
-            SELECT 
-                q.domanda{domanda} as risposta,
-                COUNT(*) as totale,
-                r.genere
-            FROM questionario q
-            JOIN registrazioni r ON q.idUtente = r.idUtente
-            JOIN immagini_generate ig ON q.id_immagine_generata = ig.idGenerazione
-            GROUP BY q.domanda{domanda}, r.genere
-            '''
-            
-            df = pd.read_sql_query(query, conn)
+            df = per_domanda.get(domanda, vuoto)
             
             fig = px.bar(df,
                         x='risposta',
@@ -159,18 +124,7 @@ def analyze_preferences():
             figures.append(fig)
         
         # Analisi per domanda 6 (Likert)
-        query_likert = '''
-        SELECT 
-            q.domanda6 as valutazione,
-            COUNT(*) as totale,
-            r.genere
-        FROM questionario q
-        JOIN registrazioni r ON q.idUtente = r.idUtente
-        JOIN immagini_generate ig ON q.id_immagine_generata = ig.idGenerazione
-        GROUP BY q.domanda6, r.genere
-        '''
-        
-        df_likert = pd.read_sql_query(query_likert, conn)
+        df_likert = per_domanda.get(6, vuoto).rename(columns={'risposta': 'valutazione'})
         
         # Grafico a torta
         fig_pie = px.pie(df_likert,
@@ -199,85 +153,106 @@ def analyze_preferences():
     finally:
         conn.close()
 
-def load_data(cursor):
-    # Funzione generica per il caricamento CSV
-    def load_csv(table, filename, converter=None):
-        file_path = CSV_FOLDER / filename
-        with open(file_path, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            headers = next(reader)
-            for row in reader:
-                if converter:
-                    try:
-                        row = converter(row)
-                    except Exception as e:
-                        print(f"Errore conversione riga {row} in {table}: {e}")
-                        continue
-                placeholders = ','.join('?' * len(row))
-                cursor.execute(f'INSERT OR IGNORE INTO {table} VALUES ({placeholders})', row)
-
-    # Caricamento dati con conversione tipi
-    load_csv('registrazioni', 'registrazioni.csv',
-        lambda r: [
-            int(r[0]), r[1], r[2], int(r[3]), r[4], r[5], r[6], r[7],
-            r[8], r[9], r[10], r[11], int(r[12]), int(r[13]) 
-        ])
-    load_csv('questionario', 'questionario.csv', 
-         lambda r: [int(r[0]), int(r[1]), int(r[2])] + r[3:10])
-    
-    load_csv('immagini_generate', 'immagini_generate.csv', 
-             lambda r: [int(r[0]), int(r[1])] + r[2:5])
-    
-    load_csv('domande', 'domande.csv')
-    load_csv('immagini_baseline', 'immagini_baseline.csv')
-
 def get_db_connection():
-    return sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+    return connect(DATABASE_PATH)
 
 def init_db():
-    # Elimina il database se esiste e lo ricrea
-    #if Path(DATABASE_PATH).exists():
-        #Path(DATABASE_PATH).unlink()
-    # Perchè? Al momento il database viene creato e ad ogni avvio di questo script
-    # vengono AGGIUNTE le cose nuove presenti nei file "csv" ma non vengono inserite 
-    # le MODIFICHE e le ELIMINAZIONI.
-    # -> NOTA che il sistema attuale però NON permette le eliminazioni o le modifiche 
-    # quindi non c'è problema ma se dovesse essere implementata questa funzionalità, 
-    # allora bisognerebbe scommentare le due righe sopra che ad ogni esecuzione tolgono
-    # e ricreano il database. Al contrario, se questo dovesse essere troppo pesante,
-    # bisognerebbe prevedere una costruzione "incrementale" del database.
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    create_tables(cursor)
-    load_data(cursor)
-    conn.commit()
-    conn.close()
+    # Costruzione "incrementale" del database: ad ogni avvio (e ad ogni sincronizzazione)
+    # vengono lette solo le righe aggiunte ai CSV dall'ultimo checkpoint; se un file
+    # risulta riscritto la tabella viene riconciliata, applicando MODIFICHE ed ELIMINAZIONI.
+    report = sync_engine.sync()
+    print(format_report(report))
+
+def sync_now():
+    # Sincronizzazione su richiesta dalla dashboard
+    try:
+        return format_report(sync_engine.sync())
+    except Exception as e:
+        return f"Errore durante la sincronizzazione: {str(e)}"
+
+def dedupe_columns(df):
+    # Gestione colonne duplicate
+    cols = pd.Series(df.columns)
+    for dup in cols[cols.duplicated()].unique():
+        # Trova gli indici delle colonne duplicate
+        dup_indices = cols[cols == dup].index.tolist()
+        # Rinomina con suffisso _1, _2, ecc., mantenendo la prima colonna intatta
+        for i, idx in enumerate(dup_indices):
+            if i > 0:  # Lascia la prima occorrenza come originale
+                cols[idx] = f"{dup}_{i}"
+    
+    df.columns = cols  # Applica i nuovi nomi
+    
+    return df
 
 def run_query(query):
-    conn = get_db_connection()
+    # Query predefinite: sola lettura, al massimo MAX_ROWS righe e QUERY_TIMEOUT_SECONDS secondi
+    session = None
     try:
-        df = pd.read_sql_query(query, conn)
-        
-        # Inizio gestione nome colonne duplicate
-        # Gestione colonne duplicate
-        cols = pd.Series(df.columns)
-        for dup in cols[cols.duplicated()].unique():
-            # Trova gli indici delle colonne duplicate
-            dup_indices = cols[cols == dup].index.tolist()
-            # Rinomina con suffisso _1, _2, ecc., mantenendo la prima colonna intatta
-            for i, idx in enumerate(dup_indices):
-                if i > 0:  # Lascia la prima occorrenza come originale
-                    cols[idx] = f"{dup}_{i}"
-        
-        df.columns = cols  # Applica i nuovi nomi
-        # Fine gestione nome colonne duplicate
-        
-        return df
+        session = QuerySession(query).start()
+        return dedupe_columns(session.next_page(MAX_ROWS))
     except Exception as e:
         return str(e)
     finally:
-        conn.close()
+        if session:
+            session.close()
+
+def page_status(session, first):
+    # Righe mostrate e se il risultato continua
+    shown = f"Righe {first:,}-{session.fetched:,}" if session.fetched >= first else "Nessuna riga"
+    if session.has_more:
+        return f"{shown} · altre righe disponibili: **Pagina successiva**"
+    if session.truncated:
+        return f"{shown} · raggiunto il limite di {session.max_rows:,} righe: usa l'export per il risultato completo"
+    return f"{shown} · fine dei risultati"
+
+def start_query(key, query, page_size=PAGE_SIZE, max_rows=MAX_ROWS, timeout=QUERY_TIMEOUT_SECONDS):
+    # Tab SQL: prima pagina, profilo (fino alla prima pagina), piano, stato e se ci sono altre pagine
+    try:
+        start = time.perf_counter()
+        session = open_session(key, query, DATABASE_PATH, timeout=float(timeout or QUERY_TIMEOUT_SECONDS),
+                               max_rows=int(max_rows or MAX_ROWS))
+        df = session.next_page(int(page_size or PAGE_SIZE))
+        elapsed = time.perf_counter() - start
+        steps = session.steps
+        try:
+            plan = explain_plan(session.conn, session.query)
+        except Exception:
+            plan = []  # es. comandi senza piano
+        profile = build_profile(session.conn, session.query, plan, elapsed, len(df), steps)
+        return (dedupe_columns(df), format_profile(profile), format_plan(plan),
+                page_status(session, 1), session.has_more)
+    except QueryInterrupted as e:
+        return None, f"⛔ {e}", "", "", False
+    except Exception as e:
+        return str(e), f"❌ {e}", "", "", False
+
+def next_query_page(key, page_size=PAGE_SIZE):
+    # Pagina successiva dal cursore aperto della sessione
+    session = get_session(key)
+    if session is None or session.cursor is None:
+        return None, "⚠️ Nessuna query aperta: premi **Esegui**", False
+    try:
+        first = session.fetched + 1
+        df = session.next_page(int(page_size or PAGE_SIZE))
+        return dedupe_columns(df), page_status(session, first), session.has_more
+    except QueryInterrupted as e:
+        return None, f"⛔ {e}", False
+    except Exception as e:
+        return str(e), f"❌ {e}", False
+
+def cancel_query(key):
+    return "⛔ Annullamento richiesto" if cancel(key) else "Nessuna query in corso"
+
+def export_result(key, query, fmt):
+    # Risultato completo su file, senza limite di righe
+    try:
+        path, rows = export_query(query, fmt.lower(), key=key)
+        return str(path), f"✅ Esportate {rows:,} righe in {path.name}"
+    except QueryInterrupted as e:
+        return None, f"⛔ {e}"
+    except Exception as e:
+        return None, f"❌ {e}"
 
 def create_interface():
     # Interfaccia Gradio
@@ -285,18 +260,56 @@ def create_interface():
 
     with gr.Blocks(title="Fashion Analytics Dashboard", css=css) as demo:
         gr.Markdown("# Fashion Analytics Dashboard")
+
+        with gr.Row():
+            sync_btn = gr.Button("🔄 Sincronizza CSV", variant="secondary", scale=0)
+            sync_status = gr.Markdown()
+        sync_btn.click(fn=sync_now, outputs=sync_status)
         
         with gr.Tab("🔍 SQL Query"):
             gr.Markdown("### Esegui query personalizzate")
             sql_input = gr.Textbox(lines=10, placeholder="Inserisci la tua query SQL...")
-            run_btn = gr.Button("Esegui", variant="primary")
+            with gr.Row():
+                page_size = gr.Number(value=PAGE_SIZE, label="Righe per pagina", precision=0, minimum=1)
+                max_rows = gr.Number(value=MAX_ROWS, label="Righe massime", precision=0, minimum=1)
+                timeout = gr.Number(value=QUERY_TIMEOUT_SECONDS, label="Timeout (s)", minimum=1)
+            with gr.Row():
+                run_btn = gr.Button("Esegui", variant="primary")
+                next_btn = gr.Button("Pagina successiva ▶", interactive=False)
+                cancel_btn = gr.Button("⛔ Annulla", variant="stop")
+            query_profile = gr.Markdown()
+            page_info = gr.Markdown()
             sql_output = gr.Dataframe(label="Risultati", wrap=True)
-            
+            query_plan = gr.Textbox(label="EXPLAIN QUERY PLAN", lines=6, interactive=False)
+            with gr.Row():
+                export_format = gr.Radio(["CSV", "Parquet"], value="CSV", label="Formato export")
+                export_btn = gr.Button("⬇️ Esporta risultato completo")
+            export_status = gr.Markdown()
+            export_file = gr.File(label="File esportato")
+
+            # Una query aperta per sessione del browser
+            def run_sql(query, size, rows, seconds, request: gr.Request):
+                *outputs, has_more = start_query(request.session_hash, query, size, rows, seconds)
+                return *outputs, gr.update(interactive=has_more)
+
+            def next_sql_page(size, request: gr.Request):
+                *outputs, has_more = next_query_page(request.session_hash, size)
+                return *outputs, gr.update(interactive=has_more)
+
+            def cancel_sql(request: gr.Request):
+                return cancel_query(request.session_hash)
+
+            def export_sql(query, fmt, request: gr.Request):
+                return export_result(request.session_hash, query, fmt)
+
             run_btn.click(
-                fn=run_query,
-                inputs=sql_input,
-                outputs=sql_output
+                fn=run_sql,
+                inputs=[sql_input, page_size, max_rows, timeout],
+                outputs=[sql_output, query_profile, query_plan, page_info, next_btn]
             )
+            next_btn.click(fn=next_sql_page, inputs=page_size, outputs=[sql_output, page_info, next_btn])
+            cancel_btn.click(fn=cancel_sql, outputs=page_info, queue=False)
+            export_btn.click(fn=export_sql, inputs=[sql_input, export_format], outputs=[export_file, export_status])
 
         with gr.Tab("📊 Analisi Predefinite"):
             gr.Markdown("### Report preconfigurati")
@@ -386,112 +399,89 @@ def create_interface():
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM immagini_baseline")
             baseline_images = cursor.fetchall()
+            conn.close()
 
+            baseline_plots = []
             for img in baseline_images:
                 with gr.Row(variant="panel"):
                     with gr.Column(scale=1):
-                        gr.Image(value=img[2], label=f"Baseline {img[0]} - {img[1]}", height=300)
+                        gr.Image(value=get_rendition(img[2], "thumbnail"), label=f"Baseline {img[0]} - {img[1]}", height=300)
                     
                     with gr.Column(scale=2):
-                        # Query per ottenere i dati reali
-                        query = f'''
-                            SELECT 
-                                'Baseline' as scelta,
-                                SUM(
-                                    (CASE WHEN TRIM(q.domanda1) = 'Baseline' THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda2) = 'Baseline' THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda3) = 'Baseline' THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda4) = 'Baseline' THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda5) = 'Baseline' THEN 1 ELSE 0 END)
-                                ) as totale
-                            FROM questionario q
-                            JOIN immagini_generate ig ON q.id_immagine_generata = ig.idGenerazione
-                            WHERE ig.id_immagine_baseline = {img[0]}
-                            AND q.id_set_domande = {ID_SET}
-
-                            UNION ALL
-
-                            SELECT 
-                                'Generated' as scelta,
-                                SUM(
-                                    (CASE WHEN TRIM(q.domanda1) = 'Generated' THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda2) = 'Generated' THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda3) = 'Generated' THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda4) = 'Generated' THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda5) = 'Generated' THEN 1 ELSE 0 END)
-                                ) as totale
-                            FROM questionario q
-                            JOIN immagini_generate ig ON q.id_immagine_generata = ig.idGenerazione
-                            WHERE ig.id_immagine_baseline = {img[0]}
-                            AND q.id_set_domande = {ID_SET}
-
-                            UNION ALL
-
-                            SELECT 
-                                'Indifferente' as scelta,
-                                SUM(
-                                    (CASE WHEN TRIM(q.domanda1) NOT IN ('Baseline', 'Generated') THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda2) NOT IN ('Baseline', 'Generated') THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda3) NOT IN ('Baseline', 'Generated') THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda4) NOT IN ('Baseline', 'Generated') THEN 1 ELSE 0 END) +
-                                    (CASE WHEN TRIM(q.domanda5) NOT IN ('Baseline', 'Generated') THEN 1 ELSE 0 END)
-                                ) as totale
-                            FROM questionario q
-                            JOIN immagini_generate ig ON q.id_immagine_generata = ig.idGenerazione
-                            WHERE ig.id_immagine_baseline = {img[0]}
-                            AND q.id_set_domande = {ID_SET}
-                        '''
-                        
-                        df = pd.read_sql_query(query, conn)
-                        
-                        # Processa i dati per il grafico
-                        categories = ['Baseline', 'Generated', 'Indifferente']
-
-                        if not df.empty:
-                            # Crea un dataframe completo con tutte le categorie
-                            final_df = df.set_index('scelta').reindex(categories, fill_value=0).reset_index()
-                            
-                            # Converti i valori nulli a 0 e poi a interi
-                            final_df['totale'] = pd.to_numeric(final_df['totale'], errors='coerce').fillna(0).astype(int)
-                        else:
-                            final_df = pd.DataFrame({
-                                'scelta': categories,
-                                'totale': [0, 0, 0]
-                            })
-
-                        # Calcola la percentuale
-                        total = final_df['totale'].sum()
-                        final_df['percentuale'] = (final_df['totale'] / total * 100).round(1) if total > 0 else 0
-
-                        # Crea il grafico
-                        fig = px.pie(
-                            final_df,
-                            names='scelta',
-                            values='totale',
-                            color='scelta',
-                            color_discrete_map={
-                                'Baseline': '#EE553D  ',
-                                'Generated': '#626DF9  ',
-                                'Indifferente': '#05CA94  '
-                            },
-                            title=f"Scelte per {img[1]} (ID: {img[0]})",
-                            hover_data=['percentuale'],
-                            height = 300, 
-                            width = 700
-                        )
+                        # Grafico calcolato all'apertura della pagina (non all'avvio della dashboard)
+                        baseline_plots.append(gr.Plot())
+
+            def baseline_choice_figure(conn, img):
+                import plotly.express as px
+                # Conteggi mantenuti dai trigger in aggregati_baseline (vedi database.py)
+                query = '''
+                    SELECT 'Baseline' AS scelta, SUM(baseline) AS totale
+                    FROM aggregati_baseline WHERE id_immagine_baseline = ? AND id_set_domande = ?
+                    UNION ALL
+                    SELECT 'Generated', SUM(generated)
+                    FROM aggregati_baseline WHERE id_immagine_baseline = ? AND id_set_domande = ?
+                    UNION ALL
+                    SELECT 'Indifferente', SUM(indifferente)
+                    FROM aggregati_baseline WHERE id_immagine_baseline = ? AND id_set_domande = ?
+                '''
+                
+                df = pd.read_sql_query(query, conn, params=(img[0], ID_SET) * 3)
+                
+                # Processa i dati per il grafico
+                categories = ['Baseline', 'Generated', 'Indifferente']
 
-                        # Personalizza l'hover
-                        fig.update_traces(
-                            hovertemplate="<br>".join([
-                                "Scelta: %{label}",
-                                "Risposte totali: %{value}",
-                                "Percentuale: %{customdata[0]}%"
-                            ])
-                        )
-                        
-                        gr.Plot(fig)
-            
-            conn.close()
+                if not df.empty:
+                    # Crea un dataframe completo con tutte le categorie
+                    final_df = df.set_index('scelta').reindex(categories, fill_value=0).reset_index()
+                    
+                    # Converti i valori nulli a 0 e poi a interi
+                    final_df['totale'] = pd.to_numeric(final_df['totale'], errors='coerce').fillna(0).astype(int)
+                else:
+                    final_df = pd.DataFrame({
+                        'scelta': categories,
+                        'totale': [0, 0, 0]
+                    })
+
+                # Calcola la percentuale
+                total = final_df['totale'].sum()
+                final_df['percentuale'] = (final_df['totale'] / total * 100).round(1) if total > 0 else 0
+
+                # Crea il grafico
+                fig = px.pie(
+                    final_df,
+                    names='scelta',
+                    values='totale',
+                    color='scelta',
+                    color_discrete_map={
+                        'Baseline': '#EE553D  ',
+                        'Generated': '#626DF9  ',
+                        'Indifferente': '#05CA94  '
+                    },
+                    title=f"Scelte per {img[1]} (ID: {img[0]})",
+                    hover_data=['percentuale'],
+                    height = 300, 
+                    width = 700
+                )
+
+                # Personalizza l'hover
+                fig.update_traces(
+                    hovertemplate="<br>".join([
+                        "Scelta: %{label}",
+                        "Risposte totali: %{value}",
+                        "Percentuale: %{customdata[0]}%"
+                    ])
+                )
+                
+                return fig
+
+            def load_baseline_choices():
+                conn = get_db_connection()
+                try:
+                    return [baseline_choice_figure(conn, img) for img in baseline_images]
+                finally:
+                    conn.close()
+
+            demo.load(fn=load_baseline_choices, outputs=baseline_plots)
 
             # Callback
             def update_analysis():
@@ -526,7 +516,9 @@ def create_interface():
             baseline_output = gr.DataFrame(label="Risultati Performance", wrap=True)
             baseline_plot = gr.Plot()
 
+            @analysis_cache.cached("immagini_baseline", "aggregati_baseline")
             def analyze_baseline_performance():
+                import plotly.express as px
                 conn = get_db_connection()
                 try:
                     # Query per ottenere tutte le baseline con informazioni complete
@@ -535,17 +527,10 @@ def create_interface():
                         ib.idImmagine,
                         ib.genere_del_capo,
                         ib.path_immagine,
-                        COUNT(q.idQuestionario) AS total_valutazioni,
-                        SUM(
-                            (CASE WHEN TRIM(q.domanda1) = 'Generated' THEN 1 ELSE 0 END) +
-                            (CASE WHEN TRIM(q.domanda2) = 'Generated' THEN 1 ELSE 0 END) +
-                            (CASE WHEN TRIM(q.domanda3) = 'Generated' THEN 1 ELSE 0 END) +
-                            (CASE WHEN TRIM(q.domanda4) = 'Generated' THEN 1 ELSE 0 END) +
-                            (CASE WHEN TRIM(q.domanda5) = 'Generated' THEN 1 ELSE 0 END)
-                        ) AS generated_wins
+                        COALESCE(SUM(a.questionari), 0) AS total_valutazioni,
+                        SUM(a.generated) AS generated_wins
                     FROM immagini_baseline ib
-                    LEFT JOIN immagini_generate ig ON ib.idImmagine = ig.id_immagine_baseline
-                    LEFT JOIN questionario q ON ig.idGenerazione = q.id_immagine_generata
+                    LEFT JOIN aggregati_baseline a ON ib.idImmagine = a.id_immagine_baseline
                     GROUP BY ib.idImmagine
                     '''
                     
@@ -606,7 +591,12 @@ def create_interface():
             correlation_output = gr.DataFrame(label="Correlazioni", wrap=True)
             correlation_plot = gr.Plot()
 
+            @analysis_cache.cached("registrazioni", "aggregati_utente")
             def compute_correlations():
+                import matplotlib
+                matplotlib.use("Agg")  # solo immagini, nessuna finestra
+                import matplotlib.pyplot as plt
+                import seaborn as sns
                 conn = get_db_connection()
                 try:
                     users = pd.read_sql_query("SELECT * FROM registrazioni", conn, dtype={
@@ -616,18 +606,9 @@ def create_interface():
                     })
 
                     quest = pd.read_sql_query('''
-                        SELECT 
-                            idUtente,
-                            SUM(
-                                (CASE WHEN TRIM(domanda1) = 'Generated' THEN 1 ELSE 0 END) +
-                                (CASE WHEN TRIM(domanda2) = 'Generated' THEN 1 ELSE 0 END) +
-                                (CASE WHEN TRIM(domanda3) = 'Generated' THEN 1 ELSE 0 END) +
-                                (CASE WHEN TRIM(domanda4) = 'Generated' THEN 1 ELSE 0 END) +
-                                (CASE WHEN TRIM(domanda5) = 'Generated' THEN 1 ELSE 0 END)
-                            ) AS generated_count,
-                            COUNT(*) * 5 AS total_questions
-                        FROM questionario
-                        GROUP BY idUtente
+                        SELECT idUtente, generated AS generated_count, questionari * 5 AS total_questions
+                        FROM aggregati_utente
+                        WHERE questionari > 0
                     ''', conn)
 
                     merged = pd.merge(users, quest, on='idUtente', how='inner').dropna()
@@ -689,8 +670,9 @@ def create_interface():
             r2_info = gr.Markdown(label="Spiegazione R²")
 
             # Funzione adattata per il database
-            import statsmodels.api as sm
+            @analysis_cache.cached("registrazioni", "aggregati_utente")
             def logistic_regression_analysis_db():
+                import statsmodels.api as sm
                 conn = get_db_connection()
                 try:
                     # Recupera dati utenti con conversione esplicita dei tipi
@@ -707,18 +689,9 @@ def create_interface():
                     
                     # Recupera e processa i questionari
                     quest = pd.read_sql_query('''
-                        SELECT 
-                            idUtente,
-                            SUM(
-                                (CASE WHEN TRIM(domanda1) = 'Generated' THEN 1 ELSE 0 END) +
-                                (CASE WHEN TRIM(domanda2) = 'Generated' THEN 1 ELSE 0 END) +
-                                (CASE WHEN TRIM(domanda3) = 'Generated' THEN 1 ELSE 0 END) +
-                                (CASE WHEN TRIM(domanda4) = 'Generated' THEN 1 ELSE 0 END) +
-                                (CASE WHEN TRIM(domanda5) = 'Generated' THEN 1 ELSE 0 END)
-                            ) AS generated_count,
-                            COUNT(*) * 5 AS total_questions
-                        FROM questionario
-                        GROUP BY idUtente
+                        SELECT idUtente, generated AS generated_count, questionari * 5 AS total_questions
+                        FROM aggregati_utente
+                        WHERE questionari > 0
                     ''', conn)
 
                     if quest.empty:
@@ -789,10 +762,8 @@ def create_interface():
                 outputs=[regression_output, model_summary, r2_info]
             )
 
-        # Tenta prima con ilsr_pairwise() con regolarizzazione alpha=0.01
-        # Se fallisce, passa automaticamente a mm_pairwise() come fallback
+        # Stima con bradley_terry.py (forma chiusa per 2 item, regolarizzazione alpha=0.01)
         with gr.Tab("🥇 Modello Bradley-Terry"):
-            from choix import ilsr_pairwise
             gr.Markdown("## Modello Bradley-Terry - Confronto Globale")
             gr.Markdown("""
             **Cosa misura**: 
@@ -806,7 +777,9 @@ def create_interface():
             bt_plot = gr.Plot()
             bt_status = gr.Markdown()
 
+            @analysis_cache.cached("questionari", "risposte", "valori_risposta", "registrazioni")
             def bradley_terry_analysis():
+                import plotly.express as px
                 conn = get_db_connection()
                 try:
                     # 1. Estrai dati da DB
@@ -824,36 +797,21 @@ def create_interface():
                             q.domanda5 IS NOT NULL
                     ''', conn)
 
-                    indexed_data = []
-                    indifferenti = 0
-
-                    # 2. Ciclo sui confronti
-                    for _, row in df.iterrows():
-                        for domanda in [f"domanda{i}" for i in range(1, 6)]:
-                            risposta = str(row[domanda]).strip().capitalize()
-                            if risposta == "Generated":
-                                indexed_data.append((1, 0))
-                            elif risposta == "Baseline":
-                                indexed_data.append((0, 1))
-                            elif risposta == "Indifferente":
-                                indifferenti += 1
-
-                    if not indexed_data:
+                    # 2. Confronti estratti in modo vettoriale (1 = generated, 0 = baseline)
+                    winners, losers, _, indifferenti = extract_comparisons(df)
+
+                    if len(winners) == 0:
                         return (
                             pd.DataFrame(columns=['Tipologia', 'Punteggio Bradley-Terry (λ)', 'Probabilità Vittoria']),
                             None,
                             "⚠️ Nessun dato comparativo valido trovato"
                         )
 
-                    # 3. Confronti senza pesi
-                    expanded = [(winner, loser) for winner, loser in indexed_data]
-
-                    # 4. Calcolo parametri BT
-                    params = ilsr_pairwise(n_items=2, data=expanded, alpha=0.01)
-                    exp_params = np.exp(params)
-                    probs = exp_params / exp_params.sum()
+                    # 3. Calcolo parametri BT (confronti senza pesi)
+                    params = fit_bradley_terry(2, winners, losers)
+                    probs = win_probabilities(params)
 
-                    # 5. Risultati finali
+                    # 4. Risultati finali
                     results_df = pd.DataFrame({
                         'Tipologia': ['baseline', 'generated'],
                         'Punteggio Bradley-Terry (λ)': np.round(params, 4),
@@ -886,7 +844,7 @@ def create_interface():
                         font=dict(size=14)
                     )
 
-                    status_msg = f"{len(indexed_data)} confronti pesati - {indifferenti} risposte 'Indifferente' ignorate"
+                    status_msg = f"{len(winners)} confronti pesati - {indifferenti} risposte 'Indifferente' ignorate"
 
                     return results_df, fig, status_msg
 
@@ -905,12 +863,11 @@ def create_interface():
             )
 
         with gr.Tab("⚖️ BT: Pesato vs Non Pesato"):
-            from choix import ilsr_pairwise
             gr.Markdown("## Confronto Bradley-Terry Pesato vs Non Pesato")
             gr.Markdown("""
             Questa sezione confronta l'effetto del **peso utente (competenza e interesse)** nel modello Bradley-Terry.  
             - Il modello **non pesato** tratta tutte le risposte allo stesso modo.  
-            - Il modello **pesato** replica i confronti in base al punteggio combinato dell'utente.
+            - Il modello **pesato** pesa ogni confronto con il punteggio combinato dell'utente (0.65 × competenza + 0.35 × interesse, senza arrotondamenti).
             """)
 
             compare_btn = gr.Button("Esegui Confronto", variant="primary")
@@ -918,7 +875,9 @@ def create_interface():
             compare_plot = gr.Plot()
             compare_msg = gr.Markdown()
 
+            @analysis_cache.cached("questionari", "risposte", "valori_risposta", "registrazioni")
             def compare_bt_models():
+                import plotly.express as px
                 conn = get_db_connection()
                 try:
                     df = pd.read_sql_query('''
@@ -935,40 +894,22 @@ def create_interface():
                             q.domanda5 IS NOT NULL
                     ''', conn)
 
-                    raw_data = []
-                    weighted_data = []
-                    indifferenti = 0
-
-                    for _, row in df.iterrows():
-                        try:
-                            competenza = float(row["competenza_moda"])
-                            interesse = float(row["interesse_moda"])
-                            peso = 0.65 * competenza + 0.35 * interesse
-                        except:
-                            continue
-
-                        for domanda in [f"domanda{i}" for i in range(1, 6)]:
-                            risposta = str(row[domanda]).strip().capitalize()
-                            if risposta == "Generated":
-                                raw_data.append((1, 0))
-                                weighted_data.extend([(1, 0)] * max(1, int(round(peso))))
-                            elif risposta == "Baseline":
-                                raw_data.append((0, 1))
-                                weighted_data.extend([(0, 1)] * max(1, int(round(peso))))
-                            elif risposta == "Indifferente":
-                                indifferenti += 1
-
-                    if not raw_data or not weighted_data:
+                    # Peso utente reale; le righe senza competenza/interesse numerici vengono escluse
+                    peso = (0.65 * pd.to_numeric(df["competenza_moda"], errors="coerce") +
+                            0.35 * pd.to_numeric(df["interesse_moda"], errors="coerce"))
+                    df, peso = df[peso.notna()], peso[peso.notna()]
+
+                    winners, losers, weights, indifferenti = extract_comparisons(df, weights=peso)
+
+                    if len(winners) == 0:
                         return pd.DataFrame(), None, "⚠️ Nessun dato comparativo valido"
 
-                    # Calcola entrambi i modelli
-                    params_raw = ilsr_pairwise(n_items=2, data=raw_data, alpha=0.01)
-                    exp_raw = np.exp(params_raw)
-                    prob_raw = exp_raw / exp_raw.sum()
+                    # Calcola entrambi i modelli (stessi confronti, con e senza pesi)
+                    params_raw = fit_bradley_terry(2, winners, losers)
+                    prob_raw = win_probabilities(params_raw)
 
-                    params_weighted = ilsr_pairwise(n_items=2, data=weighted_data, alpha=0.01)
-                    exp_weighted = np.exp(params_weighted)
-                    prob_weighted = exp_weighted / exp_weighted.sum()
+                    params_weighted = fit_bradley_terry(2, winners, losers, weights)
+                    prob_weighted = win_probabilities(params_weighted)
 
                     results = pd.DataFrame({
                         'Modello': ['Non Pesato', 'Pesato'],
@@ -996,7 +937,7 @@ def create_interface():
                         showlegend=True
                     )
 
-                    msg = f"Confronti totali: {len(raw_data)} – Indifferenti ignorati: {indifferenti}"
+                    msg = f"Confronti totali: {len(winners)} – Indifferenti ignorati: {indifferenti}"
                     return results, fig, msg
 
                 except Exception as e:
@@ -1009,9 +950,58 @@ def create_interface():
                 outputs=[compare_df, compare_plot, compare_msg]
             )
 
+        with gr.Tab("🏆 Classifica Immagini (BT)"):
+            gr.Markdown("## Classifica Bradley-Terry per singola immagine")
+            gr.Markdown("""
+            Ogni immagine baseline e ogni immagine generata è un item del modello (domande 1-5).  
+            - Ogni immagine generata viene confrontata solo con la propria baseline: le forze di baseline diverse sono confrontabili grazie alla regolarizzazione verso un item di riferimento (λ = 0).  
+            - Le immagini con pochi confronti restano vicine a 0.
+            """)
+
+            ranking_btn = gr.Button("Calcola Classifica", variant="primary")
+            ranking_output = gr.Dataframe(label="Classifica")
+            ranking_status = gr.Markdown()
+
+            def image_ranking_analysis():
+                conn = get_db_connection()
+                try:
+                    df = pd.read_sql_query('''
+                        SELECT 
+                            g.idGenerazione, g.id_immagine_baseline, g.path_immagine_generata, b.path_immagine,
+                            q.domanda1, q.domanda2, q.domanda3, q.domanda4, q.domanda5
+                        FROM questionario q
+                        JOIN immagini_generate g ON q.id_immagine_generata = g.idGenerazione
+                        JOIN immagini_baseline b ON g.id_immagine_baseline = b.idImmagine
+                    ''', conn)
+
+                    if df.empty:
+                        return pd.DataFrame(), "⚠️ Nessun questionario collegato a immagini"
+
+                    # Path salvati -> file reali nell'archivio (i CSV possono avere path pre-sharding)
+                    df["path_immagine_generata"] = df["path_immagine_generata"].map(
+                        lambda path: image_store.resolve(path) or path)
+
+                    ranking, comparisons, indifferenti = image_ranking(df)
+                    return ranking, (f"{len(ranking)} immagini - {comparisons} confronti - "
+                                     f"{indifferenti} risposte 'Indifferente' ignorate")
+
+                except Exception as e:
+                    return pd.DataFrame(), f"Errore: {str(e)}"
+                finally:
+                    conn.close()
+
+            ranking_btn.click(
+                fn=image_ranking_analysis,
+                outputs=[ranking_output, ranking_status]
+            )
+
         return demo
 
 if __name__ == '__main__':
     init_db()  # Inizializza il database all'avvio
+    if SYNC_INTERVAL and not is_profiling_child():
+        sync_engine.start(SYNC_INTERVAL)  # Sincronizzazione periodica dei CSV
     app = create_interface()  # 2. Costruisci l'interfaccia con i dati aggiornati
+    if is_profiling_child():
+        sys.exit(0)  # --profile-startup: misura solo l'avvio
     app.launch(server_port=7860, share=True) #, share=True (per mettere la pagina online)
\ No newline at end of file
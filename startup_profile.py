@@ -0,0 +1,65 @@
+'''
+Profilo dei tempi di avvio (--profile-startup) per main.py e sql superinterface.py.
+
+Lo script viene rieseguito in un processo figlio con "python -X importtime":
+il figlio fa tutto l'avvio (import, lettura dati, costruzione interfaccia) e
+si ferma subito prima di launch(). Vengono stampati il tempo totale fino a
+"pronto a servire" e i moduli che costano di più all'import.
+
+Uso:
+    python main.py --profile-startup
+    python "sql superinterface.py" --profile-startup
+'''
+import os
+import subprocess
+import sys
+import time
+
+PROFILE_FLAG = "--profile-startup"
+_CHILD_ENV = "PROFILE_STARTUP_CHILD"
+
+
+def is_profiling_child():
+    """True nel processo figlio: lo script deve fermarsi prima di launch()."""
+    return os.environ.get(_CHILD_ENV) == "1"
+
+
+def parse_importtime(stderr):
+    """Righe di -X importtime -> lista di (modulo, self µs, cumulativo µs, profondità)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            # Il nome è indentato di 2 spazi per ogni livello di import annidato
+            depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+            rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+        except ValueError:
+            continue
+    return rows
+
+
+def profile_startup(script, top=20):
+    """Esegue lo script in un processo figlio con -X importtime e stampa il report."""
+    script = os.path.abspath(script)
+    env = dict(os.environ, **{_CHILD_ENV: "1"})
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", script], env=env,
+                            cwd=os.path.dirname(script), capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    rows = parse_importtime(result.stderr)
+
+    imports_total = sum(self_us for _, self_us, _, _ in rows) / 1e6
+    print(f"Avvio di {os.path.basename(script)}: {elapsed:.2f}s fino a launch() "
+          f"(di cui import {imports_total:.2f}s, codice di avvio {max(0.0, elapsed - imports_total):.2f}s)")
+    if result.returncode != 0:
+        print(f"Il processo figlio è terminato con codice {result.returncode}:")
+        print("\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:")))
+
+    # Import di primo livello (quelli fatti direttamente dallo script) ordinati per costo
+    top_level = sorted((r for r in rows if r[3] == 0), key=lambda r: r[2], reverse=True)[:top]
+    print(f"\n{'modulo':<40}{'cumulativo':>12}{'proprio':>12}")
+    for name, self_us, cumulative_us, _ in top_level:
+        print(f"{name:<40}{cumulative_us / 1000:>10.1f}ms{self_us / 1000:>10.1f}ms")
+    return result.returncode
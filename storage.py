@@ -0,0 +1,173 @@
+'''
+Scrittura append-only dei file CSV (registrazioni, questionario, immagini generate).
+
+Ogni evento viene scritto come UNA riga in coda al file, seguita da flush + fsync:
+il costo della scrittura non dipende più dal numero di righe già presenti.
+
+Formato: un record = una riga fisica terminata da "\n". Su questa regola si basano
+repair_tail (riga troncata = coda senza "\n"), gli offset in byte del caricamento a
+blocchi (bulk_loader) e l'hash della coda della sincronizzazione (csv_sync). Per
+questo gli a capo dentro i campi testuali (es. campi liberi della registrazione)
+vengono sostituiti da uno spazio in scrittura: la trasformazione è voluta ma con
+perdita, il testo salvato non conserva le interruzioni di riga originali.
+'''
+import csv
+import io
+import os
+import re
+import threading
+from pathlib import Path
+
+
+class AppendOnlyCsvWriter:
+    """Scrive record CSV in coda a un file, una riga (fsync) per evento."""
+
+    def __init__(self, path, fieldnames, max_bytes=None, encoding="utf-8-sig"):
+        self.path = Path(path)
+        self.fieldnames = list(fieldnames)
+        self.max_bytes = max_bytes  # None = nessun rollover in segmenti
+        self.encoding = encoding
+        self._lock = threading.Lock()
+        self._file = None
+
+        with self._lock:
+            self._prepare_file()
+
+    # Gestione file
+    def _prepare_file(self):
+        # Crea il file con intestazione se non esiste (o è vuoto)
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            self._write_header()
+            return
+
+        # Ripara una eventuale ultima riga troncata (crash durante la scrittura)
+        repair_tail(self.path)
+
+        # L'ordine delle colonne è quello dell'intestazione già presente
+        with open(self.path, "r", encoding="utf-8-sig", newline="") as f:
+            header = next(csv.reader(f), [])
+        if not header:
+            self._write_header()
+            return
+        missing = [col for col in self.fieldnames if col not in header]
+        if missing:
+            raise ValueError(f"Colonne mancanti in {self.path}: {', '.join(missing)}")
+        self.fieldnames = header
+
+    def _write_header(self):
+        with open(self.path, "w", encoding=self.encoding, newline="") as f:
+            csv.writer(f, lineterminator="\n").writerow(self.fieldnames)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _open(self):
+        if self._file is None:
+            # In append non va riscritto il BOM: si usa utf-8 semplice
+            self._file = open(self.path, "a", encoding="utf-8", newline="")
+        return self._file
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # Scrittura
+    def _format_row(self, record):
+        row = []
+        for col in self.fieldnames:
+            value = record.get(col, "")
+            if value is None:
+                value = ""
+            # Una riga per evento: gli a capo diventano spazi (con perdita, vedi docstring del modulo)
+            value = str(value).replace("\r", " ").replace("\n", " ")
+            row.append(value)
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow(row)
+        return buffer.getvalue()
+
+    def append(self, record):
+        line = self._format_row(record)
+        with self._lock:
+            f = self._open()
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            if self.max_bytes and os.fstat(f.fileno()).st_size >= self.max_bytes:
+                self._rollover()
+
+    def _rollover(self):
+        # Il segmento attivo viene "sigillato" con un numero progressivo
+        # e si riparte da un file nuovo con la sola intestazione
+        self._file.close()
+        self._file = None
+        numbers = [n for n, _ in _sealed_segments(self.path)]
+        sealed = self.path.with_name(f"{self.path.stem}.{max(numbers, default=0) + 1:06d}{self.path.suffix}")
+        os.replace(self.path, sealed)
+        self._write_header()
+
+
+def repair_tail(path):
+    # Se l'ultima riga non termina con "\n" è stata scritta a metà: la si elimina
+    path = Path(path)
+    size = path.stat().st_size
+    if size == 0:
+        return False
+    with open(path, "rb+") as f:
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return False
+        # Cerca all'indietro l'ultimo "\n" a blocchi
+        position = size
+        cut = 0
+        while position > 0:
+            start = max(0, position - 65536)
+            f.seek(start)
+            chunk = f.read(position - start)
+            index = chunk.rfind(b"\n")
+            if index != -1:
+                cut = start + index + 1
+                break
+            position = start
+        f.truncate(cut)
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"Attenzione: rimossa riga incompleta in coda a {path}")
+    return True
+
+
+def _sealed_segments(path):
+    path = Path(path)
+    pattern = re.compile(rf"^{re.escape(path.stem)}\.(\d+){re.escape(path.suffix)}$")
+    segments = []
+    if path.parent.exists():
+        for candidate in path.parent.iterdir():
+            match = pattern.match(candidate.name)
+            if match:
+                segments.append((int(match.group(1)), candidate))
+    return sorted(segments)
+
+
+def segment_paths(path):
+    """Restituisce i segmenti di un CSV in ordine cronologico (sigillati + attivo)."""
+    path = Path(path)
+    paths = [p for _, p in _sealed_segments(path)]
+    if path.exists():
+        paths.append(path)
+    return paths
+
+
+def iter_csv_records(path):
+    # Scorre i record (dict) di tutti i segmenti senza caricarli in memoria
+    for segment in segment_paths(path):
+        with open(segment, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+
+
+def read_csv_segments(path, **kwargs):
+    # Legge tutti i segmenti di un CSV in un unico DataFrame
+    import pandas as pd
+    frames = [pd.read_csv(p, **kwargs) for p in segment_paths(path)]
+    if not frames:
+        raise FileNotFoundError(path)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
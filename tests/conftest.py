@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# I moduli dell'app sono nella radice del repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Cartella temporanea come directory corrente: scarti/ e CSV non toccano quelli veri
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def write_csv(path, header, rows, bom=True):
+    with open(path, "w", encoding="utf-8-sig" if bom else "utf-8", newline="") as f:
+        f.write(",".join(header) + "\n")
+        for row in rows:
+            f.write(",".join(str(value) for value in row) + "\n")
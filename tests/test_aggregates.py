@@ -0,0 +1,56 @@
+from database import connect, create_tables, rebuild_aggregates
+from repository import SqliteRepository
+
+
+def _snapshot(conn):
+    return (
+        conn.execute("SELECT * FROM aggregati_utente ORDER BY idUtente").fetchall(),
+        conn.execute("SELECT * FROM aggregati_baseline ORDER BY id_immagine_baseline, id_set_domande").fetchall(),
+    )
+
+
+def _assert_matches_rebuild(database_path):
+    conn = connect(database_path)
+    try:
+        incremental = _snapshot(conn)
+        rebuild_aggregates(conn.cursor())
+        assert _snapshot(conn) == incremental
+        conn.rollback()
+    finally:
+        conn.close()
+    return incremental
+
+
+def _questionnaire(user_id, generation_id, *answers):
+    entry = {"idUtente": user_id, "id_immagine_generata": generation_id, "id_set_domande": 1}
+    entry.update({f"domanda{n}": answer for n, answer in enumerate(answers, start=1)})
+    return entry
+
+
+def test_trigger_aggregates_match_rebuild(workdir):
+    database_path = workdir / "test.db"
+    conn = connect(database_path)
+    create_tables(conn.cursor())
+    conn.executemany("INSERT INTO immagini_baseline VALUES (?, ?, ?)",
+                     [(1, "Uomo", "a.jpg"), (2, "Donna", "b.jpg")])
+    conn.commit()
+    conn.close()
+
+    repository = SqliteRepository(database_path)
+    for generation_id, baseline_id in ((1, 1), (2, 1), (3, 2)):
+        repository.add_generation({"idGenerazione": generation_id, "id_immagine_baseline": baseline_id,
+                                   "prompt_text_to_image": "", "data_ora": "", "path_immagine_generata": "x.jpg"})
+    repository.add_questionnaire(_questionnaire(1, 1, "Generated", "Baseline", "4 - Abbastanza"))
+    repository.add_questionnaire(_questionnaire(1, 3, "Indifferente", "Generated"))
+    repository.add_questionnaire(_questionnaire(2, 2, "Generated", "Generated", "Baseline"))
+    users, baselines = _assert_matches_rebuild(database_path)
+    assert [row[:5] for row in users] == [(1, 2, 1, 1, 4), (2, 2, 1, 0, 3)]
+
+    # Modifiche successive: cambio baseline di una generazione, risposta aggiornata, questionario eliminato
+    with repository.transaction() as cursor:
+        cursor.execute("UPDATE immagini_generate SET id_immagine_baseline = 2 WHERE idGenerazione = 2")
+        cursor.execute("UPDATE risposte SET valore = 13 WHERE idQuestionario = 1 AND n_domanda = 1")
+        cursor.execute("DELETE FROM risposte WHERE idQuestionario = 2")
+        cursor.execute("DELETE FROM questionari WHERE idQuestionario = 2")
+    _assert_matches_rebuild(database_path)
+    repository.conn.close()
@@ -0,0 +1,98 @@
+import os
+
+from conftest import write_csv
+from csv_sync import CsvSyncEngine
+from database import connect
+
+TABLES = [("immagini_baseline", "immagini_baseline.csv", [0])]
+HEADER = ["idImmagine", "genere_del_capo", "path_immagine"]
+
+
+def _rows(database_path):
+    conn = connect(database_path)
+    try:
+        return conn.execute("SELECT * FROM immagini_baseline ORDER BY idImmagine").fetchall()
+    finally:
+        conn.close()
+
+
+def _bump_mtime(path):
+    # Alcuni filesystem hanno mtime a bassa risoluzione: lo si sposta esplicitamente
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_append_is_ingested_incrementally(workdir):
+    csv_path = workdir / "immagini_baseline.csv"
+    write_csv(csv_path, HEADER, [(1, "Uomo", "a.jpg"), (2, "Donna", "b.jpg")])
+    engine = CsvSyncEngine(workdir / "test.db", workdir, TABLES)
+
+    stats = engine.sync()["immagini_baseline"]
+    assert (stats["modalita"], stats["nuove"]) == ("completa", 2)
+    assert engine.sync()["immagini_baseline"]["modalita"] == "invariata"
+
+    with open(csv_path, "a", encoding="utf-8", newline="") as f:
+        f.write("3,Uomo,c.jpg\n")
+    stats = engine.sync()["immagini_baseline"]
+    assert (stats["modalita"], stats["nuove"], stats["aggiornate"]) == ("incrementale", 1, 0)
+    assert _rows(workdir / "test.db") == [(1, "Uomo", "a.jpg"), (2, "Donna", "b.jpg"), (3, "Uomo", "c.jpg")]
+
+
+def test_in_place_edit_and_delete_trigger_reconcile(workdir):
+    csv_path = workdir / "immagini_baseline.csv"
+    write_csv(csv_path, HEADER, [(1, "Uomo", "a.jpg"), (2, "Donna", "b.jpg"), (3, "Uomo", "c.jpg")])
+    engine = CsvSyncEngine(workdir / "test.db", workdir, TABLES)
+    engine.sync()
+
+    # Riga 2 eliminata, riga 3 modificata: il file è riscritto, non esteso
+    write_csv(csv_path, HEADER, [(1, "Uomo", "a.jpg"), (3, "Donna", "c.jpg")])
+    _bump_mtime(csv_path)
+    stats = engine.sync()["immagini_baseline"]
+    assert stats["modalita"] == "completa"
+    assert stats["eliminate"] == 1
+    assert _rows(workdir / "test.db") == [(1, "Uomo", "a.jpg"), (3, "Donna", "c.jpg")]
+
+
+def test_same_size_edit_is_not_treated_as_append(workdir):
+    csv_path = workdir / "immagini_baseline.csv"
+    write_csv(csv_path, HEADER, [(1, "Uomo", "a.jpg")])
+    engine = CsvSyncEngine(workdir / "test.db", workdir, TABLES)
+    engine.sync()
+
+    write_csv(csv_path, HEADER, [(1, "Uomo", "z.jpg")])
+    _bump_mtime(csv_path)
+    assert engine.sync()["immagini_baseline"]["modalita"] == "completa"
+    assert _rows(workdir / "test.db") == [(1, "Uomo", "z.jpg")]
+
+
+def test_torn_last_line_is_left_for_next_sync(workdir):
+    csv_path = workdir / "immagini_baseline.csv"
+    write_csv(csv_path, HEADER, [(1, "Uomo", "a.jpg")])
+    engine = CsvSyncEngine(workdir / "test.db", workdir, TABLES)
+    engine.sync()
+
+    # Scrittura a metà (riga senza "\n"): non va importata né scartata
+    with open(csv_path, "a", encoding="utf-8", newline="") as f:
+        f.write("2,Donna,b.j")
+    stats = engine.sync()["immagini_baseline"]
+    assert (stats["nuove"], stats["errori"]) == (0, 0)
+    assert _rows(workdir / "test.db") == [(1, "Uomo", "a.jpg")]
+
+    with open(csv_path, "a", encoding="utf-8", newline="") as f:
+        f.write("pg\n")
+    stats = engine.sync()["immagini_baseline"]
+    assert (stats["modalita"], stats["nuove"]) == ("incrementale", 1)
+    assert _rows(workdir / "test.db") == [(1, "Uomo", "a.jpg"), (2, "Donna", "b.jpg")]
+
+
+def test_sealed_segment_is_read_after_rollover(workdir):
+    csv_path = workdir / "immagini_baseline.csv"
+    write_csv(csv_path, HEADER, [(1, "Uomo", "a.jpg")])
+    engine = CsvSyncEngine(workdir / "test.db", workdir, TABLES)
+    engine.sync()
+
+    # Rollover: il file attivo diventa il segmento 000001 e si riparte con la sola intestazione
+    csv_path.rename(workdir / "immagini_baseline.000001.csv")
+    write_csv(csv_path, HEADER, [(2, "Donna", "b.jpg")])
+    engine.sync()
+    assert _rows(workdir / "test.db") == [(1, "Uomo", "a.jpg"), (2, "Donna", "b.jpg")]
@@ -0,0 +1,52 @@
+from conftest import write_csv
+from repository import CsvRepository, SqliteRepository
+
+REGISTRATION_COLUMNS = ["idUtente", "nome"]
+QUESTIONNAIRE_COLUMNS = ["idQuestionario", "idUtente", "id_immagine_generata", "id_set_domande", "domanda1"]
+GENERATION_COLUMNS = ["idGenerazione", "id_immagine_baseline", "prompt_text_to_image", "data_ora",
+                      "path_immagine_generata"]
+
+
+def _generation(generation_id, path="x.jpg"):
+    return {"idGenerazione": generation_id, "id_immagine_baseline": 1, "prompt_text_to_image": "prompt",
+            "data_ora": "2025-01-01 00:00:00", "path_immagine_generata": path}
+
+
+def test_sqlite_reserve_and_release_generation_id(workdir):
+    repository = SqliteRepository(workdir / "test.db")
+    first = repository.reserve_generation_id()
+    second = repository.reserve_generation_id()
+    assert second > first
+
+    # Generazione fallita: il segnaposto sparisce
+    repository.release_generation_id(first)
+    # Generazione riuscita: il segnaposto diventa la riga definitiva
+    repository.add_generation(_generation(second))
+    repository.release_generation_id(second)
+
+    rows = repository.conn.execute(
+        "SELECT idGenerazione, path_immagine_generata FROM immagini_generate ORDER BY idGenerazione").fetchall()
+    assert rows == [(second, "x.jpg")]
+    # AUTOINCREMENT: un id rilasciato non viene riassegnato
+    assert repository.reserve_generation_id() > second
+    repository.conn.close()
+
+
+def test_csv_reserve_generation_id_continues_from_file(workdir):
+    generation_file = workdir / "immagini_generate.csv"
+    write_csv(generation_file, GENERATION_COLUMNS, [(4, 1, "p", "2025-01-01", "a.jpg")])
+    write_csv(workdir / "immagini_baseline.csv", ["idImmagine", "genere_del_capo", "path_immagine"],
+              [(1, "Uomo", "a.jpg")])
+    repository = CsvRepository(
+        workdir / "registrazioni.csv", workdir / "questionario.csv", generation_file,
+        workdir / "immagini_baseline.csv", REGISTRATION_COLUMNS, QUESTIONNAIRE_COLUMNS, GENERATION_COLUMNS)
+
+    first = repository.reserve_generation_id()
+    second = repository.reserve_generation_id()
+    assert (first, second) == (5, 6)
+
+    repository.release_generation_id(first)
+    repository.add_generation(_generation(second))
+    assert repository.reserve_generation_id() == 7
+    assert repository.has_generations(1)
+    assert repository.get_baseline_path_for_generation(second) == "a.jpg"
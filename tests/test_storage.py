@@ -0,0 +1,54 @@
+from storage import AppendOnlyCsvWriter, iter_csv_records, repair_tail, segment_paths
+
+HEADER = ["id", "testo"]
+
+
+def test_append_writes_one_line_per_record(workdir):
+    path = workdir / "eventi.csv"
+    writer = AppendOnlyCsvWriter(path, HEADER)
+    writer.append({"id": 1, "testo": "riga\nsu due righe"})
+    writer.append({"id": 2, "testo": "a, b"})
+    writer.close()
+
+    assert path.read_bytes().count(b"\n") == 3
+    assert list(iter_csv_records(path)) == [
+        {"id": "1", "testo": "riga su due righe"},
+        {"id": "2", "testo": "a, b"},
+    ]
+
+
+def test_repair_tail_removes_torn_last_line(workdir):
+    path = workdir / "eventi.csv"
+    path.write_bytes(b"id,testo\n1,ok\n2,tronc")
+
+    assert repair_tail(path) is True
+    assert path.read_bytes() == b"id,testo\n1,ok\n"
+    assert repair_tail(path) is False
+
+
+def test_writer_repairs_torn_line_on_open(workdir):
+    path = workdir / "eventi.csv"
+    path.write_bytes(b"id,testo\n1,ok\n2,tronc")
+
+    writer = AppendOnlyCsvWriter(path, HEADER)
+    writer.append({"id": 2, "testo": "completa"})
+    writer.close()
+
+    assert [row["testo"] for row in iter_csv_records(path)] == ["ok", "completa"]
+
+
+def test_rollover_seals_segments_in_order(workdir):
+    path = workdir / "eventi.csv"
+    writer = AppendOnlyCsvWriter(path, HEADER, max_bytes=40)
+    for i in range(1, 8):
+        writer.append({"id": i, "testo": "x" * 10})
+    writer.close()
+
+    segments = segment_paths(path)
+    assert len(segments) > 1
+    assert segments[-1] == path
+    assert [p.name for p in segments[:-1]] == [f"eventi.{n:06d}.csv" for n in range(1, len(segments))]
+    # Ogni segmento ha la propria intestazione e nessun record va perso
+    for segment in segments:
+        assert segment.read_text(encoding="utf-8-sig").startswith("id,testo\n")
+    assert [int(row["id"]) for row in iter_csv_records(path)] == list(range(1, 8))
@@ -0,0 +1,176 @@
+'''
+Descrizione utente in inglese per Gemini, costruita in locale.
+
+Quasi tutti i campi della registrazione vengono da liste chiuse: qui c'è la
+traduzione fissa di ogni scelta (usata anche come elenco delle opzioni in main.py).
+Solo i campi liberi (nazione, professione) passano dal traduttore online, con una
+cache persistente: la registrazione non lo aspetta mai. Un testo nuovo viene usato
+in italiano e tradotto in background; la traduzione, salvata in cache, vale dalle
+registrazioni successive con lo stesso testo.
+'''
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from caching import PersistentCache
+
+GENERI = {"Uomo": "Man", "Donna": "Woman"}
+
+CORRENTI_ARTISTICHE = {
+    "Avant-Garde": "Avant-Garde",
+    "Tradizionalismo": "Traditionalism",
+    "Surrealismo": "Surrealism",
+    "Futurismo": "Futurism",
+    "Minimalismo": "Minimalism",
+    "Barocco": "Baroque",
+    "Decostruttivismo": "Deconstructivism",
+    "Pop-Art": "Pop Art",
+    "Neo-Classicismo": "Neoclassicism",
+    "Gothic": "Gothic",
+    "Post-Modernismo": "Postmodernism",
+    "Art Déco": "Art Deco",
+    "Romanticismo": "Romanticism",
+    "Tribalismo": "Tribalism",
+    "Eco-Fashion": "Eco-Fashion",
+    "Streetwear": "Streetwear",
+}
+
+COLORI = {
+    "Nero": "black",
+    "Bianco": "white",
+    "Rosso": "red",
+    "Verde": "green",
+    "Giallo": "yellow",
+    "Arancione": "orange",
+    "Blu": "blue",
+    "Rosa": "pink",
+    "Celeste": "light blue",
+    "Magenta": "magenta",
+    "Marrone": "brown",
+    "Bordeaux": "burgundy",
+    "Turchese": "turquoise",
+    "Viola": "purple",
+}
+
+GENERI_MUSICALI = {
+    "Rock": "rock",
+    "Rap": "rap",
+    "RnB": "R&B",
+    "Pop": "pop",
+    "House": "house",
+    "Techno": "techno",
+    "Metal": "metal",
+    "Jazz": "jazz",
+    "Country": "country",
+    "Blues": "blues",
+    "Classica": "classical",
+}
+
+COSA_CERCHI_NEI_CAPI = {
+    "Sicurezza": "confidence",
+    "Eleganza": "elegance",
+    "Audacia": "boldness",
+    "Originalità": "originality",
+    "Comodità": "comfort",
+    "Versatilità": "versatility",
+    "Libertà": "freedom",
+    "Seduttività": "seductiveness",
+    "Misteriosità": "mystery",
+    "Tradizionalità": "tradition",
+}
+
+# Nomi propri: restano invariati
+MARCHI = [
+    "Rick Owens", "Gucci", "Yves Saint Laurent", "Miu Miu", "Coperni",
+    "Stella McCartney", "Isabel Marant", "Junya Watanabe", "Dior",
+    "André Courrèges", "Jil Sander", "Ralph Lauren", "Bottega Veneta",
+    "Giorgio Armani", "Louis Vuitton", "Versace",
+]
+
+# Nazioni più frequenti: tradotte senza chiamare il traduttore
+NAZIONI = {
+    "italia": "Italy", "francia": "France", "germania": "Germany", "spagna": "Spain",
+    "portogallo": "Portugal", "regno unito": "United Kingdom", "inghilterra": "England",
+    "irlanda": "Ireland", "svizzera": "Switzerland", "austria": "Austria", "belgio": "Belgium",
+    "olanda": "Netherlands", "paesi bassi": "Netherlands", "grecia": "Greece", "polonia": "Poland",
+    "romania": "Romania", "albania": "Albania", "svezia": "Sweden", "norvegia": "Norway",
+    "danimarca": "Denmark", "finlandia": "Finland", "russia": "Russia", "ucraina": "Ukraine",
+    "stati uniti": "United States", "usa": "United States", "canada": "Canada",
+    "messico": "Mexico", "brasile": "Brazil", "argentina": "Argentina", "cina": "China",
+    "giappone": "Japan", "india": "India", "marocco": "Morocco", "egitto": "Egypt",
+    "australia": "Australia", "turchia": "Turkey",
+}
+
+_translation_cache = PersistentCache("traduzioni_it_en", max_entries=None)
+_memo = {}  # traduzioni già note in questo processo
+_translator_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="traduzioni")
+_pending = {}  # testo -> Future della traduzione in corso
+_pending_lock = threading.Lock()
+
+
+def _translate_online(text):
+    from deep_translator import GoogleTranslator
+    translated = GoogleTranslator(source="it", target="en").translate(text)
+    if translated:
+        _memo[text] = translated
+        _translation_cache.set(text, translated)
+    return translated
+
+
+def _translate_cached(text):
+    # Memoria del processo -> cache su disco; None = non ancora tradotto
+    translated = _memo.get(text)
+    if translated is None:
+        translated = _translation_cache.get(text)
+        if translated is not None:
+            _memo[text] = translated
+    return translated
+
+
+def translate_free_text(text):
+    """Traduce un campo libero (IT -> EN) dalla cache; se manca restituisce il testo e lo traduce in background."""
+    text = text.strip()
+    if not text:
+        return text
+    if text.lower() in NAZIONI:
+        return NAZIONI[text.lower()]
+    cached = _translate_cached(text)
+    if cached is not None:
+        return cached
+
+    # Una sola richiesta per testo anche con registrazioni contemporanee
+    with _pending_lock:
+        if text not in _pending:
+            future = _pending[text] = _translator_pool.submit(_translate_online, text)
+            future.add_done_callback(lambda done: _translation_done(text, done))
+    return text
+
+
+def _translation_done(text, future):
+    with _pending_lock:
+        _pending.pop(text, None)
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Traduzione di '{text}' non riuscita: {str(future.exception())}")
+
+
+def _join(values, table):
+    return ", ".join(table.get(v, v) if table else v for v in values)
+
+
+def _label(singular, plural, values):
+    return plural if len(values) > 1 else singular
+
+
+def build_english_description(genere, eta, nazione, professione, corrente_artistica,
+                              marchi_preferiti, generi_musicali, cerca_nei_capi, colori_preferiti):
+    """Descrizione utente in inglese (stessa struttura della versione italiana)."""
+    return (
+        f"Gender: {GENERI.get(genere, genere)}\n"
+        f"Age: {eta}\n"
+        f"Country: {translate_free_text(nazione)}\n"
+        f"Profession: {translate_free_text(professione)}\n"
+        f"Favorite art movement: {CORRENTI_ARTISTICHE.get(corrente_artistica, corrente_artistica)}\n"
+        f"Favorite {_label('brand', 'brands', marchi_preferiti)}: {_join(marchi_preferiti, None)}\n"
+        f"Favorite music {_label('genre', 'genres', generi_musicali)}: {_join(generi_musicali, GENERI_MUSICALI)}\n"
+        f"What they look for in the clothes they wear: {_join(cerca_nei_capi, COSA_CERCHI_NEI_CAPI)}\n"
+        f"Favorite {_label('color', 'colors', colori_preferiti)}: {_join(colori_preferiti, COLORI)}."
+    )